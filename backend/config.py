@@ -6,14 +6,121 @@ Allows frontend to configure backend settings without .env file
 from typing import Optional
 from pydantic import BaseModel
 
+# Named inference profiles; selecting one through inference_profile copies its values
+# into the inference_* / detector_* / model_precision fields ("custom" keeps them as set)
+INFERENCE_PROFILES = {
+    "accurate": {
+        "inference_intra_op_threads": 0,
+        "inference_inter_op_threads": 0,
+        "inference_execution_mode": "sequential",
+        "detector_input_size": 640,
+        "detector_confidence": 0.5,
+        "model_precision": "fp32",
+    },
+    "balanced": {
+        "inference_intra_op_threads": 2,
+        "inference_inter_op_threads": 1,
+        "inference_execution_mode": "sequential",
+        "detector_input_size": 480,
+        "detector_confidence": 0.6,
+        "model_precision": "fp32",
+    },
+    "low_power": {
+        "inference_intra_op_threads": 1,
+        "inference_inter_op_threads": 1,
+        "inference_execution_mode": "sequential",
+        "detector_input_size": 320,
+        "detector_confidence": 0.6,
+        "model_precision": "int8",
+    },
+}
+
+INFERENCE_PROFILE_FIELDS = list(INFERENCE_PROFILES["accurate"]) + [
+    "detector_int8_model_path",
+    "recognizer_int8_model_path",
+]
+
 class RuntimeConfig(BaseModel):
     # UART Configuration
     uart_port: str = "COM6"
     uart_baudrate: int = 115200
+    uart_reader_mode: str = "thread"  # "thread" (blocking reads) or "asyncio" (serial transport on the app loop, needs pyserial-asyncio)
+    uart_dispatch_queue_size: int = 256  # decoded messages waiting for their handler before new ones are dropped
+    uart_write_bytes_per_second: int = 0  # outgoing byte budget, 0 = wire rate (baudrate / 10)
+    uart_write_burst: int = 256  # bytes written back to back (ESP32 UART receive buffer)
+    uart_request_timeout: float = 5.0  # seconds to wait for the ESP32 to answer a command
+    uart_list_timeout: float = 10.0  # fingerprint listing scans all 127 sensor slots
+    uart_framing: str = "json"  # "json" or "binary" (length-prefixed frames with CRC, used if the ESP32 accepts the hello handshake)
     
     # Face Recognition
     face_similarity_threshold: float = 0.7
     
+    # Face quality gate: faces failing these checks are not embedded (the stream retries them on later frames)
+    face_quality_enabled: bool = True
+    face_quality_min_size: int = 48  # face width in pixels
+    face_quality_min_sharpness: float = 20.0  # variance of the Laplacian on the 64x64 face crop
+    face_quality_min_brightness: float = 40.0  # mean gray level of the face crop
+    face_quality_max_brightness: float = 220.0
+    face_quality_max_yaw: float = 0.35  # nose offset from the eye midpoint, in inter-eye distances
+    face_quality_min_score: float = 0.15  # combined score (confidence x size x sharpness x pose)
+    
+    # Enrollment: several samples per user, averaged into a centroid template
+    enrollment_min_quality: float = 0.3  # samples scoring below this are rejected
+    enrollment_max_samples: int = 10  # best samples kept per user
+    enrollment_stream_samples: int = 5  # frames captured by /register-from-stream
+    enrollment_stream_interval: float = 0.3  # seconds between captured frames
+    embedding_storage_dtype: str = "float32"  # "float32", "float16" or "int8" for newly stored embeddings
+    reembed_batch_size: int = 8  # registration images per background inference call
+    import_batch_size: int = 8  # images per inference call during bulk import
+    import_chunk_size: int = 100  # people per database transaction during bulk import
+    
+    # Registration image store (uploads/, content-addressed)
+    image_thumbnails_enabled: bool = True
+    image_thumbnail_size: int = 160  # longer side of the thumbnails in pixels
+    image_gc_grace_seconds: int = 600  # unreferenced files younger than this are kept
+    
+    # Face gallery index: "brute" (exact), "ivf" (coarse clustering) or "pq" (product quantization)
+    face_index_backend: str = "brute"
+    face_index_nprobe: int = 8  # IVF clusters scanned per query, higher = better recall, slower
+    face_index_rerank: int = 50  # PQ candidates re-scored exactly
+    face_index_path: str = "face_index.npz"  # trained quantizer, rows are re-encoded on load
+    face_index_keep_vectors: bool = True  # PQ: keep the float32 templates for re-ranking, off = uint8 codes only
+    
+    # Recognition stream: detect every N frames and follow faces with optical flow in between
+    face_tracking_enabled: bool = True
+    face_detect_interval: int = 5
+    face_track_min_quality_gain: float = 0.1  # re-embed a confirmed track only if its quality improves by 10%
+    
+    # Detect only inside the center box plus a margin (fraction of the box size)
+    face_roi_enabled: bool = True
+    face_roi_margin: float = 0.15
+    face_roi_max_side: int = 0  # downscale the ROI so its longer side fits, 0 = keep full resolution
+    
+    # Motion gate: skip face detection while the scene is static
+    motion_gate_enabled: bool = True
+    motion_gate_pixel_threshold: int = 15  # gray-level change counted as motion
+    motion_gate_min_area: float = 0.005  # fraction of changed pixels that opens the gate
+    
+    # Inference profile: onnxruntime threading, detector resolution/confidence and model precision
+    inference_profile: str = "accurate"  # key of INFERENCE_PROFILES or "custom"
+    inference_intra_op_threads: int = 0  # 0 = onnxruntime default
+    inference_inter_op_threads: int = 0
+    inference_execution_mode: str = "sequential"  # "sequential" or "parallel"
+    detector_input_size: int = 640
+    detector_confidence: float = 0.5
+    model_precision: str = "fp32"  # "fp32" or "int8" (needs the quantized models below)
+    detector_int8_model_path: str = "models/retinaface_int8.onnx"
+    recognizer_int8_model_path: str = "models/arcface_int8.onnx"
+    
+    # Inference worker pool for the face API endpoints (0 = one thread in the API process;
+    # re-embedding always runs in its own low-priority process)
+    inference_workers: int = 2
+    inference_queue_depth: int = 8  # queued + running requests before answering 503
+    
+    # Video streaming
+    video_stream_mode: str = "async"  # "async" (awaits on the event loop) or "thread" (one threadpool worker per viewer)
+    video_stream_max_clients: int = 64  # open viewers per stream endpoint
+    
     # API Configuration  
     api_host: str = "0.0.0.0"
     api_port: int = 8000
@@ -28,11 +135,22 @@ class ConfigManager:
     
     def update_config(self, **kwargs):
         """Update configuration"""
+        profile = kwargs.get("inference_profile")
+        if profile in INFERENCE_PROFILES:
+            # Preset values first, explicit fields in the same update still win
+            kwargs = {**INFERENCE_PROFILES[profile], **kwargs}
+        elif profile is None and any(key in INFERENCE_PROFILE_FIELDS for key in kwargs):
+            kwargs = {**kwargs, "inference_profile": "custom"}
+        
         for key, value in kwargs.items():
             if hasattr(self._config, key):
                 setattr(self._config, key, value)
                 print(f"✓ Updated config: {key} = {value}")
     
+    def get_inference_profile(self) -> dict:
+        """Current inference settings as a plain dict (picklable for worker processes)"""
+        return {key: getattr(self._config, key) for key in INFERENCE_PROFILE_FIELDS}
+    
     def get(self, key: str, default=None):
         """Get a specific config value"""
         return getattr(self._config, key, default)
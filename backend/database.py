@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -19,3 +19,29 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def add_missing_columns():
+    """
+    create_all() only creates missing tables; columns added to existing models are
+    added here with ALTER TABLE so older databases keep working
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT '{column.server_default.arg}'"
+                conn.execute(text(ddl))
+                print(f"Added column {table.name}.{column.name}")
+                # create_all() skips the indexes of existing tables too (index=True -> ix_<table>_<column>)
+                for index in table.indexes:
+                    if column.name in index.columns:
+                        columns = ", ".join(indexed.name for indexed in index.columns)
+                        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index.name} ON {table.name} ({columns})"))
+                        print(f"Created index {index.name}")
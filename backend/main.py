@@ -1,11 +1,16 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from database import Base, engine
+import asyncio
+from database import Base, engine, add_missing_columns
 from routers import state, face, fingerprint, keypad, logs, config, video, user
 from services.uart import uart_service
+from services.uart_dispatcher import message_dispatcher
 from services.state_manager import state_manager
 from services.websocket import websocket_manager
+from services.inference_pool import inference_pool
+from services.uniface import uniface_service
+from services.reembed import reembed_job
 from models import AccessLog, AccessMethod, AccessType
 from database import SessionLocal
 
@@ -13,6 +18,7 @@ from database import SessionLocal
 async def lifespan(app: FastAPI):
 
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
     print("Database tables created")
     
     from models import KeypadPassword
@@ -32,28 +38,23 @@ async def lifespan(app: FastAPI):
         db.close()
     
     print("Waiting for UART configuration from Frontend...")
-
-    # Initialize Camera Service and Face Stream globally
-    from services.face_stream import face_recognition_stream
+    
+    # Models and camera start in the background so the API answers right away;
+    # /health reports their progress and face endpoints return 503 until ready
     from services.camera import camera_service
     
-    print("Initializing Camera Service...")
-    try:
-        # Warm up camera
-        camera_service.get_frame()
-        # Start face recognition stream (it runs its own loop if generated, but we just ensures it's ready)
-        # Actually generate_frames_with_recognition is a generator.
-        # If we want it to run always, we might need a separate thread consuming it or different design.
-        # But User request: "mới chạy?? đúng nguyên tắc là nó phải khởi tạo sớm hơn".
-        # Initializing `CameraService` (opening camera) here handles the "slow start".
-        print("Camera initialized.")
-    except Exception as e:
-        print(f"Failed to initialize camera: {e}")
+    # Serial handlers and background jobs broadcast from their threads through this loop
+    websocket_manager.bind_loop(asyncio.get_running_loop())
+    uniface_service.start_loading()
+    inference_pool.start()
+    camera_service.start()
     
     yield
     
     print("Shutting down Smart Lock Backend...")
     uart_service.disconnect()
+    message_dispatcher.stop()
+    inference_pool.shutdown()
 
 app = FastAPI(
     title="Smart Lock API",
@@ -97,9 +98,13 @@ async def health():
     return {
         "status": "healthy",
         "uart_connected": uart_service.serial_conn is not None and uart_service.serial_conn.is_open,
+        "uart": uart_service.get_stats(),
         "mode": state_manager.mode.value,
         "door_status": state_manager.door_status.value,
-        "websocket_clients": len(websocket_manager.active_connections)
+        "websocket_clients": len(websocket_manager.active_connections),
+        "models": uniface_service.get_status(),
+        "inference": inference_pool.get_stats(),
+        "reembed": reembed_job.get_status()
     }
 
 @app.websocket("/ws")
@@ -1,7 +1,7 @@
 from models.user import User
 from models.fingerprint import Fingerprint
-from models.face import Face
+from models.face import Face, FaceKind
 from models.keypad import KeypadPassword
 from models.access_log import AccessLog, AccessMethod, AccessType
 
-__all__ = ["User", "Fingerprint", "Face", "KeypadPassword", "AccessLog", "AccessMethod", "AccessType"]
+__all__ = ["User", "Fingerprint", "Face", "FaceKind", "KeypadPassword", "AccessLog", "AccessMethod", "AccessType"]
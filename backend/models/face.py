@@ -1,15 +1,26 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, LargeBinary
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, LargeBinary, Float
 from sqlalchemy.orm import relationship
 from database import Base
 from utils.time_utils import vietnam_now
 
+class FaceKind:
+    SAMPLE = "sample"  # embedding of one enrollment image
+    CENTROID = "centroid"  # normalized mean of the user's samples, matched first
+
 class Face(Base):
     __tablename__ = "faces"
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    face_embedding = Column(LargeBinary, nullable=False)  # Numpy array stored as bytes
+    face_embedding = Column(LargeBinary, nullable=False)  # services.embedding_codec format (legacy rows: raw float32)
     image_path = Column(String, nullable=True) # Path to the registered image
+    kind = Column(String, nullable=False, default=FaceKind.SAMPLE, server_default=FaceKind.SAMPLE)
+    quality = Column(Float, nullable=True)  # enrollment quality score in [0, 1], None for centroids/legacy rows
+    model_version = Column(String, nullable=True, index=True)  # recognizer that produced the embedding, None = legacy
+    # Re-embedding job output, swapped into the columns above once every image is done
+    staged_embedding = Column(LargeBinary, nullable=True)
+    staged_quality = Column(Float, nullable=True)
+    staged_model_version = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), default=vietnam_now)
     updated_at = Column(DateTime(timezone=True), onupdate=vietnam_now)
 
@@ -1,8 +1,15 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
-from config import config_manager
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Literal
+from config import config_manager, INFERENCE_PROFILES, INFERENCE_PROFILE_FIELDS
 from services.uart import uart_service
 from services.message_handler import handle_esp32_message
+from services.uart_dispatcher import message_dispatcher
+from services.face_gallery import face_gallery
+from services.inference_pool import inference_pool
+from services.uniface import uniface_service
+from services.inference_benchmark import load_benchmark_images, run_benchmark
 from database import DATABASE_URL
 
 router = APIRouter(prefix="/api/config", tags=["Configuration"])
@@ -10,24 +17,143 @@ router = APIRouter(prefix="/api/config", tags=["Configuration"])
 class UpdateConfigRequest(BaseModel):
     uart_port: str | None = None
     uart_baudrate: int | None = None
+    uart_reader_mode: Literal["thread", "asyncio"] | None = None
+    uart_dispatch_queue_size: int | None = Field(default=None, ge=1)
+    uart_write_bytes_per_second: int | None = Field(default=None, ge=0)
+    uart_write_burst: int | None = Field(default=None, ge=1)
+    uart_request_timeout: float | None = Field(default=None, gt=0)
+    uart_list_timeout: float | None = Field(default=None, gt=0)
+    uart_framing: Literal["json", "binary"] | None = None
     face_similarity_threshold: float | None = None
+    face_quality_enabled: bool | None = None
+    face_quality_min_size: int | None = Field(default=None, ge=0)
+    face_quality_min_sharpness: float | None = Field(default=None, ge=0)
+    face_quality_min_brightness: float | None = Field(default=None, ge=0, le=255)
+    face_quality_max_brightness: float | None = Field(default=None, ge=0, le=255)
+    face_quality_max_yaw: float | None = Field(default=None, gt=0)
+    face_quality_min_score: float | None = Field(default=None, ge=0, le=1)
+    enrollment_min_quality: float | None = Field(default=None, ge=0, le=1)
+    enrollment_max_samples: int | None = Field(default=None, ge=1)
+    enrollment_stream_samples: int | None = Field(default=None, ge=1)
+    enrollment_stream_interval: float | None = Field(default=None, ge=0)
+    embedding_storage_dtype: Literal["float32", "float16", "int8"] | None = None
+    reembed_batch_size: int | None = Field(default=None, ge=1)
+    import_batch_size: int | None = Field(default=None, ge=1)
+    import_chunk_size: int | None = Field(default=None, ge=1)
+    image_thumbnails_enabled: bool | None = None
+    image_thumbnail_size: int | None = Field(default=None, ge=16)
+    image_gc_grace_seconds: int | None = Field(default=None, ge=0)
+    face_index_backend: Literal["brute", "ivf", "pq"] | None = None
+    face_index_nprobe: int | None = Field(default=None, ge=1)
+    face_index_rerank: int | None = Field(default=None, ge=0)
+    face_index_keep_vectors: bool | None = None
+    face_tracking_enabled: bool | None = None
+    face_detect_interval: int | None = Field(default=None, ge=1)
+    face_track_min_quality_gain: float | None = Field(default=None, ge=0, le=1)
+    face_roi_enabled: bool | None = None
+    face_roi_margin: float | None = Field(default=None, ge=0)
+    face_roi_max_side: int | None = Field(default=None, ge=0)
+    motion_gate_enabled: bool | None = None
+    motion_gate_pixel_threshold: int | None = Field(default=None, ge=0, le=255)
+    motion_gate_min_area: float | None = Field(default=None, ge=0, le=1)
+    inference_profile: Literal["accurate", "balanced", "low_power", "custom"] | None = None
+    inference_intra_op_threads: int | None = Field(default=None, ge=0)
+    inference_inter_op_threads: int | None = Field(default=None, ge=0)
+    inference_execution_mode: Literal["sequential", "parallel"] | None = None
+    detector_input_size: int | None = Field(default=None, ge=160)
+    detector_confidence: float | None = Field(default=None, gt=0, lt=1)
+    model_precision: Literal["fp32", "int8"] | None = None
+    detector_int8_model_path: str | None = None
+    recognizer_int8_model_path: str | None = None
+    inference_workers: int | None = Field(default=None, ge=0)
+    inference_queue_depth: int | None = Field(default=None, ge=1)
+    video_stream_mode: Literal["async", "thread"] | None = None
+    video_stream_max_clients: int | None = Field(default=None, ge=1)
 
-@router.get("")
-async def get_config():
-    config = config_manager.get_config()
+class BenchmarkRequest(BaseModel):
+    profiles: List[Literal["accurate", "balanced", "low_power"]] | None = None
+    max_images: int = Field(default=20, ge=1, le=200)
+
+def _serialize_config(config) -> dict:
     return {
         "uart_port": config.uart_port,
         "uart_baudrate": config.uart_baudrate,
+        "uart_reader_mode": config.uart_reader_mode,
+        "uart_dispatch_queue_size": config.uart_dispatch_queue_size,
+        "uart_write_bytes_per_second": config.uart_write_bytes_per_second,
+        "uart_write_burst": config.uart_write_burst,
+        "uart_request_timeout": config.uart_request_timeout,
+        "uart_list_timeout": config.uart_list_timeout,
+        "uart_framing": config.uart_framing,
         "face_similarity_threshold": config.face_similarity_threshold,
+        "face_quality_enabled": config.face_quality_enabled,
+        "face_quality_min_size": config.face_quality_min_size,
+        "face_quality_min_sharpness": config.face_quality_min_sharpness,
+        "face_quality_min_brightness": config.face_quality_min_brightness,
+        "face_quality_max_brightness": config.face_quality_max_brightness,
+        "face_quality_max_yaw": config.face_quality_max_yaw,
+        "face_quality_min_score": config.face_quality_min_score,
+        "enrollment_min_quality": config.enrollment_min_quality,
+        "enrollment_max_samples": config.enrollment_max_samples,
+        "enrollment_stream_samples": config.enrollment_stream_samples,
+        "enrollment_stream_interval": config.enrollment_stream_interval,
+        "embedding_storage_dtype": config.embedding_storage_dtype,
+        "reembed_batch_size": config.reembed_batch_size,
+        "import_batch_size": config.import_batch_size,
+        "import_chunk_size": config.import_chunk_size,
+        "image_thumbnails_enabled": config.image_thumbnails_enabled,
+        "image_thumbnail_size": config.image_thumbnail_size,
+        "image_gc_grace_seconds": config.image_gc_grace_seconds,
+        "face_index_backend": config.face_index_backend,
+        "face_index_nprobe": config.face_index_nprobe,
+        "face_index_rerank": config.face_index_rerank,
+        "face_index_keep_vectors": config.face_index_keep_vectors,
+        "face_tracking_enabled": config.face_tracking_enabled,
+        "face_detect_interval": config.face_detect_interval,
+        "face_track_min_quality_gain": config.face_track_min_quality_gain,
+        "face_roi_enabled": config.face_roi_enabled,
+        "face_roi_margin": config.face_roi_margin,
+        "face_roi_max_side": config.face_roi_max_side,
+        "motion_gate_enabled": config.motion_gate_enabled,
+        "motion_gate_pixel_threshold": config.motion_gate_pixel_threshold,
+        "motion_gate_min_area": config.motion_gate_min_area,
+        "inference_profile": config.inference_profile,
+        "inference_intra_op_threads": config.inference_intra_op_threads,
+        "inference_inter_op_threads": config.inference_inter_op_threads,
+        "inference_execution_mode": config.inference_execution_mode,
+        "detector_input_size": config.detector_input_size,
+        "detector_confidence": config.detector_confidence,
+        "model_precision": config.model_precision,
+        "detector_int8_model_path": config.detector_int8_model_path,
+        "recognizer_int8_model_path": config.recognizer_int8_model_path,
+        "inference_workers": config.inference_workers,
+        "inference_queue_depth": config.inference_queue_depth,
+        "video_stream_mode": config.video_stream_mode,
+        "video_stream_max_clients": config.video_stream_max_clients,
         "database_url": DATABASE_URL
     }
 
+@router.get("")
+async def get_config():
+    return _serialize_config(config_manager.get_config())
+
 @router.post("/update")
 async def update_config(request: UpdateConfigRequest):
     updates = request.model_dump(exclude_none=True)
     config_manager.update_config(**updates)
     
-    if request.uart_port or request.uart_baudrate:
+    if request.face_index_backend or request.face_index_keep_vectors is not None:
+        # Rebuild (or load the persisted) index on the next match
+        face_gallery.invalidate()
+    
+    if "inference_profile" in updates or any(key in updates for key in INFERENCE_PROFILE_FIELDS):
+        # Stream keeps using the current models until the new ones are loaded
+        uniface_service.reload(config_manager.get_inference_profile())
+        inference_pool.restart()
+    elif request.inference_workers is not None:
+        inference_pool.restart()
+    
+    if request.uart_port or request.uart_baudrate or request.uart_reader_mode or request.uart_framing:
         print("UART Config changed, reconnecting...")
         uart_service.disconnect()
         
@@ -39,21 +165,39 @@ async def update_config(request: UpdateConfigRequest):
             return {
                 "success": False,
                 "message": "Đã lưu cấu hình nhưng không thể kết nối UART",
-                "config": {
-                    "uart_port": current_config.uart_port,
-                    "uart_baudrate": current_config.uart_baudrate,
-                    "face_similarity_threshold": current_config.face_similarity_threshold,
-                    "database_url": DATABASE_URL
-                }
+                "config": _serialize_config(current_config)
             }
+    elif request.uart_write_bytes_per_second is not None or request.uart_write_burst is not None:
+        uart_service.configure_writer()
+    
+    if request.uart_dispatch_queue_size is not None:
+        # The queue is sized when the dispatcher starts; queued messages are handled first
+        message_dispatcher.restart()
             
     return {
         "success": True,
         "message": "Đã cập nhật cấu hình và kết nối UART",
-        "config": {
-            "uart_port": config_manager.get_config().uart_port,
-            "uart_baudrate": config_manager.get_config().uart_baudrate,
-            "face_similarity_threshold": config_manager.get_config().face_similarity_threshold,
-            "database_url": DATABASE_URL
-        }
+        "config": _serialize_config(config_manager.get_config())
+    }
+
+@router.get("/inference/profiles")
+async def get_inference_profiles():
+    return {
+        "current": config_manager.get("inference_profile"),
+        "profiles": INFERENCE_PROFILES,
+        "models": uniface_service.get_status()
     }
+
+@router.post("/inference/benchmark")
+async def benchmark_inference(request: BenchmarkRequest):
+    """Compare latency and accuracy of the inference profiles on the registered face images"""
+    samples = await run_in_threadpool(load_benchmark_images, request.max_images)
+    if not samples:
+        raise HTTPException(status_code=400, detail="Chưa có ảnh khuôn mặt đã đăng ký để chạy benchmark")
+    
+    try:
+        results = await run_in_threadpool(run_benchmark, samples, request.profiles)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi benchmark: {str(e)}")
+    
+    return {"success": True, "images": len(samples), "results": results}
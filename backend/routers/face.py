@@ -1,102 +1,159 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from database import get_db
-from models import User, Face, AccessLog, AccessMethod, AccessType
-from schemas.user import UserResponse, FaceVerifyResponse
-from services.uniface import uniface_service
+from models import User, Face, FaceKind, AccessLog, AccessMethod, AccessType
+from schemas.user import UserResponse, FaceEnrollResponse, FaceVerifyResponse
+from config import config_manager
+from services.face_gallery import face_gallery
+from services.inference_pool import inference_pool, InferencePoolBusy
 from services.state_manager import state_manager
 from services.uart import uart_service
 from services.camera import camera_service
-import numpy as np
-from typing import List
+from services.face_enrollment import save_samples
+from services.image_store import image_store
+from services.face_import import ImportBatchError, import_faces, items_from_manifest, items_from_zip
+from services.reembed import reembed_job
+from typing import List, Literal, Optional
+import cv2
 import os
-import uuid
-from datetime import datetime
+
+def require_face_models():
+    if not inference_pool.is_ready():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Mô hình nhận diện khuôn mặt chưa sẵn sàng ({inference_pool.status})"
+        )
 
 router = APIRouter(prefix="/api/face", tags=["Face Recognition"])
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+async def run_inference(method, image):
+    try:
+        return await method(image)
+    except InferencePoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Hệ thống nhận diện đang quá tải, vui lòng thử lại"
+        )
 
-def save_uploaded_image(image: UploadFile, user_name: str) -> str:
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_extension = os.path.splitext(image.filename)[1] or ".jpg"
-    filename = f"{user_name}_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
+def enroll_samples(db: Session, user: User, candidates, append: bool) -> FaceEnrollResponse:
+    """
+    Store the candidates (image_path, sample) whose quality passes enrollment_min_quality.
+    `sample` is the (embedding, quality) from the inference pool, or None if no face was found.
+    """
+    min_quality = config_manager.get("enrollment_min_quality", 0.3)
+    accepted = [(image_path, sample) for image_path, sample in candidates
+                if sample is not None and sample[1] >= min_quality]
+    rejected = len(candidates) - len(accepted)
+    if rejected:
+        # Rejected uploads are already stored
+        image_store.schedule_gc()
+    
+    if not accepted:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Không phát hiện khuôn mặt đạt chất lượng trong ảnh"
+        )
     
-    with open(filepath, "wb") as f:
-        f.write(image.file.read())
+    samples = [(embedding, float(quality), image_path) for image_path, (embedding, quality) in accepted]
+    total = save_samples(db, user, samples, append=append)
+    db.refresh(user)
+    face_gallery.invalidate()
     
-    return filepath
+    uart_service.set_led("green")
+    uart_service.beep(2)
+    
+    return FaceEnrollResponse(
+        id=user.id,
+        name=user.name,
+        created_at=user.created_at,
+        has_face=True,
+        samples_accepted=len(accepted),
+        samples_rejected=rejected,
+        samples_total=total,
+        qualities=[round(float(sample[1]), 3) for _, sample in accepted]
+    )
 
-@router.post("/register", response_model=UserResponse)
+def get_user_or_404(db: Session, user_id: int) -> User:
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Người dùng không tồn tại"
+        )
+    return user
+
+@router.post("/register", response_model=FaceEnrollResponse, dependencies=[Depends(require_face_models)])
 async def register_face(
     user_id: int = Form(...),
-    image: UploadFile = File(...),
+    image: Optional[UploadFile] = File(None),
+    images: Optional[List[UploadFile]] = File(None),
+    append: bool = Form(False),
     db: Session = Depends(get_db)
 ):
+    """Enroll one or more images; each is quality scored and the user's centroid template is rebuilt"""
+    uploads = ([image] if image is not None else []) + list(images or [])
+    if not uploads:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Vui lòng gửi ít nhất một ảnh"
+        )
+    
     # Tự động chuyển sang chế độ đăng ký
     state_manager.set_registration_mode()
     
     try:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Người dùng không tồn tại"
-            )
-
-        # Check existing face (One Face Per User)
-        existing_face = db.query(Face).filter(Face.user_id == user.id).first()
-        if existing_face:
-            # Delete old image/record to allow overwrite
-            if existing_face.image_path and os.path.exists(existing_face.image_path):
-                try:
-                    os.remove(existing_face.image_path)
-                except:
-                    pass
-            db.delete(existing_face)
-            db.commit()
-
-        image_bytes = await image.read()
+        user = get_user_or_404(db, user_id)
         
-        image.file.seek(0)  
-        image_path = save_uploaded_image(image, user.name)
+        stored = [await image_store.put_upload(upload) for upload in uploads]
+        # All uploads go through one inference call, recognized as a batch
+        samples = await run_inference(inference_pool.extract_samples, [image_bytes for _, image_bytes in stored])
+        candidates = [(image_path, sample) for (image_path, _), sample in zip(stored, samples)]
+        
+        return enroll_samples(db, user, candidates, append)
+    finally:
+        state_manager.set_entry_exit_mode()
 
+@router.post("/register-from-stream", response_model=FaceEnrollResponse, dependencies=[Depends(require_face_models)])
+async def register_face_from_stream(
+    user_id: int = Form(...),
+    samples: Optional[int] = Form(None),
+    append: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    """Enroll a short burst of camera frames"""
+    state_manager.set_registration_mode()
+    
+    try:
+        user = get_user_or_404(db, user_id)
         
-        embedding = uniface_service.extract_embedding(image_bytes)
+        count = samples or config_manager.get("enrollment_stream_samples", 5)
+        count = max(1, min(count, config_manager.get("enrollment_max_samples", 10)))
+        interval = config_manager.get("enrollment_stream_interval", 0.3)
+        frames = await run_in_threadpool(camera_service.capture_burst, count, interval)
         
-        if embedding is None:
-            if os.path.exists(image_path):
-                os.remove(image_path)
+        if not frames:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Không phát hiện khuôn mặt trong ảnh"
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Không thể truy cập camera backend"
             )
         
-        # Add face to user
-        face = Face(
-            user_id=user.id,
-            face_embedding=embedding.tobytes(),
-            image_path=image_path
-        )
-        db.add(face)
-        db.commit()
-        db.refresh(user) 
+        # Frames are encoded once: the JPEG is both stored and sent, as one batch, to the pool
+        encoded = await run_in_threadpool(lambda: [cv2.imencode('.jpg', frame) for frame in frames])
+        images = [buffer.tobytes() for ret, buffer in encoded if ret]
+        samples = await run_inference(inference_pool.extract_samples, images)
         
-        uart_service.set_led("green")
-        uart_service.beep(2)
+        candidates = []
+        for image_bytes, sample in zip(images, samples):
+            image_path = await image_store.put_async(image_bytes, "frame.jpg") if sample is not None else None
+            candidates.append((image_path, sample if image_path is not None else None))
         
-        return UserResponse(
-            id=user.id,
-            name=user.name,
-            created_at=user.created_at,
-            has_face=True
-        )
+        return enroll_samples(db, user, candidates, append)
     finally:
         state_manager.set_entry_exit_mode()
 
-@router.post("/verify", response_model=FaceVerifyResponse)
+@router.post("/verify", response_model=FaceVerifyResponse, dependencies=[Depends(require_face_models)])
 async def verify_face(
     image: UploadFile = File(...),
     db: Session = Depends(get_db)
@@ -110,9 +167,9 @@ async def verify_face(
     
     image_bytes = await image.read()
     
-    new_embedding = uniface_service.extract_embedding(image_bytes)
+    new_embeddings = await run_inference(inference_pool.extract_embeddings, image_bytes)
     
-    if new_embedding is None:
+    if new_embeddings is None:
         log = AccessLog(
             user_name=None,
             access_method=AccessMethod.FACE,
@@ -133,9 +190,7 @@ async def verify_face(
             message="Không phát hiện khuôn mặt"
         )
     
-    faces = db.query(Face).all()
-    
-    if not faces:
+    if await run_in_threadpool(face_gallery.size) == 0:
         log = AccessLog(
             user_name=None,
             access_method=AccessMethod.FACE,
@@ -156,24 +211,14 @@ async def verify_face(
             message="Chưa có người dùng nào đăng ký"
         )
     
-    best_match_face = None
-    best_similarity = 0.0
-    
-    for face in faces:
-        stored_embedding = np.frombuffer(face.face_embedding, dtype=np.float32)
-        similarity = uniface_service.compare_faces(new_embedding, stored_embedding)
-        
-        if similarity > best_similarity:
-            best_similarity = similarity
-            best_match_face = face
+    # Every face in the picture is matched in one batch; the best match decides
+    matches = await run_in_threadpool(face_gallery.match_batch, new_embeddings)
+    match_name, _, best_similarity = max(matches, key=lambda match: match[2])
     
-    threshold = 0.7
-    if best_similarity >= threshold:
-        # Get user from face
-        user = best_match_face.user
-        
+    threshold = config_manager.get("face_similarity_threshold", 0.7)
+    if best_similarity >= threshold and match_name:
         log = AccessLog(
-            user_name=user.name,
+            user_name=match_name,
             access_method=AccessMethod.FACE,
             access_type=AccessType.ENTRY,
             success=True,
@@ -188,9 +233,9 @@ async def verify_face(
         
         return FaceVerifyResponse(
             success=True,
-            user_name=user.name,
+            user_name=match_name,
             similarity=best_similarity,
-            message=f"Chào mừng {user.name}!"
+            message=f"Chào mừng {match_name}!"
         )
     else:
         log = AccessLog(
@@ -228,7 +273,7 @@ async def get_users(db: Session = Depends(get_db)):
         for user in users
     ]
 
-@router.post("/verify-from-stream", response_model=FaceVerifyResponse)
+@router.post("/verify-from-stream", response_model=FaceVerifyResponse, dependencies=[Depends(require_face_models)])
 async def verify_face_from_stream(db: Session = Depends(get_db)):
     
     if not state_manager.is_entry_exit_mode():
@@ -237,9 +282,10 @@ async def verify_face_from_stream(db: Session = Depends(get_db)):
             detail="Chỉ có thể xác thực trong chế độ Entry/Exit"
         )
     
-    frame_bytes = camera_service.get_frame()
+    # Raw BGR frame straight from the capture thread, no JPEG encode/decode
+    frame = await run_in_threadpool(camera_service.get_raw_frame)
     
-    if frame_bytes is None:
+    if frame is None:
         uart_service.set_led("red")
         uart_service.beep(1)
         
@@ -250,9 +296,9 @@ async def verify_face_from_stream(db: Session = Depends(get_db)):
             message="Không thể truy cập camera backend"
         )
     
-    new_embedding = uniface_service.extract_embedding(frame_bytes)
+    new_embeddings = await run_inference(inference_pool.extract_embeddings_from_array, frame)
     
-    if new_embedding is None:
+    if new_embeddings is None:
         log = AccessLog(
             user_name=None,
             access_method=AccessMethod.FACE,
@@ -273,9 +319,7 @@ async def verify_face_from_stream(db: Session = Depends(get_db)):
             message="Không phát hiện khuôn mặt"
         )
     
-    faces = db.query(Face).all()
-    
-    if not faces:
+    if await run_in_threadpool(face_gallery.size) == 0:
         log = AccessLog(
             user_name=None,
             access_method=AccessMethod.FACE,
@@ -296,22 +340,14 @@ async def verify_face_from_stream(db: Session = Depends(get_db)):
             message="Chưa có người dùng nào đăng ký"
         )
     
-    best_match_face = None
-    best_similarity = 0.0
-    
-    for face in faces:
-        stored_embedding = np.frombuffer(face.face_embedding, dtype=np.float32)
-        similarity = uniface_service.compare_faces(new_embedding, stored_embedding)
-        
-        if similarity > best_similarity:
-            best_similarity = similarity
-            best_match_face = face
+    # Every face in the picture is matched in one batch; the best match decides
+    matches = await run_in_threadpool(face_gallery.match_batch, new_embeddings)
+    match_name, _, best_similarity = max(matches, key=lambda match: match[2])
     
-    threshold = 0.7
-    if best_similarity >= threshold:
-        user = best_match_face.user
+    threshold = config_manager.get("face_similarity_threshold", 0.7)
+    if best_similarity >= threshold and match_name:
         log = AccessLog(
-            user_name=user.name,
+            user_name=match_name,
             access_method=AccessMethod.FACE,
             access_type=AccessType.ENTRY,
             success=True,
@@ -326,9 +362,9 @@ async def verify_face_from_stream(db: Session = Depends(get_db)):
         
         return FaceVerifyResponse(
             success=True,
-            user_name=user.name,
+            user_name=match_name,
             similarity=best_similarity,
-            message=f"Chào mừng {user.name}!"
+            message=f"Chào mừng {match_name}!"
         )
     else:
         log = AccessLog(
@@ -351,6 +387,94 @@ async def verify_face_from_stream(db: Session = Depends(get_db)):
             message="Khuôn mặt không khớp"
         )
 
+@router.post("/import", dependencies=[Depends(require_face_models)])
+async def import_faces_batch(
+    archive: Optional[UploadFile] = File(None),
+    manifest: Optional[str] = Form(None),
+    files: Optional[List[UploadFile]] = File(None),
+    on_existing: Literal["skip", "append", "replace"] = Form("skip")
+):
+    """
+    Bulk enrollment from a ZIP (one folder per person, or Name.jpg per person) or from
+    multipart files plus a JSON manifest [{"name": ..., "images": [filename, ...]}]
+    """
+    try:
+        if archive is not None:
+            items = items_from_zip(archive.file)
+        elif manifest is not None:
+            items = items_from_manifest(manifest, files or [])
+        else:
+            raise ImportBatchError("Vui lòng gửi file ZIP hoặc manifest kèm ảnh")
+    except ImportBatchError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if not items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Không tìm thấy ảnh nào để nhập"
+        )
+    
+    report = await import_faces(items, on_existing)
+    return {"success": report["failed"] == 0, **report}
+
+@router.get("/users/{user_id}/samples")
+async def get_face_samples(user_id: int, db: Session = Depends(get_db)):
+    user = get_user_or_404(db, user_id)
+    faces = db.query(Face).filter(Face.user_id == user.id, Face.kind == FaceKind.SAMPLE).order_by(Face.id).all()
+    return [
+        {
+            "id": face.id,
+            "quality": face.quality,
+            "model_version": face.model_version,
+            "created_at": face.created_at,
+            "image_url": f"/api/face/images/{face.id}",
+            "thumbnail_url": f"/api/face/images/{face.id}?thumbnail=true"
+        }
+        for face in faces
+    ]
+
+@router.get("/images/{face_id}")
+async def get_face_image(face_id: int, thumbnail: bool = False, db: Session = Depends(get_db)):
+    face = db.query(Face).filter(Face.id == face_id).first()
+    path = face.image_path if face else None
+    if path and thumbnail:
+        path = await run_in_threadpool(image_store.thumbnail, path)
+    if not path or not os.path.exists(path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Không tìm thấy ảnh"
+        )
+    return FileResponse(path)
+
+@router.post("/images/gc")
+async def collect_image_garbage():
+    """Remove stored images (and thumbnails) that no face references anymore"""
+    result = await run_in_threadpool(image_store.collect_garbage)
+    return {"success": True, **result}
+
+@router.get("/reembed")
+async def get_reembed_status():
+    return reembed_job.get_status()
+
+@router.post("/reembed", dependencies=[Depends(require_face_models)])
+async def start_reembed(force: bool = False):
+    """Re-embed stored registration images; force=True re-embeds every sample, not only stale ones"""
+    if not reembed_job.schedule(force=force, automatic=False):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Tác vụ tạo lại embedding đang chạy"
+        )
+    return {"success": True, "message": "Đã bắt đầu tạo lại embedding", "status": reembed_job.get_status()}
+
+@router.post("/reembed/cancel")
+async def cancel_reembed():
+    if not reembed_job.cancel():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Không có tác vụ tạo lại embedding nào đang chạy"
+        )
+    return {"success": True, "message": "Đã dừng, lần chạy sau sẽ tiếp tục từ chỗ dừng"}
+
 @router.delete("/{user_id}")
 async def delete_user(user_id: int, db: Session = Depends(get_db)):
     # This logic seems redundant if user.py handles user deletion.
@@ -372,5 +496,6 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
     
     db.delete(user)
     db.commit()
+    face_gallery.invalidate()
     
     return {"success": True, "message": f"Đã xóa người dùng {user.name}"}
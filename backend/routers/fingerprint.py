@@ -1,12 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from typing import Optional
+from config import config_manager
 from database import get_db
 from models import Fingerprint, User, AccessLog, AccessMethod, AccessType
 from pydantic import BaseModel
 from services.state_manager import state_manager
 from services.uart import uart_service
-import services.message_handler as mh
-import asyncio
+from services.uart_requests import UARTRequestTimeout
+import json
 
 router = APIRouter(prefix="/api/fingerprint", tags=["Fingerprint"])
 
@@ -20,6 +23,15 @@ class FingerprintResponse(BaseModel):
     user_name: str
     is_active: bool
     created_at: object
+    sensor_acknowledged: Optional[bool] = None
+
+async def sensor_request(message: dict, timeout: Optional[float] = None) -> Optional[dict]:
+    """Send a command and await the sensor's answer; None if not connected or no answer in time"""
+    try:
+        return await uart_service.request(message, timeout)
+    except (ConnectionError, UARTRequestTimeout) as e:
+        print(f"ESP32 request failed: {e}")
+        return None
 
 class FingerprintVerifyRequest(BaseModel):
     fingerprint_id: int
@@ -62,20 +74,22 @@ async def enroll_fingerprint(
     db.commit()
     db.refresh(fingerprint)
     
-    uart_service.send_command({
+    uart_service.beep(2)
+    
+    # The final result arrives later over the WebSocket (enrollment_success / enrollment_failed)
+    acknowledged = await sensor_request({
         "cmd": "enroll_fingerprint",
         "id": new_id
     })
     
-    uart_service.beep(2)
-    
     return FingerprintResponse(
         id=fingerprint.id,
         fingerprint_id=fingerprint.fingerprint_id,
         user_id=fingerprint.user_id,
         user_name=user.name,
         is_active=fingerprint.is_active,
-        created_at=fingerprint.created_at
+        created_at=fingerprint.created_at,
+        sensor_acknowledged=acknowledged is not None
     )
 
 @router.post("/verify", response_model=FingerprintVerifyResponse)
@@ -147,47 +161,83 @@ async def get_fingerprints(db: Session = Depends(get_db)):
         for fp in fingerprints
     ]
 
+def start_listing():
+    try:
+        return uart_service.start_request({"cmd": "list_fingerprints"})
+    except ConnectionError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Không thể gửi lệnh đến cảm biến (Mất kết nối UART)"
+        )
+
 @router.get("/sensor-prints")
 async def get_sensor_prints():
-    # Send command to list fingerprints
-    mh.sensor_listing_complete = False
-    mh.sensor_fingerprints = []
-    
-    success = uart_service.send_command({
-        "cmd": "list_fingerprints"
-    })
-    
-    if not success:
-         raise HTTPException(
+    request = start_listing()
+    try:
+        result = await request.wait(config_manager.get("uart_list_timeout", 10.0))
+        fingerprints, complete = result["items"], True
+    except UARTRequestTimeout:
+        if not request.started:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Cảm biến không phản hồi"
+            )
+        fingerprints, complete = list(request.items), False
+    except ConnectionError:
+        raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Không thể gửi lệnh đến cảm biến (Mất kết nối UART)"
+            detail="Mất kết nối UART trong khi đọc cảm biến"
         )
+    finally:
+        uart_service.requests.discard(request)
     
-    # Wait for results (max 3 seconds)
-    for _ in range(30):
-        if mh.sensor_listing_complete:
-            break
-        await asyncio.sleep(0.1)
-        
     return {
         "success": True,
-        "message": "Lấy danh sách từ cảm biến thành công",
-        "fingerprints": mh.sensor_fingerprints,
-        "count": len(mh.sensor_fingerprints)
+        "message": "Lấy danh sách từ cảm biến thành công" if complete else "Cảm biến chưa gửi hết danh sách",
+        "fingerprints": fingerprints,
+        "count": len(fingerprints),
+        "complete": complete
     }
 
+@router.get("/sensor-prints/stream")
+async def stream_sensor_prints():
+    """Newline-delimited JSON: one {"fingerprint_id": n} per slot as the sensor reports it, then a summary"""
+    request = start_listing()
+    
+    async def generate():
+        try:
+            async for kind, value in request.stream(config_manager.get("uart_list_timeout", 10.0)):
+                if kind == "item":
+                    yield json.dumps({"fingerprint_id": value}) + "\n"
+                else:
+                    yield json.dumps({"complete": True, "count": len(value["items"])}) + "\n"
+        except (UARTRequestTimeout, ConnectionError):
+            yield json.dumps({"complete": False, "count": len(request.items)}) + "\n"
+        finally:
+            uart_service.requests.discard(request)
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 @router.delete("/clear-all")
 async def clear_all_fingerprints(db: Session = Depends(get_db)):
     deleted_count = db.query(Fingerprint).delete()
     db.commit()
     
-    uart_service.send_command({
+    result = await sensor_request({
         "cmd": "clear_all_fingerprints"
     })
+    sensor_cleared = result["ok"] if result else None
     
+    if sensor_cleared:
+        message = f"Đã xóa {deleted_count} vân tay khỏi database và cảm biến AS608"
+    elif sensor_cleared is False:
+        message = f"Đã xóa {deleted_count} vân tay khỏi database nhưng cảm biến AS608 báo lỗi khi xóa"
+    else:
+        message = f"Đã xóa {deleted_count} vân tay khỏi database, cảm biến AS608 không phản hồi"
     return {
         "success": True,
-        "message": f"Đã xóa {deleted_count} vân tay khỏi database và gửi lệnh xóa tất cả đến AS608"
+        "message": message,
+        "sensor_cleared": sensor_cleared
     }
 
 @router.delete("/{fingerprint_id}")
@@ -204,12 +254,16 @@ async def delete_fingerprint(fingerprint_id: int, db: Session = Depends(get_db))
     db.delete(fingerprint)
     db.commit()
     
-    uart_service.send_command({
+    result = await sensor_request({
         "cmd": "delete_fingerprint",
         "id": sensor_id
     })
     
-    return {"success": True, "message": f"Đã xóa vân tay ID {sensor_id}"}
+    return {
+        "success": True,
+        "message": f"Đã xóa vân tay ID {sensor_id}",
+        "sensor_deleted": result["ok"] if result else None
+    }
 
 
 @router.post("/retry/{fingerprint_id}")
@@ -230,13 +284,17 @@ async def retry_enroll_fingerprint(
             detail="Vân tay đã Active, không cần đăng ký lại"
         )
 
+    uart_service.beep(2)
+    
     # Resend command
-    uart_service.send_command({
+    acknowledged = await sensor_request({
         "cmd": "enroll_fingerprint",
         "id": fingerprint.fingerprint_id
     })
     
-    uart_service.beep(2)
-    
-    return {"success": True, "message": f"Đã gửi lại lệnh đăng ký cho ID {fingerprint.fingerprint_id}"}
+    return {
+        "success": True,
+        "message": f"Đã gửi lại lệnh đăng ký cho ID {fingerprint.fingerprint_id}",
+        "sensor_acknowledged": acknowledged is not None
+    }
 
@@ -1,14 +1,20 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
 from pydantic import BaseModel
 from datetime import datetime
+from config import config_manager
 from database import get_db
-from models import User, Face, Fingerprint
+from models import User, Face, FaceKind, Fingerprint
 from services.uart import uart_service
+from services.face_gallery import face_gallery
+from services.image_store import image_store
 
 router = APIRouter(prefix="/api/users", tags=["Users"])
 
+SENSOR_CLEANUP_TIMEOUT = 2.0  # seconds
+
 class UserListResponse(BaseModel):
     id: int
     name: str
@@ -19,6 +25,9 @@ class UserListResponse(BaseModel):
     class Config:
         from_attributes = True
 
+def count_face_samples(user: User) -> int:
+    return sum(1 for face in user.faces if face.kind != FaceKind.CENTROID)
+
 class UserCreateRequest(BaseModel):
     name: str
 
@@ -36,7 +45,7 @@ async def get_all_users(db: Session = Depends(get_db)):
             "name": user.name,
             "created_at": user.created_at,
             "fingerprints_count": len(user.fingerprints),
-            "faces_count": len(user.faces)
+            "faces_count": count_face_samples(user)
         })
         
     return result
@@ -73,13 +82,14 @@ async def update_user(user_id: int, user_data: UserUpdateRequest, db: Session =
     user.name = user_data.name
     db.commit()
     db.refresh(user)
+    face_gallery.invalidate()
     
     return UserListResponse(
         id=user.id,
         name=user.name,
         created_at=user.created_at,
         fingerprints_count=len(user.fingerprints),
-        faces_count=len(user.faces)
+        faces_count=count_face_samples(user)
     )
 
 @router.delete("/{user_id}")
@@ -92,26 +102,21 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
             detail="Không tìm thấy người dùng"
         )
     
-    # Delete fingerprints from sensor
-    for fp in user.fingerprints:
-        uart_service.send_command({
-            "cmd": "delete_fingerprint",
-            "id": fp.fingerprint_id
-        })
+    # Delete fingerprints from sensor, all requests in flight at once. Best effort with a short
+    # timeout: a silent ESP32 must not hold up the user deletion
+    timeout = min(config_manager.get("uart_request_timeout", 5.0), SENSOR_CLEANUP_TIMEOUT)
+    results = await asyncio.gather(*(
+        uart_service.request({"cmd": "delete_fingerprint", "id": fp.fingerprint_id}, timeout)
+        for fp in user.fingerprints
+    ), return_exceptions=True)
+    sensor_deleted = sum(1 for result in results if isinstance(result, dict) and result["ok"])
     
     # Database cascade delete should handle faces/fingerprints rows if configured,
     # but SQLAlchemy defaults need explicit cascade or manual delete.
-    # We will manually delete to be safe and clear files if needed.
+    # Image files may be shared with other faces; the image store GC removes unreferenced ones.
     
     # Delete faces
     for face in user.faces:
-        # Delete file if exists
-        import os
-        if face.image_path and os.path.exists(face.image_path):
-            try:
-                os.remove(face.image_path)
-            except:
-                pass
         db.delete(face)
 
     # Delete fingerprints
@@ -120,5 +125,11 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
         
     db.delete(user)
     db.commit()
+    face_gallery.invalidate()
+    image_store.schedule_gc()
     
-    return {"success": True, "message": f"Đã xóa người dùng {user.name} và toàn bộ dữ liệu liên quan"}
+    return {
+        "success": True,
+        "message": f"Đã xóa người dùng {user.name} và toàn bộ dữ liệu liên quan",
+        "sensor_fingerprints_deleted": sensor_deleted
+    }
@@ -1,17 +1,41 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, status
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from config import config_manager
 from services.camera import camera_service
 from services.face_stream import face_recognition_stream
+from services.frame_hub import FrameHub
 
 router = APIRouter(prefix="/api/video", tags=["Video Stream"])
 
+def _mjpeg_response(hub: FrameHub) -> StreamingResponse:
+    cfg = config_manager.get_config()
+    
+    # Check and count the viewer in one step, so concurrent requests cannot all pass the limit
+    slot = hub.try_reserve(cfg.video_stream_max_clients)
+    if slot is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Quá nhiều người đang xem luồng video, vui lòng thử lại sau"
+        )
+    
+    # The async mode awaits frames on the event loop, the thread mode parks a threadpool worker per viewer
+    if cfg.video_stream_mode == "async":
+        frames = hub.asubscribe(slot=slot)
+    else:
+        frames = hub.subscribe(slot=slot)
+    # The background task also frees the slot when the client leaves before the first frame
+    return StreamingResponse(
+        frames,
+        media_type="multipart/x-mixed-replace; boundary=frame",
+        background=BackgroundTask(slot.release)
+    )
+
 @router.get("/stream")
 async def video_stream():
     """Stream video thuần từ camera (không có nhận diện)"""
-    return StreamingResponse(
-        camera_service.generate_frames(),
-        media_type="multipart/x-mixed-replace; boundary=frame"
-    )
+    camera_service.start()
+    return _mjpeg_response(camera_service.hub)
 
 @router.get("/face-recognition")
 async def face_recognition_video_stream():
@@ -21,7 +45,13 @@ async def face_recognition_video_stream():
     - Chỉ nhận diện khi mặt nằm trong khung
     - Cooldown sau khi mở cửa thành công
     """
-    return StreamingResponse(
-        face_recognition_stream.generate_frames_with_recognition(),
-        media_type="multipart/x-mixed-replace; boundary=frame"
-    )
+    face_recognition_stream.start()
+    return _mjpeg_response(face_recognition_stream.hub)
+
+@router.get("/stats")
+async def video_pipeline_stats():
+    """FPS, độ trễ, số khung bị bỏ qua và số người xem của camera và pipeline nhận diện"""
+    return {
+        "camera": camera_service.get_stats(),
+        "face_recognition": face_recognition_stream.get_stats()
+    }
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -16,6 +16,12 @@ class UserResponse(UserBase):
     class Config:
         from_attributes = True
 
+class FaceEnrollResponse(UserResponse):
+    samples_accepted: int = 0
+    samples_rejected: int = 0
+    samples_total: int = 0  # samples stored for the user after this enrollment
+    qualities: List[float] = []
+
 class FaceRegisterRequest(BaseModel):
     name: str
 
@@ -1,14 +1,30 @@
 import cv2
 import time
-from typing import Generator
+import threading
+from typing import Generator, List, Optional
 
 from services.singleton import SingletonMeta
+from services.pipeline import LatestValue, StageStats
+from services.frame_hub import FrameHub
 
 class CameraService(metaclass=SingletonMeta):
+    """
+    Single producer for the camera.
+    One capture thread owns the cv2.VideoCapture; every consumer reads the newest frame from
+    `frames`, and the plain video stream is encoded once per frame and fanned out through `hub`.
+    """
+
     def __init__(self):
         self.camera = None
+        self.running = False
+        self.capture_thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self.frames = LatestValue()
+        self.hub = FrameHub("camera")
+        self.capture_stats = StageStats()
 
-    def get_raw_frame(self):
+    def _read_frame(self):
         if self.camera is None or not self.camera.isOpened():
              self.camera = cv2.VideoCapture(0, cv2.CAP_DSHOW) # Use CAP_DSHOW for faster startup on Windows if possible, or just 0
              time.sleep(0.5)
@@ -22,6 +38,52 @@ class CameraService(metaclass=SingletonMeta):
                 return None
         return frame
 
+    def _capture_loop(self):
+        while self.running:
+            frame = self._read_frame()
+            if frame is None:
+                time.sleep(1)
+                continue
+
+            self.frames.put(frame)
+            self.capture_stats.tick()
+
+            # Encode once per frame no matter how many viewers are connected
+            if self.hub.has_viewers():
+                ret, buffer = cv2.imencode('.jpg', frame)
+                if ret:
+                    self.hub.publish(buffer.tobytes())
+
+    def start(self):
+        with self._start_lock:
+            if self.running:
+                return
+            self.running = True
+            self.capture_thread = threading.Thread(target=self._capture_loop, name="camera-capture", daemon=True)
+            self.capture_thread.start()
+
+    def get_raw_frame(self, timeout: float = 2.0):
+        """Newest captured frame (shared, do not modify in place), or None if the camera is unavailable"""
+        self.start()
+        seq, frame = self.frames.peek()
+        if frame is None:
+            seq, frame = self.frames.wait_newer(seq, timeout)
+        return frame
+
+    def capture_burst(self, count: int, interval: float = 0.3, timeout: float = 2.0) -> List:
+        """Up to `count` distinct frames spaced at least `interval` seconds apart (blocking)"""
+        self.start()
+        frames = []
+        seq, _ = self.frames.peek()
+        while len(frames) < count:
+            seq, frame = self.frames.wait_newer(seq, timeout)
+            if frame is None:
+                break
+            frames.append(frame)
+            if len(frames) < count:
+                time.sleep(interval)
+        return frames
+
     def get_frame(self):
         frame = self.get_raw_frame()
         if frame is None:
@@ -30,19 +92,25 @@ class CameraService(metaclass=SingletonMeta):
         ret, buffer = cv2.imencode('.jpg', frame)
         if not ret:
             return None
-        
+
         return buffer.tobytes()
 
     def generate_frames(self) -> Generator[bytes, None, None]:
-        while True:
-            frame_bytes = self.get_frame()
-            if frame_bytes:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            else:
-                time.sleep(1)
+        self.start()
+        yield from self.hub.subscribe()
+
+    def get_stats(self) -> dict:
+        return {
+            "running": self.running,
+            "capture": self.capture_stats.snapshot(),
+            "stream": self.hub.get_stats()
+        }
 
     def release(self):
+        self.running = False
+        if self.capture_thread:
+            self.capture_thread.join(timeout=2)
+            self.capture_thread = None
         if self.camera and self.camera.isOpened():
             self.camera.release()
 
@@ -0,0 +1,84 @@
+import struct
+import numpy as np
+from typing import Optional, Sequence, Tuple
+
+# Stored embedding layout: 16-byte little-endian header followed by the values
+#   magic "FEMB" | format version u8 | dtype code u8 | dim u16 | norm f32 | scale f32
+# The values are the L2-normalized embedding in the stored dtype; `norm` restores the
+# original magnitude and `scale` dequantizes int8. Rows written before this format are
+# raw float32 bytes without a header and are still read.
+MAGIC = b"FEMB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBBHff")
+
+DTYPES = {"float32": 0, "float16": 1, "int8": 2}
+_NUMPY_DTYPES = {0: np.float32, 1: np.float16, 2: np.int8}
+
+def encode_embedding(embedding: np.ndarray, dtype: str = "float32") -> bytes:
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vector))
+    unit = vector / norm if norm > 0 else vector
+
+    scale = 1.0
+    if dtype == "int8":
+        # Symmetric quantization of the unit vector
+        peak = float(np.abs(unit).max()) if unit.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        values = np.clip(np.round(unit / scale), -127, 127).astype(np.int8)
+    else:
+        values = unit.astype(_NUMPY_DTYPES[DTYPES[dtype]])
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, DTYPES[dtype], vector.size, norm, scale)
+    return header + values.tobytes()
+
+def read_header(blob: bytes) -> Optional[Tuple[int, int, float, float]]:
+    """(dtype code, dim, norm, scale), or None for legacy raw float32 rows"""
+    if len(blob) < HEADER.size or blob[:4] != MAGIC:
+        return None
+    _, version, code, dim, norm, scale = HEADER.unpack_from(blob)
+    if version != FORMAT_VERSION or code not in _NUMPY_DTYPES:
+        raise ValueError(f"Unsupported embedding format (version {version}, dtype {code})")
+    return code, dim, norm, scale
+
+def embedding_dim(blob: bytes) -> int:
+    header = read_header(blob)
+    return len(blob) // 4 if header is None else header[1]
+
+def decode_into(blob: bytes, out: np.ndarray, normalized: bool = False):
+    """Decode one stored embedding into the float32 row `out` without intermediate arrays"""
+    header = read_header(blob)
+    if header is None:
+        out[:] = np.frombuffer(blob, dtype=np.float32)
+        if normalized:
+            norm = np.linalg.norm(out)
+            if norm > 0:
+                out /= norm
+        return
+
+    code, dim, norm, scale = header
+    values = np.frombuffer(blob, dtype=_NUMPY_DTYPES[code], count=dim, offset=HEADER.size)
+    out[:] = values
+    factor = scale if code == DTYPES["int8"] else 1.0
+    if not normalized:
+        factor *= norm
+    if factor != 1.0:
+        out *= factor
+    if normalized and code == DTYPES["int8"]:
+        # Quantization error leaves the row slightly off unit length
+        length = np.linalg.norm(out)
+        if length > 0:
+            out /= length
+
+def decode_embedding(blob: bytes, normalized: bool = False) -> np.ndarray:
+    out = np.empty(embedding_dim(blob), dtype=np.float32)
+    decode_into(blob, out, normalized)
+    return out
+
+def decode_matrix(blobs: Sequence[bytes], dim: int, normalized: bool = True) -> np.ndarray:
+    """Decode stored embeddings of dimension `dim` into one preallocated (N, dim) float32 matrix"""
+    matrix = np.empty((len(blobs), dim), dtype=np.float32)
+    for row, blob in enumerate(blobs):
+        decode_into(blob, matrix[row], normalized)
+    return matrix
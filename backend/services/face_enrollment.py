@@ -0,0 +1,95 @@
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+from sqlalchemy.orm import Session
+
+from config import config_manager
+from models import Face, FaceKind, User
+from services.embedding_codec import decode_embedding, encode_embedding
+from services.image_store import image_store
+from services.uniface import uniface_service
+
+# Quality assumed for samples registered before quality scoring existed
+LEGACY_SAMPLE_QUALITY = 0.5
+
+def compute_centroid(embeddings: Sequence[np.ndarray], weights: Optional[Sequence[float]] = None) -> np.ndarray:
+    """Quality-weighted mean of the L2-normalized embeddings, normalized again"""
+    matrix = np.vstack([np.asarray(e, dtype=np.float32).reshape(-1) for e in embeddings])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+
+    weights = np.ones(len(matrix), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+    if weights.sum() <= 0:
+        weights = np.ones(len(matrix), dtype=np.float32)
+    centroid = (matrix * weights[:, None]).sum(axis=0)
+    norm = np.linalg.norm(centroid)
+    return (centroid / norm if norm > 0 else centroid).astype(np.float32)
+
+def encode_for_storage(embedding: np.ndarray) -> bytes:
+    return encode_embedding(embedding, config_manager.get("embedding_storage_dtype", "float32"))
+
+def _sample_quality(face: Face) -> float:
+    return face.quality if face.quality is not None else LEGACY_SAMPLE_QUALITY
+
+def rebuild_centroid(db: Session, user: User) -> int:
+    """
+    Keep the user's best enrollment_max_samples samples and replace their centroid row.
+    Returns the number of samples kept. Does not commit.
+    """
+    faces = db.query(Face).filter(Face.user_id == user.id).all()
+    for face in faces:
+        if face.kind == FaceKind.CENTROID:
+            db.delete(face)
+    samples = [face for face in faces if face.kind != FaceKind.CENTROID]
+
+    max_samples = max(1, config_manager.get("enrollment_max_samples", 10))
+    samples.sort(key=_sample_quality, reverse=True)
+    for face in samples[max_samples:]:
+        db.delete(face)
+    samples = samples[:max_samples]
+
+    # Only samples from the current model can be averaged together
+    version = uniface_service.model_version
+    compatible = [face for face in samples if version is None or face.model_version in (None, version)]
+    if compatible:
+        qualities = [_sample_quality(face) for face in compatible]
+        centroid = compute_centroid(
+            [decode_embedding(face.face_embedding, normalized=True) for face in compatible], qualities
+        )
+        db.add(Face(
+            user_id=user.id,
+            face_embedding=encode_for_storage(centroid),
+            kind=FaceKind.CENTROID,
+            quality=float(np.mean(qualities)),
+            model_version=version
+        ))
+    return len(samples)
+
+def save_samples(db: Session, user: User, samples: List[Tuple[np.ndarray, float, str]], append: bool = False,
+                 commit: bool = True) -> int:
+    """
+    Store enrollment samples (embedding, quality, image_path) and refresh the user's centroid.
+    Without `append` the user's previous samples are replaced. Returns the number of samples kept.
+    """
+    if not append:
+        for face in db.query(Face).filter(Face.user_id == user.id).all():
+            db.delete(face)
+        db.flush()
+
+    for embedding, quality, image_path in samples:
+        db.add(Face(
+            user_id=user.id,
+            face_embedding=encode_for_storage(embedding),
+            image_path=image_path,
+            kind=FaceKind.SAMPLE,
+            quality=quality,
+            model_version=uniface_service.model_version
+        ))
+    db.flush()
+
+    kept = rebuild_centroid(db, user)
+    if commit:
+        db.commit()
+        # Replaced or trimmed samples may leave unreferenced images behind
+        image_store.schedule_gc()
+    return kept
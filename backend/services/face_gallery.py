@@ -0,0 +1,270 @@
+import threading
+import numpy as np
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+
+from config import config_manager
+from database import SessionLocal
+from models import Face, FaceKind, User
+from services.singleton import SingletonMeta
+from services.embedding_codec import decode_into, decode_matrix, embedding_dim
+from services.uniface import uniface_service
+from services.face_index import BruteForceIndex, create_index, load_index, needs_training, save_index
+
+class FaceGallery(metaclass=SingletonMeta):
+    """
+    In-memory gallery of registered face embeddings.
+    Each user has one template (the centroid of their enrollment samples); templates live in one
+    contiguous (N, D) float32 matrix with L2-normalized rows, so matching a probe is a single
+    matrix-vector product followed by argmax. Probes whose best template score is below the
+    threshold are matched again against the individual samples.
+    Large galleries can use an approximate index instead (face_index_backend in RuntimeConfig);
+    its quantizer is trained on a background thread, matches use the exact scan until it is ready.
+    The gallery is loaded lazily from the database and reloaded after invalidate().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._user_names = np.empty(0, dtype=object)
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._samples = np.zeros((0, 0), dtype=np.float32)
+        self._sample_names = np.empty(0, dtype=object)
+        self._sample_user_ids = np.empty(0, dtype=np.int64)
+        self._index = BruteForceIndex()
+        self._model_version: Optional[str] = None
+        self._stale = 0
+        self._training: Optional[threading.Thread] = None
+        self._trained: Optional[Tuple[str, dict]] = None  # last trained quantizer, if it could not be saved
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _read(self) -> dict:
+        """Build the gallery state from the database without touching the live one"""
+        current_version = uniface_service.model_version
+        db = SessionLocal()
+        try:
+            # Plain rows in one query, no ORM objects
+            rows = db.execute(
+                select(Face.user_id, Face.kind, Face.model_version, Face.face_embedding, User.name)
+                .join(User, Face.user_id == User.id)
+            ).all()
+        finally:
+            db.close()
+
+        # Embeddings from another recognizer (or of another size) are not comparable and are
+        # left out until they are re-embedded; legacy rows without a version are trusted
+        dim = None
+        usable = []
+        stale = 0
+        for row in rows:
+            if current_version is not None and row.model_version not in (None, current_version):
+                stale += 1
+                continue
+            row_dim = embedding_dim(row.face_embedding)
+            if dim is None:
+                dim = row_dim
+            if row_dim != dim:
+                stale += 1
+                continue
+            usable.append(row)
+
+        centroid_rows = [row for row in usable if row.kind == FaceKind.CENTROID]
+        sample_rows = [row for row in usable if row.kind != FaceKind.CENTROID]
+        samples = decode_matrix([row.face_embedding for row in sample_rows], dim or 0)
+        sample_user_ids = np.array([row.user_id for row in sample_rows], dtype=np.int64)
+
+        names = {row.user_id: row.name for row in usable}
+        centroids = {row.user_id: row.face_embedding for row in centroid_rows}
+        user_ids = sorted(names)
+
+        # One template per user: the stored centroid, or the mean of the samples for
+        # users enrolled before centroids existed
+        embeddings = np.empty((len(user_ids), dim or 0), dtype=np.float32)
+        for row, user_id in enumerate(user_ids):
+            if user_id in centroids:
+                decode_into(centroids[user_id], embeddings[row], normalized=True)
+            else:
+                embeddings[row] = samples[sample_user_ids == user_id].mean(axis=0)
+        if len(user_ids):
+            embeddings = np.ascontiguousarray(self._normalize(embeddings))
+        else:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+
+        index = self._build_index(embeddings)
+        if getattr(index, "keep_vectors", True) is False:
+            # PQ codes only: drop the float32 templates, the row count stays for the dim check
+            embeddings = embeddings[:0]
+
+        return {
+            "_embeddings": embeddings,
+            "_user_names": np.array([names[user_id] for user_id in user_ids], dtype=object),
+            "_user_ids": np.array(user_ids, dtype=np.int64),
+            "_samples": samples if len(sample_rows) else np.zeros((0, 0), dtype=np.float32),
+            "_sample_names": np.array([row.name for row in sample_rows], dtype=object),
+            "_sample_user_ids": sample_user_ids,
+            "_index": index,
+            "_model_version": current_version,
+            "_stale": stale,
+        }
+
+    def _apply(self, state: dict):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._dirty = False
+        print(f"Face gallery loaded: {len(self._user_ids)} templates, {len(self._samples)} samples ({self._index.kind} index)")
+
+        if self._stale and self._model_version is not None:
+            print(f"{self._stale} stored embeddings do not match model {self._model_version}, scheduling re-embedding")
+            from services.reembed import reembed_job
+            reembed_job.schedule()
+
+    def _load(self):
+        self._apply(self._read())
+
+    def _build_index(self, embeddings: np.ndarray):
+        cfg = config_manager.get_config()
+        kind = cfg.face_index_backend
+
+        index = None
+        if kind != BruteForceIndex.kind and len(embeddings) > 0:
+            index = load_index(
+                cfg.face_index_path, kind, embeddings.shape[1], nprobe=cfg.face_index_nprobe,
+                rerank=cfg.face_index_rerank, keep_vectors=cfg.face_index_keep_vectors
+            )
+            if index is None and self._trained is not None and self._trained[0] == kind:
+                index = create_index(
+                    kind, nprobe=cfg.face_index_nprobe, rerank=cfg.face_index_rerank,
+                    keep_vectors=cfg.face_index_keep_vectors
+                )
+                index.set_state(self._trained[1])
+                if index.dim != embeddings.shape[1]:
+                    index = None
+            if index is None or needs_training(index, len(embeddings)):
+                self._train_index(kind, embeddings)
+
+        if index is None:
+            index = BruteForceIndex()
+            index.build(embeddings)
+            return index
+
+        # Encoding with the trained quantizer is cheap; k-means only runs in _train_index
+        index.add(embeddings)
+        return index
+
+    def _train_index(self, kind: str, embeddings: np.ndarray):
+        """Train and persist the quantizer off the request path, then reload the gallery with it"""
+        if self._training is not None and self._training.is_alive():
+            return
+
+        def train():
+            cfg = config_manager.get_config()
+            index = create_index(kind)
+            index.train(embeddings)
+            try:
+                save_index(index, cfg.face_index_path)
+                self._trained = None
+            except Exception as e:
+                print(f"Failed to save face index: {e}")
+                self._trained = (kind, index.get_state())
+            print(f"Face index trained ({kind}, {len(embeddings)} templates)")
+            self.invalidate()
+
+        self._training = threading.Thread(target=train, name="face-index-training", daemon=True)
+        self._training.start()
+
+    def _ensure_loaded(self):
+        # A model change (e.g. a new inference profile) also invalidates the gallery
+        if self._dirty or self._model_version != uniface_service.model_version:
+            self._load()
+
+    def invalidate(self):
+        """Mark the gallery stale; it is reloaded on the next match"""
+        with self._lock:
+            self._dirty = True
+
+    def reload(self):
+        """Rebuild from the database and swap the new state in at once; matches keep using the old one meanwhile"""
+        state = self._read()
+        with self._lock:
+            self._apply(state)
+
+    def stale_count(self) -> int:
+        """Stored embeddings left out because they come from another model"""
+        with self._lock:
+            self._ensure_loaded()
+            return self._stale
+
+    def size(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._user_ids)
+
+    def match(self, embedding: np.ndarray, threshold: Optional[float] = None) -> Tuple[Optional[str], Optional[int], float]:
+        """
+        Find the closest registered face.
+        Returns (user_name, user_id, similarity), or (None, None, 0.0) if the gallery is empty.
+        """
+        return self.match_batch(np.asarray(embedding, dtype=np.float32).reshape(1, -1), threshold)[0]
+
+    def match_batch(self, embeddings: np.ndarray, threshold: Optional[float] = None) -> List[Tuple[Optional[str], Optional[int], float]]:
+        """
+        Match several probes (Q, D) at once with a single matrix-matrix product.
+        Probes scoring below `threshold` (default face_similarity_threshold) on the templates
+        fall back to the best individual sample.
+        """
+        probes = np.asarray(embeddings, dtype=np.float32)
+        no_match = [(None, None, 0.0)] * len(probes)
+        if threshold is None:
+            threshold = config_manager.get("face_similarity_threshold", 0.7)
+
+        with self._lock:
+            self._ensure_loaded()
+            gallery = self._embeddings
+            user_names = self._user_names
+            user_ids = self._user_ids
+            samples = self._samples
+            sample_names = self._sample_names
+            sample_user_ids = self._sample_user_ids
+            index = self._index
+
+        if len(user_ids) == 0 or len(probes) == 0 or probes.shape[1] != gallery.shape[1]:
+            return no_match
+        probes = self._normalize(probes)
+
+        if index.kind == BruteForceIndex.kind:
+            scores = gallery @ probes.T
+            best_rows = np.argmax(scores, axis=0)
+            best_scores = scores[best_rows, np.arange(len(probes))]
+        else:
+            # Recall/latency knobs are read per query so config updates apply immediately
+            index.nprobe = config_manager.get("face_index_nprobe", 8)
+            index.rerank = config_manager.get("face_index_rerank", 50)
+            scores, rows = index.search(probes, k=1)
+            best_rows = rows[:, 0]
+            best_scores = scores[:, 0]
+
+        results = []
+        for row, score in zip(best_rows, best_scores):
+            if row < 0:
+                results.append((None, None, 0.0))
+            else:
+                results.append((user_names[row], int(user_ids[row]), float(score)))
+
+        fallback = [i for i, (_, _, score) in enumerate(results) if score < threshold]
+        if fallback and len(samples) > 0:
+            scores = samples @ probes[fallback].T
+            sample_rows = np.argmax(scores, axis=0)
+            for column, (i, row) in enumerate(zip(fallback, sample_rows)):
+                score = float(scores[row, column])
+                if score > results[i][2]:
+                    results[i] = (sample_names[row], int(sample_user_ids[row]), score)
+        return results
+
+face_gallery = FaceGallery()
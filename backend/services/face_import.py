@@ -0,0 +1,197 @@
+import asyncio
+import json
+import zipfile
+from pathlib import PurePosixPath
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import config_manager
+from database import SessionLocal
+from models import User
+from services.face_enrollment import save_samples
+from services.image_store import image_store
+from services.face_gallery import face_gallery
+from services.inference_pool import inference_pool, InferencePoolBusy
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# name -> [(filename, reader)]; images are only read when their chunk is processed
+ImportItems = Dict[str, List[Tuple[str, Callable[[], bytes]]]]
+
+class ImportBatchError(ValueError):
+    """The batch itself is malformed (bad ZIP or manifest)"""
+
+def items_from_zip(fileobj) -> ImportItems:
+    """
+    One person per folder (`Name/1.jpg`, `Name/2.jpg`, nested folders allowed) or one image
+    per person at the top level (`Name.jpg`)
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ImportBatchError("File ZIP không hợp lệ")
+
+    items: ImportItems = {}
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        path = PurePosixPath(info.filename)
+        if any(part.startswith(("__MACOSX", ".")) for part in path.parts):
+            continue
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        name = (path.parts[-2] if len(path.parts) >= 2 else path.stem).strip()
+        if name:
+            items.setdefault(name, []).append((path.name, lambda info=info: archive.read(info)))
+    return items
+
+def items_from_manifest(manifest: str, files) -> ImportItems:
+    """`manifest` is a JSON list of {"name": ..., "images": [filename, ...]} naming the uploaded files"""
+    try:
+        entries = json.loads(manifest)
+    except json.JSONDecodeError:
+        raise ImportBatchError("Manifest không phải JSON hợp lệ")
+    if not isinstance(entries, list):
+        raise ImportBatchError("Manifest phải là một danh sách")
+
+    uploads = {upload.filename: upload for upload in files}
+
+    def read(upload) -> bytes:
+        # A file may be listed more than once (e.g. one photo for two people)
+        upload.file.seek(0)
+        return upload.file.read()
+
+    items: ImportItems = {}
+    for entry in entries:
+        name = str(entry.get("name", "")).strip() if isinstance(entry, dict) else ""
+        if not name:
+            raise ImportBatchError("Mỗi mục trong manifest cần có tên")
+        images = items.setdefault(name, [])
+        for filename in entry.get("images", []):
+            upload = uploads.get(filename)
+            # Missing files are read as empty and reported as rejected images
+            images.append((filename, (lambda upload=upload: read(upload) if upload else b"")))
+    return items
+
+async def _extract_samples(images: List[bytes]):
+    """Samples for a batch of images, waiting (not failing) while the inference queue is full"""
+    while True:
+        try:
+            return await inference_pool.extract_samples(images)
+        except InferencePoolBusy:
+            await asyncio.sleep(0.2)
+
+async def _embed(images: List[bytes]) -> List[Optional[tuple]]:
+    """Embed all images, batch_size per call, with one call in flight per inference worker"""
+    batch_size = max(1, config_manager.get("import_batch_size", 8))
+    semaphore = asyncio.Semaphore(max(1, config_manager.get("inference_workers", 2)))
+
+    async def run(batch):
+        async with semaphore:
+            return await _extract_samples(batch)
+
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    outputs = await asyncio.gather(*(run(batch) for batch in batches), return_exceptions=True)
+
+    samples = []
+    for batch, output in zip(batches, outputs):
+        samples.extend([None] * len(batch) if isinstance(output, BaseException) else output)
+    return samples
+
+def _read_chunk(chunk: List[Tuple[str, list]]) -> List[Tuple[str, List[Tuple[str, bytes]]]]:
+    read = []
+    for name, sources in chunk:
+        images = []
+        for filename, reader in sources:
+            try:
+                images.append((filename, reader()))
+            except Exception:
+                images.append((filename, b""))
+        read.append((name, images))
+    return read
+
+def _existing_names(names: List[str]) -> set:
+    db = SessionLocal()
+    try:
+        return {name for (name,) in db.query(User.name).filter(User.name.in_(names)).all()}
+    finally:
+        db.close()
+
+def _store_chunk(chunk, samples, on_existing: str) -> List[dict]:
+    """Create users and faces of one chunk in a single transaction"""
+    min_quality = config_manager.get("enrollment_min_quality", 0.3)
+    db = SessionLocal()
+    try:
+        names = [name for name, _ in chunk]
+        existing = {user.name: user for user in db.query(User).filter(User.name.in_(names)).all()}
+
+        results = []
+        position = 0
+        for name, images in chunk:
+            item_samples = samples[position:position + len(images)]
+            position += len(images)
+
+            accepted = [(data, filename, sample) for (filename, data), sample in zip(images, item_samples)
+                        if sample is not None and sample[1] >= min_quality]
+            result = {"name": name, "images": len(images), "samples_accepted": len(accepted)}
+
+            user = existing.get(name)
+            if user is not None and on_existing == "skip":
+                results.append({**result, "success": False, "error": "Người dùng đã tồn tại"})
+                continue
+            if not accepted:
+                results.append({**result, "success": False, "error": "Không phát hiện khuôn mặt đạt chất lượng trong ảnh"})
+                continue
+
+            if user is None:
+                user = User(name=name)
+                db.add(user)
+                db.flush()
+
+            stored = [(embedding, float(quality), image_store.put(data, filename))
+                      for data, filename, (embedding, quality) in accepted]
+            save_samples(db, user, stored, append=on_existing != "replace", commit=False)
+            results.append({**result, "success": True, "user_id": user.id})
+
+        db.commit()
+        return results
+    except Exception as e:
+        db.rollback()
+        return [{"name": name, "success": False, "error": f"Lỗi lưu dữ liệu: {e}"} for name, _ in chunk]
+    finally:
+        db.close()
+
+async def import_faces(items: ImportItems, on_existing: str = "skip") -> dict:
+    """
+    Enroll many people at once. People are processed in chunks of import_chunk_size: images
+    of a chunk are embedded in parallel across the inference workers, then its users and faces
+    are written in one transaction. Failures are reported per person and do not stop the import.
+    on_existing: "skip" existing users, "append" samples to them or "replace" their samples.
+    """
+    chunk_size = max(1, config_manager.get("import_chunk_size", 100))
+    entries = list(items.items())
+    results = []
+
+    for start in range(0, len(entries), chunk_size):
+        chunk = entries[start:start + chunk_size]
+        if on_existing == "skip":
+            # Skip existing users before spending inference on them
+            existing = await run_in_threadpool(_existing_names, [name for name, _ in chunk])
+            results.extend({"name": name, "images": len(sources), "samples_accepted": 0, "success": False,
+                            "error": "Người dùng đã tồn tại"} for name, sources in chunk if name in existing)
+            chunk = [(name, sources) for name, sources in chunk if name not in existing]
+
+        chunk = await run_in_threadpool(_read_chunk, chunk)
+        samples = await _embed([data for _, images in chunk for _, data in images])
+        results.extend(await run_in_threadpool(_store_chunk, chunk, samples, on_existing))
+
+    face_gallery.invalidate()
+    image_store.schedule_gc()
+    imported = sum(1 for result in results if result["success"])
+    return {
+        "total": len(results),
+        "imported": imported,
+        "failed": len(results) - imported,
+        "results": results
+    }
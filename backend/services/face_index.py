@@ -0,0 +1,309 @@
+"""
+Nearest-neighbour index backends for the face gallery.
+
+All backends work on L2-normalized float32 rows, so the inner product is the cosine similarity.
+- brute: exact scan, one matrix product per query batch
+- ivf:   coarse k-means clustering, only the `nprobe` closest clusters are scanned exactly
+- pq:    product quantization, rows are stored as uint8 codes and scored with lookup tables;
+         the best `rerank` candidates are re-scored exactly when the full vectors are kept
+
+Like faiss, the approximate backends are trained once (k-means for the IVF centroids or the PQ
+codebooks) and rows are then encoded with add(), which only assigns them to the trained
+quantizer. Only the quantizer is persisted, so a changed gallery is re-encoded in
+milliseconds instead of re-running k-means.
+
+search() returns (scores, rows) of shape (Q, k); rows index into the vectors given to add()
+and are -1 where fewer than k candidates exist.
+"""
+
+import os
+import numpy as np
+from typing import Optional, Tuple
+
+def _assign(data: np.ndarray, centroids: np.ndarray, spherical: bool, chunk: int = 4096) -> np.ndarray:
+    assignments = np.empty(len(data), dtype=np.int64)
+    centroid_sq = (centroids * centroids).sum(axis=1)[None, :]
+    for start in range(0, len(data), chunk):
+        products = data[start:start + chunk] @ centroids.T
+        if spherical:
+            assignments[start:start + chunk] = np.argmax(products, axis=1)
+        else:
+            # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, ||x||^2 is constant per row
+            assignments[start:start + chunk] = np.argmin(centroid_sq - 2.0 * products, axis=1)
+    return assignments
+
+def _kmeans(data: np.ndarray, k: int, n_iter: int = 15, spherical: bool = False, seed: int = 0,
+            max_points_per_centroid: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(data)))
+
+    # Train on a subsample, like faiss does, then assign every row once at the end
+    train = data
+    if len(data) > k * max_points_per_centroid:
+        train = data[rng.choice(len(data), size=k * max_points_per_centroid, replace=False)]
+
+    centroids = train[rng.choice(len(train), size=k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(train, centroids, spherical)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, train)
+        counts = np.bincount(assignments, minlength=k).astype(np.float32)
+
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random rows
+            sums[empty] = train[rng.choice(len(train), size=int(empty.sum()))]
+            counts[empty] = 1.0
+
+        centroids = sums / counts[:, None]
+        if spherical:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = centroids / norms
+
+    centroids = centroids.astype(np.float32)
+    return centroids, _assign(data, centroids, spherical)
+
+def _top_k(scores: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    out_scores = np.full(k, -np.inf, dtype=np.float32)
+    out_rows = np.full(k, -1, dtype=np.int64)
+    if len(candidates) == 0:
+        return out_scores, out_rows
+
+    n = min(k, len(candidates))
+    if n < len(candidates):
+        top = np.argpartition(-scores, n - 1)[:n]
+    else:
+        top = np.arange(len(candidates))
+    top = top[np.argsort(-scores[top])]
+
+    out_scores[:n] = scores[top]
+    out_rows[:n] = candidates[top]
+    return out_scores, out_rows
+
+def _top_k_batch(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Best k columns of every row of `scores` (Q, N), padded with -inf / -1 when N < k"""
+    out_scores = np.full((len(scores), k), -np.inf, dtype=np.float32)
+    out_cols = np.full((len(scores), k), -1, dtype=np.int64)
+    n = min(k, scores.shape[1])
+    if n == 0:
+        return out_scores, out_cols
+
+    if n < scores.shape[1]:
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    else:
+        top = np.broadcast_to(np.arange(n), (len(scores), n))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+
+    out_scores[:, :n] = np.take_along_axis(top_scores, order, axis=1)
+    out_cols[:, :n] = np.take_along_axis(top, order, axis=1)
+    return out_scores, out_cols
+
+class BruteForceIndex:
+    kind = "brute"
+
+    def __init__(self):
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def build(self, vectors: np.ndarray):
+        self._vectors = vectors
+
+    def add(self, vectors: np.ndarray):
+        self._vectors = vectors if len(self._vectors) == 0 else np.concatenate([self._vectors, vectors])
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        return _top_k_batch(queries @ self._vectors.T, k)
+
+class IVFIndex:
+    kind = "ivf"
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 8):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.trained_rows = 0
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._centroids = np.zeros((0, 0), dtype=np.float32)
+        self._assignments = np.empty(0, dtype=np.int64)
+        self._order = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+
+    def train(self, vectors: np.ndarray):
+        nlist = self.nlist or int(4 * np.sqrt(len(vectors)))
+        self._centroids, _ = _kmeans(vectors, max(1, nlist), spherical=True)
+        self.trained_rows = len(vectors)
+
+    def build(self, vectors: np.ndarray):
+        self.train(vectors)
+        self.add(vectors)
+
+    def add(self, vectors: np.ndarray):
+        if len(self._vectors) == 0:
+            self._vectors = vectors
+            self._assignments = _assign(vectors, self._centroids, spherical=True)
+        else:
+            self._vectors = np.concatenate([self._vectors, vectors])
+            self._assignments = np.concatenate([self._assignments, _assign(vectors, self._centroids, spherical=True)])
+
+        # Inverted lists stored as one permutation plus per-list offsets
+        self._order = np.argsort(self._assignments, kind="stable")
+        counts = np.bincount(self._assignments, minlength=len(self._centroids))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        nprobe = max(1, min(self.nprobe, len(self._centroids)))
+        coarse = queries @ self._centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        all_scores = []
+        all_rows = []
+        for query, lists in zip(queries, probes):
+            candidates = np.concatenate([
+                self._order[self._offsets[l]:self._offsets[l + 1]] for l in lists
+            ])
+            scores = self._vectors[candidates] @ query
+            top_scores, top_rows = _top_k(scores, candidates, k)
+            all_scores.append(top_scores)
+            all_rows.append(top_rows)
+        return np.stack(all_scores), np.stack(all_rows)
+
+    def get_state(self) -> dict:
+        return {"centroids": self._centroids, "trained_rows": self.trained_rows}
+
+    def set_state(self, state: dict):
+        self._centroids = state["centroids"]
+        self.trained_rows = int(state["trained_rows"])
+
+    @property
+    def dim(self) -> int:
+        return self._centroids.shape[1]
+
+class PQIndex:
+    kind = "pq"
+
+    def __init__(self, m: int = 16, rerank: int = 50, keep_vectors: bool = True):
+        self.m = m
+        self.rerank = rerank
+        # Without the float32 vectors only the uint8 codes are held (m bytes per row), at the
+        # cost of no exact re-ranking
+        self.keep_vectors = keep_vectors
+        self.trained_rows = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._codebooks = np.zeros((0, 0, 0), dtype=np.float32)
+        self._codes = np.zeros((0, 0), dtype=np.uint8)
+
+    def _subspaces(self, dim: int) -> int:
+        m = max(1, min(self.m, dim))
+        while dim % m:
+            m -= 1
+        return m
+
+    def train(self, vectors: np.ndarray):
+        n, dim = vectors.shape
+        m = self._subspaces(dim)
+        sub_dim = dim // m
+        ksub = min(256, n)
+
+        codebooks = np.zeros((m, ksub, sub_dim), dtype=np.float32)
+        for i in range(m):
+            sub = np.ascontiguousarray(vectors[:, i * sub_dim:(i + 1) * sub_dim])
+            centroids, _ = _kmeans(sub, ksub, seed=i)
+            codebooks[i, :len(centroids)] = centroids
+        self._codebooks = codebooks
+        self.trained_rows = n
+
+    def build(self, vectors: np.ndarray):
+        self.train(vectors)
+        self.add(vectors)
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        m, _, sub_dim = self._codebooks.shape
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        for i in range(m):
+            sub = np.ascontiguousarray(vectors[:, i * sub_dim:(i + 1) * sub_dim])
+            codes[:, i] = _assign(sub, self._codebooks[i], spherical=False)
+        return codes
+
+    def add(self, vectors: np.ndarray):
+        codes = self._encode(vectors)
+        if len(self._codes) == 0:
+            self._codes = codes
+            self._vectors = vectors if self.keep_vectors else None
+        else:
+            self._codes = np.concatenate([self._codes, codes])
+            if self._vectors is not None:
+                self._vectors = np.concatenate([self._vectors, vectors])
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        m, _, sub_dim = self._codebooks.shape
+
+        # Asymmetric distance for the whole batch: (Q, m, ksub) lookup tables of query . centroid,
+        # then one gather per subspace over all codes
+        luts = np.einsum("mkd,qmd->qmk", self._codebooks, queries.reshape(len(queries), m, sub_dim))
+        scores = np.zeros((len(queries), len(self._codes)), dtype=np.float32)
+        for i in range(m):
+            scores += np.take(luts[:, i], self._codes[:, i], axis=1)
+
+        if self.rerank <= 0 or self._vectors is None:
+            return _top_k_batch(scores, k)
+
+        _, shortlist = _top_k_batch(scores, max(k, self.rerank))
+        valid = shortlist >= 0
+        exact = np.einsum("qrd,qd->qr", self._vectors[np.where(valid, shortlist, 0)], queries)
+        exact[~valid] = -np.inf
+        top_scores, top = _top_k_batch(exact, k)
+        rows = np.take_along_axis(shortlist, np.maximum(top, 0), axis=1)
+        rows[top < 0] = -1
+        return top_scores, rows
+
+    def get_state(self) -> dict:
+        return {"codebooks": self._codebooks, "trained_rows": self.trained_rows}
+
+    def set_state(self, state: dict):
+        self._codebooks = state["codebooks"]
+        self.trained_rows = int(state["trained_rows"])
+
+    @property
+    def dim(self) -> int:
+        m, _, sub_dim = self._codebooks.shape
+        return m * sub_dim
+
+INDEX_BACKENDS = {
+    BruteForceIndex.kind: BruteForceIndex,
+    IVFIndex.kind: IVFIndex,
+    PQIndex.kind: PQIndex,
+}
+
+def create_index(kind: str, nprobe: int = 8, rerank: int = 50, keep_vectors: bool = True):
+    if kind == IVFIndex.kind:
+        return IVFIndex(nprobe=nprobe)
+    if kind == PQIndex.kind:
+        return PQIndex(rerank=rerank, keep_vectors=keep_vectors)
+    return BruteForceIndex()
+
+def needs_training(index, rows: int) -> bool:
+    """A quantizer trained on a much smaller gallery clusters the current one poorly"""
+    return rows > 2 * max(1, index.trained_rows)
+
+def save_index(index, path: str):
+    """Persist the trained quantizer (not the encoded rows)"""
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, kind=index.kind, **index.get_state())
+    os.replace(tmp_path, path)
+
+def load_index(path: str, kind: str, dim: int, nprobe: int = 8, rerank: int = 50, keep_vectors: bool = True):
+    """Load a persisted quantizer, without rows; returns None if missing, corrupt, or of another kind or dimension"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["kind"]) != kind:
+                return None
+            state = {key: data[key] for key in data.files if key != "kind"}
+        index = create_index(kind, nprobe=nprobe, rerank=rerank, keep_vectors=keep_vectors)
+        index.set_state(state)
+    except Exception as e:
+        print(f"Failed to load face index: {e}")
+        return None
+    return index if index.dim == dim else None
@@ -0,0 +1,123 @@
+import threading
+import cv2
+import numpy as np
+from typing import Optional
+
+from config import config_manager
+
+class QualityReport:
+    """Per-face quality measures; `reason` names the first failed check, None if the face is usable"""
+    __slots__ = ("score", "confidence", "size", "sharpness", "brightness", "yaw", "roll", "reason")
+
+    def __init__(self, score, confidence, size, sharpness, brightness, yaw, roll, reason=None):
+        self.score = score
+        self.confidence = confidence
+        self.size = size
+        self.sharpness = sharpness
+        self.brightness = brightness
+        self.yaw = yaw
+        self.roll = roll
+        self.reason = reason
+
+    @property
+    def passed(self) -> bool:
+        return self.reason is None
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def _pose(landmarks: Optional[np.ndarray]):
+    """
+    (yaw, roll) from the five landmarks (eyes, nose, mouth corners).
+    yaw is the nose offset from the eye midpoint in inter-eye distances (0 = frontal),
+    roll the eye-line angle in degrees.
+    """
+    if landmarks is None or len(landmarks) < 3:
+        return 0.0, 0.0
+    left_eye, right_eye, nose = landmarks[0], landmarks[1], landmarks[2]
+    eye_vector = right_eye - left_eye
+    eye_distance = float(np.linalg.norm(eye_vector))
+    if eye_distance < 1e-3:
+        return 1.0, 0.0
+    # Project the nose offset on the eye line so head roll does not read as yaw
+    offset = nose - (left_eye + right_eye) / 2.0
+    yaw = float(np.dot(offset, eye_vector) / (eye_distance ** 2))
+    roll = float(np.degrees(np.arctan2(eye_vector[1], eye_vector[0])))
+    return yaw, roll
+
+def assess_face(image_bgr: np.ndarray, face, gray: Optional[np.ndarray] = None) -> QualityReport:
+    """
+    Cheap quality check of a detected face (DetectedFace or Track): detection confidence,
+    width, blur (variance of the Laplacian on a 64x64 crop), brightness and landmark pose.
+    Costs well under a millisecond per face.
+    """
+    cfg = config_manager.get_config()
+    height, width = image_bgr.shape[:2]
+    x1, y1, x2, y2 = (int(v) for v in face.bbox[:4])
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(width, x2), min(height, y2)
+    confidence = float(face.confidence)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return QualityReport(0.0, confidence, 0, 0.0, 0.0, 0.0, 0.0, "small")
+
+    if gray is None:
+        crop = cv2.cvtColor(image_bgr[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+    else:
+        crop = gray[y1:y2, x1:x2]
+    crop = cv2.resize(crop, (64, 64), interpolation=cv2.INTER_AREA)
+    sharpness = float(cv2.Laplacian(crop, cv2.CV_64F).var())
+    brightness = float(crop.mean())
+    yaw, roll = _pose(face.landmarks)
+    size = x2 - x1
+
+    score = (
+        confidence
+        * min(1.0, size / 112.0)
+        * min(1.0, sharpness / 100.0)
+        * max(0.0, 1.0 - abs(yaw) / 0.6)
+        * max(0.0, 1.0 - max(0.0, abs(roll) - 15.0) / 45.0)
+    )
+
+    reason = None
+    if size < cfg.face_quality_min_size:
+        reason = "small"
+    elif sharpness < cfg.face_quality_min_sharpness:
+        reason = "blurry"
+    elif not cfg.face_quality_min_brightness <= brightness <= cfg.face_quality_max_brightness:
+        reason = "lighting"
+    elif abs(yaw) > cfg.face_quality_max_yaw:
+        reason = "pose"
+    elif score < cfg.face_quality_min_score:
+        reason = "low_score"
+    return QualityReport(score, confidence, size, sharpness, brightness, yaw, roll, reason)
+
+def face_quality(image_bgr: np.ndarray, face) -> float:
+    """Quality score in [0, 1] (used to weight enrollment samples)"""
+    return assess_face(image_bgr, face).score
+
+class QualityStats:
+    """Counts of faces assessed and of embeddings skipped (by reason)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.assessed = 0
+        self.passed = 0
+        self.skipped = {}
+
+    def record(self, report: QualityReport):
+        with self._lock:
+            self.assessed += 1
+            if report.passed:
+                self.passed += 1
+            else:
+                self.skipped[report.reason] = self.skipped.get(report.reason, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            skipped = sum(self.skipped.values())
+            return {
+                "assessed": self.assessed,
+                "passed": self.passed,
+                "embeddings_saved": skipped,
+                "skipped_by_reason": dict(self.skipped)
+            }
@@ -1,21 +1,44 @@
 import cv2
 import time
 import threading
-import numpy as np
+from functools import lru_cache
 from typing import Generator, Optional, List
 from database import SessionLocal
-from models import User, AccessLog, AccessMethod, AccessType, Face
+from models import AccessLog, AccessMethod, AccessType
 from services.singleton import SingletonMeta
 from services.state_manager import state_manager
 from services.uniface import uniface_service
+from services.face_gallery import face_gallery
 from services.uart import uart_service
 from services.camera import camera_service
+from services.pipeline import LatestValue, StageStats
+from services.frame_hub import FrameHub
+from services.face_tracker import FaceTracker
+from services.face_quality import QualityStats, assess_face
+from services.motion_gate import MotionGate
+from services.overlay import overlay_renderer
+from config import config_manager
 
 class FaceRecognitionStream(metaclass=SingletonMeta):
     def __init__(self):
         self.camera = None
         self.running = False
-        self.recognition_thread: Optional[threading.Thread] = None
+        self.threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        
+        # Capture -> (recognition, encode) -> hub, linked by latest-value queues
+        self.recognition_queue = LatestValue()
+        self.encode_queue = LatestValue()
+        self.hub = FrameHub("face-recognition")
+        self.capture_stats = StageStats()
+        self.recognition_stats = StageStats()
+        self.encode_stats = StageStats()
+        self.latest_result = self._empty_result()
+        
+        self.tracker = FaceTracker()
+        self.motion_gate = MotionGate()
+        self.tracking_stats = {"detections": 0, "tracked_frames": 0, "embeddings": 0, "embeddings_skipped": 0}
+        self.quality_stats = QualityStats()
         
         self.last_unlock_time = 0
         self.cooldown_seconds = 5
@@ -24,6 +47,8 @@ class FaceRecognitionStream(metaclass=SingletonMeta):
         
         self.last_recognized_user: Optional[str] = None
         self.last_similarity: float = 0.0
+        self.recognized_user: Optional[str] = None
+        self.recognition_time = 0.0
         
     def _get_center_box(self, frame_width: int, frame_height: int):
         box_w = int(frame_width * self.box_ratio)
@@ -47,8 +72,6 @@ class FaceRecognitionStream(metaclass=SingletonMeta):
         return time.time() - self.last_unlock_time > self.cooldown_seconds
     
     def _draw_detection_ui(self, frame, center_box, faces=None, success_user=None, in_box=False, display_name=None, display_score=0.0):
-        from PIL import Image, ImageDraw, ImageFont
-        
         height, width = frame.shape[:2]
         cx1, cy1, cx2, cy2 = center_box
         
@@ -67,16 +90,6 @@ class FaceRecognitionStream(metaclass=SingletonMeta):
         cv2.line(frame, (cx2, cy2), (cx2 - corner_len, cy2), color, corner_thickness)
         cv2.line(frame, (cx2, cy2), (cx2, cy2 - corner_len), color, corner_thickness)
         
-        img_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        draw = ImageDraw.Draw(img_pil)
-        
-        try:
-            font = ImageFont.truetype("arial.ttf", 24)
-            font_big = ImageFont.truetype("arial.ttf", 32)
-        except IOError:
-            font = ImageFont.load_default()
-            font_big = ImageFont.load_default()
-
         text_guide = "Di chuyển mặt vào khung"
         if in_box:
             if success_user:
@@ -84,16 +97,8 @@ class FaceRecognitionStream(metaclass=SingletonMeta):
             else:
                 text_guide = "Đang nhận diện..."
         
-        text_bbox = draw.textbbox((0, 0), text_guide, font=font_big)
-        text_w = text_bbox[2] - text_bbox[0]
-        text_h = text_bbox[3] - text_bbox[1]
-        
-        text_x = (width - text_w) // 2
-        text_y = cy1 - 40
-        
-        draw.rectangle([text_x - 10, text_y - 5, text_x + text_w + 10, text_y + text_h + 5], fill=(0, 0, 0))
-        pil_color = (color[2], color[1], color[0])
-        draw.text((text_x, text_y), text_guide, font=font_big, fill=pil_color)
+        guide_w, _ = overlay_renderer.text_size(text_guide, 32, background=(0, 0, 0))
+        overlay_renderer.draw_text(frame, text_guide, (width - guide_w) // 2, cy1 - 45, 32, color, background=(0, 0, 0))
 
         if faces is not None:
             try:
@@ -112,25 +117,21 @@ class FaceRecognitionStream(metaclass=SingletonMeta):
                             x1, y1, x2, y2 = [int(v) for v in bbox[:4]]
                             is_face_in_box = self._is_face_in_box((x1, y1, x2, y2), center_box)
                             
-                            outline_color = (0, 255, 0) if is_face_in_box else (255, 165, 0)
-                            draw.rectangle([x1, y1, x2, y2], outline=outline_color, width=2)
+                            outline_color = (0, 255, 0) if is_face_in_box else (0, 165, 255)
+                            cv2.rectangle(frame, (x1, y1), (x2, y2), outline_color, 2)
                             
-                            if is_face_in_box and display_name:
-                                name_normalized = display_name
-                                try:
-                                    import unidecode
-                                    name_normalized = unidecode.unidecode(display_name)
-                                except ImportError:
-                                    pass
-                                
-                                label_text = f"Tương đồng {name_normalized} {display_score*100:.1f}%"
-                                
-                                label_bbox = draw.textbbox((0, 0), label_text, font=font)
-                                label_w = label_bbox[2] - label_bbox[0]
-                                label_h = label_bbox[3] - label_bbox[1]
+                            # Tracks carry their own identity, so every face in a group gets its own label
+                            label_name = getattr(face, 'identity', None) or display_name
+                            label_score = getattr(face, 'similarity', 0.0) if getattr(face, 'identity', None) else display_score
+                            
+                            if is_face_in_box and label_name:
+                                label_text = f"Tương đồng {self._ascii_name(label_name)} {label_score*100:.1f}%"
                                 
-                                draw.rectangle([x1, y1 - label_h - 10, x1 + label_w + 10, y1], fill=(0, 255, 0))
-                                draw.text((x1 + 5, y1 - label_h - 5), label_text, font=font, fill=(0, 0, 0))
+                                _, label_h = overlay_renderer.text_size(label_text, 24, background=(0, 255, 0), padding=(5, 5))
+                                overlay_renderer.draw_text(
+                                    frame, label_text, x1, y1 - label_h, 24, (0, 0, 0),
+                                    background=(0, 255, 0), padding=(5, 5)
+                                )
                                 
                     except Exception:
                         pass
@@ -138,122 +139,192 @@ class FaceRecognitionStream(metaclass=SingletonMeta):
         if not self._can_recognize():
             remaining = self.cooldown_seconds - (time.time() - self.last_unlock_time)
             cooldown_text = f"Chờ {remaining:.1f}s"
-            draw.text((10, height - 40), cooldown_text, font=font_big, fill=(255, 255, 255))
+            overlay_renderer.draw_text(frame, cooldown_text, 10, height - 40, 32, (255, 255, 255))
 
-        frame = cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
         return frame
     
-    def generate_frames_with_recognition(self) -> Generator[bytes, None, None]:
-        self.running = True
-        recognized_user = None
-        recognition_time = 0
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _ascii_name(name: str) -> str:
+        try:
+            import unidecode
+            return unidecode.unidecode(name)
+        except ImportError:
+            return name
+    
+    def _detect(self, frame, center_box, cfg):
+        if not cfg.face_roi_enabled:
+            return uniface_service.detect_faces(frame)
         
-        while self.running:
-            current_best_similarity = 0.0
-            candidate_name = None
+        # Only faces centered in the box are used, so detect on the box plus a margin
+        cx1, cy1, cx2, cy2 = center_box
+        margin_x = int((cx2 - cx1) * cfg.face_roi_margin)
+        margin_y = int((cy2 - cy1) * cfg.face_roi_margin)
+        roi = (cx1 - margin_x, cy1 - margin_y, cx2 + margin_x, cy2 + margin_y)
+        return uniface_service.detect_faces(frame, roi=roi, max_side=cfg.face_roi_max_side)
+    
+    def _empty_result(self) -> dict:
+        return {"faces": [], "in_box": False, "candidate_name": None, "similarity": 0.0}
+    
+    def _recognize(self, frame) -> dict:
+        result = self._empty_result()
+        
+        if not state_manager.is_entry_exit_mode() or not uniface_service.is_ready():
+            self.tracker.reset()
+            self.motion_gate.reset()
+            return result
+        
+        height, width = frame.shape[:2]
+        center_box = self._get_center_box(width, height)
+        
+        cfg = config_manager.get_config()
+        tracking = cfg.face_tracking_enabled
+        
+        if cfg.motion_gate_enabled:
+            motion = self.motion_gate.check(frame, cfg.motion_gate_pixel_threshold, cfg.motion_gate_min_area)
+            # Faces already being tracked keep the detector running even if they stand still
+            if not motion and not self.tracker.tracks:
+                return result
+        
+        try:
+            # Without tracking every frame is a detection frame and every in-box face is re-embedded
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if tracking else None
+            if not tracking or self.tracker.should_detect(cfg.face_detect_interval):
+                tracks = self.tracker.update(self._detect(frame, center_box, cfg), gray)
+                self.tracking_stats["detections"] += 1
+            else:
+                tracks = self.tracker.propagate(gray)
+                self.tracking_stats["tracked_frames"] += 1
+            result["faces"] = tracks
             
-            frame = camera_service.get_raw_frame()
+            threshold = 0.7
+            
+            if tracks and self._can_recognize():
+                in_box_tracks = [
+                    track for track in tracks
+                    if self._is_face_in_box(tuple(int(v) for v in track.bbox), center_box)
+                ]
+                result["in_box"] = len(in_box_tracks) > 0
+                
+                pending = [
+                    track for track in in_box_tracks
+                    if not tracking or track.needs_embedding(threshold, cfg.face_track_min_quality_gain)
+                ]
+                pending = [track for track in pending if track.landmarks is not None]
+                self.tracking_stats["embeddings_skipped"] += len(in_box_tracks) - len(pending)
+                
+                if pending and cfg.face_quality_enabled:
+                    # Blurry, turned or tiny faces are deferred: they stay pending and are
+                    # embedded on a later frame once they pass
+                    if gray is None:
+                        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    usable = []
+                    for track in pending:
+                        report = assess_face(frame, track, gray)
+                        self.quality_stats.record(report)
+                        if report.passed:
+                            usable.append(track)
+                    pending = usable
+                
+                if pending:
+                    # One ArcFace run and one gallery product for every face that needs an embedding
+                    try:
+                        embeddings = uniface_service.get_embeddings_batch(frame, [track.landmarks for track in pending])
+                        matches = face_gallery.match_batch(embeddings)
+                        for track, (match_name, _, similarity) in zip(pending, matches):
+                            track.set_identity(match_name, similarity)
+                        self.tracking_stats["embeddings"] += len(pending)
+                    except Exception:
+                        pass
+                
+                if in_box_tracks:
+                    best = max(in_box_tracks, key=lambda track: track.similarity)
+                    result["similarity"] = best.similarity
+                    result["candidate_name"] = best.identity
+                
+                recognized = {}
+                for track in in_box_tracks:
+                    if track.identity and track.similarity >= threshold:
+                        recognized[track.identity] = max(track.similarity, recognized.get(track.identity, 0.0))
+                if recognized:
+                    self._on_recognized(recognized)
+        except Exception:
+            pass
+        
+        return result
+    
+    def _on_recognized(self, recognized: dict):
+        """Log every user recognized in this pass (name -> similarity) in one transaction"""
+        best_name = max(recognized, key=recognized.get)
+        self.recognized_user = ", ".join(recognized)
+        self.recognition_time = time.time()
+        self.last_recognized_user = best_name
+        self.last_similarity = recognized[best_name]
+        
+        db = SessionLocal()
+        try:
+            for user_name, similarity in recognized.items():
+                log = AccessLog(
+                    user_name=user_name,
+                    access_method=AccessMethod.FACE,
+                    access_type=AccessType.ENTRY,
+                    success=True,
+                    details=f"Do tuong dong: {similarity:.3f}"
+                )
+                db.add(log)
+            db.commit()
+        finally:
+            db.close()
+        
+        # uart_service.unlock_door(duration=5)
+        uart_service.beep(2)
+        
+        self.last_unlock_time = time.time()
+    
+    def _capture_loop(self):
+        # Follow the shared camera producer instead of reading the device here
+        camera_service.start()
+        last_seq, _ = camera_service.frames.peek()
+        
+        while self.running:
+            last_seq, frame = camera_service.frames.wait_newer(last_seq, timeout=1.0)
+            if frame is None:
+                continue
             
+            self.capture_stats.tick()
+            self.recognition_queue.put(frame)
+            self.encode_queue.put(frame)
+    
+    def _recognition_loop(self):
+        while self.running:
+            frame = self.recognition_queue.get(timeout=0.5)
             if frame is None:
-                time.sleep(0.1)
                 continue
             
-            height, width = frame.shape[:2]
-            center_box = self._get_center_box(width, height)
-            faces = []
-            in_box = False
+            started = time.monotonic()
+            self.latest_result = self._recognize(frame)
+            self.recognition_stats.tick(time.monotonic() - started)
+    
+    def _encode_loop(self):
+        while self.running:
+            frame = self.encode_queue.get(timeout=0.5)
+            if frame is None or not self.hub.has_viewers():
+                continue
             
-            if state_manager.is_entry_exit_mode():
-                try:
-                    faces = uniface_service.detector.detect(frame)
-                    
-                    if faces is not None and len(faces) > 0 and self._can_recognize():
-                        for face in faces:
-                            bbox = getattr(face, 'bbox', None)
-                            if bbox is None:
-                                bbox = getattr(face, 'box', None)
-                            
-                            landmarks = getattr(face, 'landmarks', None)
-                            if landmarks is None:
-                                landmarks = getattr(face, 'kps', None)
-                            
-                            if bbox is not None:
-                                try:
-                                    x1, y1, x2, y2 = [int(v) for v in bbox[:4]]
-                                except:
-                                    continue
-                                
-                                if self._is_face_in_box((x1, y1, x2, y2), center_box):
-                                    in_box = True
-                                    embedding = None
-                                    
-                                    if landmarks is not None:
-                                        try:
-                                            embedding = uniface_service.recognizer.get_normalized_embedding(
-                                                frame, 
-                                                landmarks
-                                            )
-                                        except Exception:
-                                            pass
-                                    
-                                    if embedding is not None:
-                                        db = SessionLocal()
-                                        try:
-                                            faces_db = db.query(Face).all()
-                                            
-                                            best_match_face = None
-                                            best_similarity = 0.0
-                                            
-                                            for face_db in faces_db:
-                                                stored_embedding = np.frombuffer(face_db.face_embedding, dtype=np.float32)
-                                                similarity = uniface_service.compare_faces(embedding, stored_embedding)
-                                                
-                                                if similarity > best_similarity:
-                                                    best_similarity = similarity
-                                                    best_match_face = face_db
-                                            
-                                            current_best_similarity = best_similarity
-                                            if best_match_face and best_match_face.user:
-                                                candidate_name = best_match_face.user.name
-                                            
-                                            threshold = 0.7
-                                            
-                                            if best_similarity >= threshold and best_match_face:
-                                                user = best_match_face.user
-                                                recognized_user = user.name
-                                                self.last_recognized_user = recognized_user
-                                                self.last_similarity = best_similarity
-                                                recognition_time = time.time()
-                                                
-                                                log = AccessLog(
-                                                    user_name=user.name,
-                                                    access_method=AccessMethod.FACE,
-                                                    access_type=AccessType.ENTRY,
-                                                    success=True,
-                                                    details=f"Do tuong dong: {best_similarity:.3f}"
-                                                )
-                                                db.add(log)
-                                                db.commit()
-                                                
-                                                # uart_service.unlock_door(duration=5)
-                                                uart_service.beep(2)
-                                                
-                                                self.last_unlock_time = time.time()
-                                                
-                                            else:
-                                                pass
-                                        finally:
-                                            db.close()
-                                    
-                                    break
-                except Exception:
-                    pass
+            started = time.monotonic()
+            # Annotate a copy: the same frame object is shared with the recognition worker
+            frame = frame.copy()
+            result = self.latest_result
             
-            if recognized_user and time.time() - recognition_time > 3:
-                recognized_user = None
+            if self.recognized_user and time.time() - self.recognition_time > 3:
+                self.recognized_user = None
+            recognized_user = self.recognized_user
             
-            display_name = candidate_name
-            display_score = current_best_similarity
+            height, width = frame.shape[:2]
+            center_box = self._get_center_box(width, height)
+            
+            display_name = result["candidate_name"]
+            display_score = result["similarity"]
             
             if recognized_user:
                 display_name = recognized_user
@@ -263,21 +334,57 @@ class FaceRecognitionStream(metaclass=SingletonMeta):
             frame = self._draw_detection_ui(
                 frame, 
                 center_box, 
-                faces, 
+                result["faces"], 
                 success_user=recognized_user, 
-                in_box=in_box, 
+                in_box=result["in_box"], 
                 display_name=display_name, 
                 display_score=display_score
             )
             
             ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
             if ret:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+                self.hub.publish(buffer.tobytes())
+                self.encode_stats.tick(time.monotonic() - started)
+    
+    def start(self):
+        with self._start_lock:
+            if self.running:
+                return
             
-            time.sleep(0.03)
+            self.running = True
+            self.latest_result = self._empty_result()
+            self.recognition_queue.clear()
+            self.encode_queue.clear()
+            
+            self.threads = [
+                threading.Thread(target=self._capture_loop, name="face-capture", daemon=True),
+                threading.Thread(target=self._recognition_loop, name="face-recognition", daemon=True),
+                threading.Thread(target=self._encode_loop, name="face-encode", daemon=True),
+            ]
+            for thread in self.threads:
+                thread.start()
+            print("Face recognition pipeline started")
+    
+    def get_stats(self) -> dict:
+        return {
+            "running": self.running,
+            "capture": self.capture_stats.snapshot(),
+            "recognition": {**self.recognition_stats.snapshot(), "dropped": self.recognition_queue.dropped},
+            "encode": {**self.encode_stats.snapshot(), "dropped": self.encode_queue.dropped},
+            "tracking": dict(self.tracking_stats),
+            "quality": self.quality_stats.snapshot(),
+            "motion_gate": self.motion_gate.get_stats(),
+            "stream": self.hub.get_stats()
+        }
+    
+    def generate_frames_with_recognition(self) -> Generator[bytes, None, None]:
+        self.start()
+        yield from self.hub.subscribe()
     
     def release(self):
         self.running = False
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.threads = []
 
 face_recognition_stream = FaceRecognitionStream()
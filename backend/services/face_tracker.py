@@ -0,0 +1,174 @@
+import cv2
+import numpy as np
+from typing import List, Optional
+
+from services.uniface import DetectedFace
+
+def _iou(a: np.ndarray, b: np.ndarray) -> float:
+    x1 = max(a[0], b[0])
+    y1 = max(a[1], b[1])
+    x2 = min(a[2], b[2])
+    y2 = min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+class Track:
+    """A face followed across frames, with the identity of its last embedding"""
+
+    def __init__(self, track_id: int, face: DetectedFace):
+        self.id = track_id
+        self.bbox = face.bbox.copy()
+        self.landmarks = None if face.landmarks is None else face.landmarks.copy()
+        self.confidence = face.confidence
+        self.misses = 0
+
+        self.identity: Optional[str] = None
+        self.similarity = 0.0
+        self.embedded_quality = -1.0
+
+    @property
+    def quality(self) -> float:
+        # Detection confidence weighted by face width relative to the 112px ArcFace input
+        width = float(self.bbox[2] - self.bbox[0])
+        return self.confidence * min(1.0, width / 112.0)
+
+    def update(self, face: DetectedFace):
+        self.bbox = face.bbox.copy()
+        self.landmarks = None if face.landmarks is None else face.landmarks.copy()
+        self.confidence = face.confidence
+        self.misses = 0
+
+    def set_identity(self, identity: Optional[str], similarity: float):
+        self.identity = identity
+        self.similarity = similarity
+        self.embedded_quality = self.quality
+
+    def needs_embedding(self, threshold: float, min_quality_gain: float) -> bool:
+        if self.landmarks is None:
+            return False
+        if self.identity is None or self.similarity < threshold:
+            return True
+        return self.quality > self.embedded_quality * (1.0 + min_quality_gain)
+
+class FaceTracker:
+    """
+    Keeps face boxes alive between detector runs.
+    Detections are associated to tracks by greedy IoU; in between, boxes and landmarks are
+    moved with a similarity transform fitted to pyramidal Lucas-Kanade optical flow.
+    The detector is requested again every `interval` frames, when flow is lost, or when
+    the tracked faces move fast.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_misses: int = 1, motion_ratio: float = 0.2):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.motion_ratio = motion_ratio
+        self.tracks: List[Track] = []
+        self._next_id = 1
+        self._prev_gray: Optional[np.ndarray] = None
+        self._frames_since_detect = 0
+        self._force_detect = True
+
+    def reset(self):
+        self.tracks = []
+        self._prev_gray = None
+        self._force_detect = True
+
+    def should_detect(self, interval: int) -> bool:
+        return (
+            self._force_detect
+            or not self.tracks
+            or self._prev_gray is None
+            or self._frames_since_detect >= interval
+        )
+
+    def update(self, faces: List[DetectedFace], gray: Optional[np.ndarray] = None) -> List[Track]:
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for fi, face in enumerate(faces):
+                iou = _iou(track.bbox, face.bbox)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, ti, fi))
+        pairs.sort(reverse=True)
+
+        matched_tracks = set()
+        matched_faces = set()
+        for _, ti, fi in pairs:
+            if ti in matched_tracks or fi in matched_faces:
+                continue
+            self.tracks[ti].update(faces[fi])
+            matched_tracks.add(ti)
+            matched_faces.add(fi)
+
+        tracks = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            tracks.append(track)
+
+        for fi, face in enumerate(faces):
+            if fi not in matched_faces:
+                tracks.append(Track(self._next_id, face))
+                self._next_id += 1
+
+        self.tracks = tracks
+        self._prev_gray = gray
+        self._frames_since_detect = 0
+        self._force_detect = False
+        return [track for track in self.tracks if track.misses == 0]
+
+    def _track_points(self, track: Track) -> np.ndarray:
+        x1, y1, x2, y2 = track.bbox
+        xs = np.linspace(x1, x2, 6)[1:-1]
+        ys = np.linspace(y1, y2, 6)[1:-1]
+        grid = np.array([(x, y) for y in ys for x in xs], dtype=np.float32)
+        if track.landmarks is not None:
+            grid = np.vstack([grid, track.landmarks])
+        return grid.reshape(-1, 1, 2)
+
+    def propagate(self, gray: np.ndarray) -> List[Track]:
+        """Move tracks to `gray` with optical flow; tracks that cannot be followed are dropped"""
+        self._frames_since_detect += 1
+        prev_gray = self._prev_gray
+        self._prev_gray = gray
+        if prev_gray is None:
+            self._force_detect = True
+            return self.tracks
+
+        tracks = []
+        for track in self.tracks:
+            points = self._track_points(track)
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, winSize=(21, 21), maxLevel=2)
+            back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, moved, None, winSize=(21, 21), maxLevel=2)
+
+            # Forward-backward check rejects points that drifted
+            fb_error = np.linalg.norm((points - back).reshape(-1, 2), axis=1)
+            good = (status.reshape(-1) == 1) & (back_status.reshape(-1) == 1) & (fb_error < 1.0)
+            if good.sum() < max(4, len(points) // 2):
+                self._force_detect = True
+                continue
+
+            transform, _ = cv2.estimateAffinePartial2D(points[good], moved[good])
+            if transform is None:
+                self._force_detect = True
+                continue
+
+            corners = np.array([[track.bbox[0], track.bbox[1]], [track.bbox[2], track.bbox[3]]], dtype=np.float32)
+            new_corners = cv2.transform(corners.reshape(-1, 1, 2), transform).reshape(-1, 2)
+
+            width = float(track.bbox[2] - track.bbox[0])
+            shift = float(np.linalg.norm(new_corners.mean(axis=0) - corners.mean(axis=0)))
+            if shift > self.motion_ratio * width:
+                # Fast motion: the next frame gets a fresh detection
+                self._force_detect = True
+
+            track.bbox = np.array([*new_corners[0], *new_corners[1]], dtype=np.float32)
+            if track.landmarks is not None:
+                track.landmarks = cv2.transform(track.landmarks.reshape(-1, 1, 2), transform).reshape(-1, 2)
+            tracks.append(track)
+
+        self.tracks = tracks
+        return tracks
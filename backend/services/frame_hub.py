@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from typing import AsyncGenerator, Dict, Generator, Optional
+
+from services.pipeline import LatestValue
+
+class ViewerSlot:
+    """
+    One counted viewer of a FrameHub. Released at most once, by whichever comes first: the end
+    of the subscription, the response's background task, or garbage collection of a stream
+    that was never started (its generator body, and so its finally, never runs).
+    """
+
+    def __init__(self, hub: "FrameHub"):
+        self._hub = hub
+        self._released = False
+
+    def release(self):
+        with self._hub._lock:
+            if self._released:
+                return
+            self._released = True
+            self._hub.viewers -= 1
+
+    def __del__(self):
+        self.release()
+
+class FrameHub:
+    """
+    Fan-out of one encoded MJPEG stream to any number of viewers.
+    The producer publishes each JPEG once; the multipart chunk is built once and every viewer
+    yields the very same bytes object. Viewers follow the newest frame and skip ahead over the
+    frames they were too slow for, so a slow client never builds a backlog or slows the others.
+    subscribe() blocks a thread per viewer; asubscribe() waits on the event loop instead and is
+    woken by the producer thread through call_soon_threadsafe, once per loop and frame.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._frames = LatestValue()
+        # Reentrant: a ViewerSlot may be collected, and release itself, while the lock is held
+        self._lock = threading.RLock()
+        self.viewers = 0
+        self.published = 0
+        self.skipped = 0
+        self._loop_viewers: Dict[asyncio.AbstractEventLoop, int] = {}
+        self._loop_events: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+
+    def has_viewers(self) -> bool:
+        return self.viewers > 0
+
+    def publish(self, jpeg_bytes: bytes):
+        chunk = (b'--frame\r\n'
+                 b'Content-Type: image/jpeg\r\n\r\n' + jpeg_bytes + b'\r\n')
+        self._frames.put(chunk)
+        self.published += 1
+
+        with self._lock:
+            loops = list(self._loop_viewers)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake, loop)
+            except RuntimeError:
+                # Loop already closed
+                pass
+
+    def _wake(self, loop: asyncio.AbstractEventLoop):
+        # Runs on `loop`: release everyone waiting for this frame, the next waiter gets a fresh event
+        with self._lock:
+            event = self._loop_events.pop(loop, None)
+        if event is not None:
+            event.set()
+
+    def try_reserve(self, max_viewers: Optional[int] = None) -> Optional[ViewerSlot]:
+        """Count a new viewer if fewer than `max_viewers` are watching; None when full"""
+        with self._lock:
+            if max_viewers is not None and self.viewers >= max_viewers:
+                return None
+            self.viewers += 1
+            return ViewerSlot(self)
+
+    def subscribe(self, timeout: float = 1.0, slot: Optional[ViewerSlot] = None) -> Generator[bytes, None, None]:
+        slot = slot or self.try_reserve()
+        try:
+            last_seq, _ = self._frames.peek()
+            while True:
+                seq, chunk = self._frames.wait_newer(last_seq, timeout)
+                if chunk is None:
+                    continue
+                if seq - last_seq > 1:
+                    with self._lock:
+                        self.skipped += seq - last_seq - 1
+                last_seq = seq
+                yield chunk
+        finally:
+            slot.release()
+
+    async def asubscribe(self, timeout: float = 1.0, slot: Optional[ViewerSlot] = None) -> AsyncGenerator[bytes, None]:
+        slot = slot or self.try_reserve()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._loop_viewers[loop] = self._loop_viewers.get(loop, 0) + 1
+        try:
+            last_seq, _ = self._frames.peek()
+            while True:
+                seq, chunk = self._frames.peek()
+                if seq == last_seq:
+                    # No new frame yet: register on this loop's event in the same step as the
+                    # check, so a publish in between still reaches us through _wake
+                    with self._lock:
+                        event = self._loop_events.get(loop)
+                        if event is None:
+                            event = self._loop_events[loop] = asyncio.Event()
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if seq - last_seq > 1:
+                    with self._lock:
+                        self.skipped += seq - last_seq - 1
+                last_seq = seq
+                yield chunk
+        finally:
+            slot.release()
+            with self._lock:
+                remaining = self._loop_viewers.get(loop, 1) - 1
+                if remaining > 0:
+                    self._loop_viewers[loop] = remaining
+                else:
+                    self._loop_viewers.pop(loop, None)
+                    self._loop_events.pop(loop, None)
+
+    def get_stats(self) -> dict:
+        return {
+            "viewers": self.viewers,
+            "published": self.published,
+            "skipped": self.skipped
+        }
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from config import config_manager
+from services.singleton import SingletonMeta
+
+CHUNK_SIZE = 1024 * 1024
+
+class ImageStore(metaclass=SingletonMeta):
+    """
+    Content-addressed storage for registration images.
+    Files are named by the SHA-256 of their bytes (uploads/ab/abcdef....jpg), so identical
+    uploads are stored once and several faces may share a file. Because of that, deleting a face
+    never removes its file directly: collect_garbage() removes files no face references anymore.
+    Downscaled JPEG thumbnails for the frontend live under uploads/thumbs/.
+    """
+
+    def __init__(self, root: str = "uploads"):
+        self.root = root
+        self.thumbs_dir = os.path.join(root, "thumbs")
+        os.makedirs(self.thumbs_dir, exist_ok=True)
+        self._gc_lock = threading.Lock()
+        self._gc_thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _extension(filename: Optional[str]) -> str:
+        extension = os.path.splitext(filename or "")[1].lower()
+        return extension if extension in (".jpg", ".jpeg", ".png", ".bmp", ".webp") else ".jpg"
+
+    def path_for(self, digest: str, extension: str) -> str:
+        return os.path.join(self.root, digest[:2], digest + extension)
+
+    def _commit(self, temp_path: str, digest: str, extension: str) -> str:
+        path = self.path_for(digest, extension)
+        if os.path.exists(path):
+            # Same content already stored; touch it so the GC grace period covers the new reference
+            os.remove(temp_path)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return path
+
+    def _temp_path(self) -> str:
+        return os.path.join(self.root, f".upload-{uuid.uuid4().hex}")
+
+    def put(self, data: bytes, filename: Optional[str] = None) -> str:
+        """Store `data` (blocking; call from a worker thread) and return its path"""
+        digest = hashlib.sha256(data).hexdigest()
+        extension = self._extension(filename)
+        path = self.path_for(digest, extension)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            temp_path = self._temp_path()
+            view = memoryview(data)
+            with open(temp_path, "wb") as f:
+                for offset in range(0, len(view), CHUNK_SIZE):
+                    f.write(view[offset:offset + CHUNK_SIZE])
+            path = self._commit(temp_path, digest, extension)
+        if config_manager.get("image_thumbnails_enabled", True):
+            self.thumbnail(path, data)
+        return path
+
+    async def put_async(self, data: bytes, filename: Optional[str] = None) -> str:
+        return await run_in_threadpool(self.put, data, filename)
+
+    async def put_upload(self, upload: UploadFile) -> Tuple[str, bytes]:
+        """Stream an upload to disk chunk by chunk, hashing as it goes; returns (path, bytes)"""
+        temp_path = self._temp_path()
+        hasher = hashlib.sha256()
+        data = bytearray()
+        f = await run_in_threadpool(open, temp_path, "wb")
+        try:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                data.extend(chunk)
+                await run_in_threadpool(f.write, chunk)
+        finally:
+            await run_in_threadpool(f.close)
+        path = await run_in_threadpool(self._commit, temp_path, hasher.hexdigest(), self._extension(upload.filename))
+        if config_manager.get("image_thumbnails_enabled", True):
+            await run_in_threadpool(self.thumbnail, path, bytes(data))
+        return path, bytes(data)
+
+    def thumbnail_path(self, path: str) -> str:
+        return os.path.join(self.thumbs_dir, os.path.splitext(os.path.basename(path))[0] + ".jpg")
+
+    def thumbnail(self, path: str, data: Optional[bytes] = None) -> Optional[str]:
+        """Path of the downscaled JPEG of `path`, created on first use; None if the image is unreadable"""
+        thumb_path = self.thumbnail_path(path)
+        if os.path.exists(thumb_path):
+            return thumb_path
+        if data is None:
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        size = config_manager.get("image_thumbnail_size", 160)
+        height, width = image.shape[:2]
+        scale = size / max(height, width)
+        if scale < 1.0:
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ret:
+            return None
+
+        temp_path = thumb_path + f".{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(buffer.tobytes())
+        os.replace(temp_path, thumb_path)
+        return thumb_path
+
+    def collect_garbage(self, grace_seconds: Optional[float] = None) -> dict:
+        """
+        Delete stored images no face references, and thumbnails of missing images.
+        Files younger than `grace_seconds` are kept: their face row may not be committed yet.
+        """
+        from database import SessionLocal
+        from models import Face
+
+        if grace_seconds is None:
+            grace_seconds = config_manager.get("image_gc_grace_seconds", 600)
+        db = SessionLocal()
+        try:
+            referenced = {
+                os.path.normpath(path)
+                for (path,) in db.query(Face.image_path).filter(Face.image_path.isnot(None)).all()
+            }
+        finally:
+            db.close()
+        referenced_stems = {os.path.splitext(os.path.basename(path))[0] for path in referenced}
+
+        cutoff = time.time() - grace_seconds
+        removed = kept = freed = 0
+        for directory, _, files in os.walk(self.root):
+            in_thumbs = os.path.normpath(directory) == os.path.normpath(self.thumbs_dir)
+            for name in files:
+                if name.startswith(".") and not name.startswith(".upload-"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime > cutoff:
+                    kept += 1
+                    continue
+                if in_thumbs:
+                    orphan = os.path.splitext(name)[0] not in referenced_stems
+                else:
+                    orphan = os.path.normpath(path) not in referenced
+                if not orphan:
+                    kept += 1
+                    continue
+                try:
+                    os.remove(path)
+                    removed += 1
+                    freed += stat.st_size
+                except OSError:
+                    pass
+
+        if removed:
+            print(f"Image store GC: removed {removed} files ({freed / 1e6:.1f} MB)")
+        return {"removed": removed, "kept": kept, "freed_bytes": freed}
+
+    def schedule_gc(self):
+        """Run collect_garbage() on a background thread (no-op if one is already running)"""
+        with self._gc_lock:
+            if self._gc_thread is not None and self._gc_thread.is_alive():
+                return
+            self._gc_thread = threading.Thread(target=self.collect_garbage, name="image-gc", daemon=True)
+            self._gc_thread.start()
+
+image_store = ImageStore()
@@ -0,0 +1,120 @@
+import os
+import time
+import cv2
+import numpy as np
+from typing import List, Optional, Tuple
+
+from config import config_manager, INFERENCE_PROFILES
+from database import SessionLocal
+from models import Face
+from services.face_gallery import face_gallery
+from services.uniface import DetectedFace, build_models
+
+def load_benchmark_images(max_images: int = 20) -> List[Tuple[np.ndarray, int]]:
+    """Registered face images from uploads/, decoded to BGR, with the id of the user they belong to"""
+    db = SessionLocal()
+    try:
+        rows = db.query(Face.image_path, Face.user_id).filter(Face.image_path.isnot(None)).all()
+    finally:
+        db.close()
+
+    samples = []
+    for path, user_id in rows:
+        if len(samples) >= max_images:
+            break
+        if os.path.exists(path):
+            image = cv2.imread(path)
+            if image is not None:
+                samples.append((image, user_id))
+    return samples
+
+def _profile_settings(name: str) -> dict:
+    # Model paths always come from the live config, presets only change runtime settings
+    profile = config_manager.get_inference_profile()
+    if name in INFERENCE_PROFILES:
+        profile.update(INFERENCE_PROFILES[name])
+    return profile
+
+def _run_models(detector, recognizer, image: np.ndarray):
+    """Detect, then embed the largest face; returns (seconds, bbox, embedding)"""
+    started = time.perf_counter()
+    detections = detector.detect(image)
+    # Some detectors return arrays, whose truth value is ambiguous
+    if detections is None or len(detections) == 0:
+        detections = []
+    faces = [DetectedFace.from_detection(face) for face in detections]
+    faces = [face for face in faces if face is not None and face.landmarks is not None]
+
+    bbox, embedding = None, None
+    if faces:
+        face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+        bbox = face.bbox
+        embedding = np.asarray(recognizer.get_normalized_embedding(image, face.landmarks), dtype=np.float32).reshape(-1)
+    return time.perf_counter() - started, bbox, embedding
+
+def _iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+def _evaluate(name: str, images: List[np.ndarray]):
+    detector, recognizer = build_models(_profile_settings(name))
+    _run_models(detector, recognizer, images[0])  # warm-up, excluded from timing
+    return [_run_models(detector, recognizer, image) for image in images]
+
+def run_benchmark(samples: List[Tuple[np.ndarray, int]], profiles: Optional[List[str]] = None) -> List[dict]:
+    """
+    Latency and accuracy of each inference profile on the same (image, user_id) samples.
+    - identification_accuracy: images whose gallery match, above face_similarity_threshold,
+      is the user the image is registered to (the gallery holds these images, so this is an
+      upper bound for unseen images)
+    Compared with the "accurate" profile (fp32, full resolution):
+    - detection_agreement: images where both found the same largest face (IoU >= 0.5) or both found none
+    - embedding_similarity: mean cosine between the profile's and the reference embedding
+    """
+    profiles = profiles or list(INFERENCE_PROFILES)
+    images = [image for image, _ in samples]
+    user_ids = [user_id for _, user_id in samples]
+    threshold = config_manager.get("face_similarity_threshold", 0.7)
+    reference = _evaluate("accurate", images)
+
+    results = []
+    for name in profiles:
+        try:
+            runs = reference if name == "accurate" else _evaluate(name, images)
+        except Exception as e:
+            results.append({"profile": name, "error": str(e)})
+            continue
+
+        latencies = np.array([seconds for seconds, _, _ in runs]) * 1000
+        detections = 0
+        similarities = []
+        identified = 0
+        for (_, bbox, emb), (_, ref_bbox, ref_emb), user_id in zip(runs, reference, user_ids):
+            if emb is not None:
+                _, match_id, score = face_gallery.match(emb)
+                if match_id == user_id and score >= threshold:
+                    identified += 1
+            if bbox is None and ref_bbox is None:
+                detections += 1
+                continue
+            if bbox is None or ref_bbox is None:
+                continue
+            if _iou(bbox, ref_bbox) >= 0.5:
+                detections += 1
+            if emb is not None and ref_emb is not None:
+                similarities.append(float(emb @ ref_emb / (np.linalg.norm(emb) * np.linalg.norm(ref_emb))))
+
+        results.append({
+            "profile": name,
+            "settings": INFERENCE_PROFILES.get(name, {}),
+            "images": len(images),
+            "latency_ms_mean": round(float(latencies.mean()), 1),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 1),
+            "detection_agreement": round(detections / len(images), 3),
+            "embedding_similarity": round(float(np.mean(similarities)), 4) if similarities else None,
+            "identification_accuracy": round(identified / len(images), 3)
+        })
+    return results
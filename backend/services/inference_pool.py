@@ -0,0 +1,265 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config import config_manager
+from services.singleton import SingletonMeta
+
+# Workers are spawned, not forked: a fork taken while the model loader thread holds its lock
+# (or mid-load) would inherit that state and hang in the initializer
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+class InferencePoolBusy(Exception):
+    """Raised when the inference queue is full; callers should answer 503"""
+
+# Worker-side functions. Each worker process loads its own UnifaceService models in the
+# initializer; in thread mode they share the main process instance.
+
+_worker_profile: Optional[dict] = None
+
+def _worker_service():
+    from services.uniface import UnifaceService
+    service = UnifaceService()
+    if not service.is_ready() and not service.load_models(_worker_profile):
+        raise RuntimeError(f"Face models failed to load: {service.error}")
+    return service
+
+def _init_worker(profile: Optional[dict] = None, shared: bool = False):
+    # Worker processes do not see runtime config changes, so the profile is passed in and
+    # always loaded. A shared (thread mode) worker uses the API process models, which
+    # UnifaceService.reload() keeps on the current profile.
+    global _worker_profile
+    _worker_profile = profile
+    from services.uniface import UnifaceService
+    service = UnifaceService()
+    if not shared:
+        service.load_models(profile, force=True)
+    elif not service.is_ready():
+        service.load_models(profile)
+
+def _lower_priority(niceness: int = 10):
+    # On Linux niceness is per thread; called before the models load, so the onnxruntime
+    # threads created by the session inherit it
+    if hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+        except OSError:
+            pass
+
+def _init_background_worker(profile: Optional[dict] = None):
+    _lower_priority()
+    _init_worker(profile)
+
+def _warmup() -> int:
+    # The initializer cannot fail without breaking the pool, so a failed load surfaces
+    # here and turns the pool status into "failed"
+    from services.uniface import UnifaceService
+    service = UnifaceService()
+    if not service.is_ready():
+        raise RuntimeError(f"Face models failed to load: {service.error}")
+    return os.getpid()
+
+def _extract_embeddings(image_bytes: bytes) -> Optional[np.ndarray]:
+    return _worker_service().extract_embeddings(image_bytes)
+
+def _extract_embeddings_from_array(image_bgr: np.ndarray) -> Optional[np.ndarray]:
+    return _worker_service().extract_embeddings_from_array(image_bgr)
+
+def _extract_samples(images: List[bytes]):
+    return _worker_service().extract_samples(images)
+
+class InferencePool(metaclass=SingletonMeta):
+    """
+    Runs face detection/embedding off the event loop.
+    With inference_workers > 0 the work goes to that many processes, each holding its own
+    models, so concurrent requests scale across cores; with 0 it runs on one thread in this
+    process. At most inference_queue_depth requests may be queued or running, beyond that
+    submit() fails fast with InferencePoolBusy instead of building an unbounded backlog.
+    Batch jobs (re-embedding) use a separate single worker process at low OS priority via
+    run_background(), also with inference_workers = 0: a thread in this process could only
+    renice itself, not the onnxruntime threads it shares with the API.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._workers = 0
+        self._pending = 0
+        self._warmup_futures = []
+        self._background: Optional[Executor] = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._latency = 0.0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._workers = max(0, config_manager.get("inference_workers", 2))
+                profile = config_manager.get_inference_profile()
+                if self._workers > 0:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self._workers, mp_context=_MP_CONTEXT,
+                        initializer=_init_worker, initargs=(profile,)
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix="inference", initializer=_init_worker, initargs=(profile, True)
+                    )
+                print(f"Inference pool started ({self._workers or 'in-process'} workers)")
+            return self._executor
+
+    def start(self):
+        """Create the pool and load the models in every worker ahead of the first request"""
+        executor = self._get_executor()
+        self._warmup_futures = [executor.submit(_warmup) for _ in range(max(1, self._workers))]
+
+    @property
+    def status(self) -> str:
+        """loading until every worker has its models, then ready (or failed)"""
+        if self._executor is None:
+            return "stopped"
+        futures = self._warmup_futures
+        if any(f.done() and not f.cancelled() and f.exception() is not None for f in futures):
+            return "failed"
+        if all(f.done() for f in futures):
+            return "ready"
+        return "loading"
+
+    def is_ready(self) -> bool:
+        return self.status == "ready"
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.stop_background()
+
+    def _get_background_executor(self) -> Executor:
+        with self._lock:
+            if self._background is None:
+                # One onnxruntime thread, so a batch job takes at most one core from the API
+                profile = {
+                    **config_manager.get_inference_profile(),
+                    "inference_intra_op_threads": 1,
+                    "inference_inter_op_threads": 1,
+                }
+                self._background = ProcessPoolExecutor(
+                    max_workers=1, mp_context=_MP_CONTEXT,
+                    initializer=_init_background_worker, initargs=(profile,)
+                )
+            return self._background
+
+    def run_background(self, fn, *args):
+        """Blocking call on the low-priority background worker; not counted against the queue depth"""
+        executor = self._get_background_executor()
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # Only the broken executor is dropped; the next call creates a new one
+            self.stop_background(executor)
+            raise
+
+    def stop_background(self, executor: Optional[Executor] = None):
+        """Shut down the background worker (only if it is still `executor`, when given)"""
+        with self._lock:
+            if executor is not None and executor is not self._background:
+                return
+            executor = self._background
+            self._background = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def is_busy(self) -> bool:
+        """True while interactive requests are queued or running"""
+        return self._pending > 0
+
+    def restart(self):
+        self.shutdown()
+        self.start()
+
+    def _replace_broken(self, executor: Executor):
+        """Rebuild the interactive pool after a worker died; the background worker is left alone"""
+        with self._lock:
+            if self._executor is not executor:
+                # Another request already replaced it
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        print("Inference worker died, restarting the pool")
+        self.start()
+
+    async def submit(self, fn, *args):
+        max_depth = config_manager.get("inference_queue_depth", 8)
+        with self._lock:
+            if self._pending >= max_depth:
+                self.rejected += 1
+                raise InferencePoolBusy(f"Inference queue is full ({self._pending} pending)")
+            self._pending += 1
+            self.submitted += 1
+
+        started = time.monotonic()
+        executor = None
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            result = await loop.run_in_executor(executor, fn, *args)
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.completed += 1
+                self._latency = elapsed if not self._latency else 0.9 * self._latency + 0.1 * elapsed
+            return result
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory): replace the pool and reload its models
+            with self._lock:
+                self.failed += 1
+            self._replace_broken(executor)
+            raise
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def extract_embeddings(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        return await self.submit(_extract_embeddings, image_bytes)
+
+    async def extract_embeddings_from_array(self, image_bgr: np.ndarray) -> Optional[np.ndarray]:
+        # In-process workers get the frame itself; worker processes receive a pickled copy,
+        # which is still cheaper than a JPEG encode/decode round trip
+        return await self.submit(_extract_embeddings_from_array, image_bgr)
+
+    async def extract_samples(self, images: List[bytes]) -> List[Optional[Tuple[np.ndarray, float]]]:
+        return await self.submit(_extract_samples, images)
+
+    def extract_samples_background(self, images: List[bytes]) -> List[Optional[Tuple[np.ndarray, float]]]:
+        return self.run_background(_extract_samples, images)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "status": self.status,
+                "workers": self._workers,
+                "pending": self._pending,
+                "queue_depth": config_manager.get("inference_queue_depth", 8),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "latency_ms": round(self._latency * 1000, 1)
+            }
+
+inference_pool = InferencePool()
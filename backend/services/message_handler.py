@@ -4,41 +4,19 @@ from services.websocket import websocket_manager
 from database import SessionLocal
 from models import KeypadPassword, AccessLog, AccessMethod, AccessType, Fingerprint
 import hashlib
-import asyncio
-
-sensor_fingerprints = []
-sensor_listing_complete = False
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
-def broadcast_async(payload: dict):
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    if loop.is_running():
-        loop.create_task(websocket_manager.broadcast(payload))
-    else:
-        loop.run_until_complete(websocket_manager.broadcast(payload))
-
 def handle_esp32_message(message: dict):
-    global sensor_fingerprints, sensor_listing_complete
+    # Answers to pending commands (fingerprint listing, delete, clear, enroll)
+    uart_service.requests.feed(message)
     
     msg_type = message.get("type")
     status_value = message.get("status")
     
     if status_value and not msg_type:
-        if status_value == "listing_fingerprints":
-            sensor_fingerprints = []
-            sensor_listing_complete = False
-        elif status_value == "listing_complete":
-            sensor_listing_complete = True
-        elif status_value == "all_fingerprints_cleared":
-            pass
-        elif status_value in ["place_finger", "remove_finger", "place_again", "enrollment_started"]:
+        if status_value in ["place_finger", "remove_finger", "place_again", "enrollment_started"]:
             try:
                 messages = {
                     "enrollment_started": "Đang bắt đầu đăng ký vân tay...",
@@ -53,14 +31,12 @@ def handle_esp32_message(message: dict):
                     "message": messages.get(status_value, status_value)
                 }
                 
-                broadcast_async(payload)
+                websocket_manager.broadcast_threadsafe(payload)
             except Exception:
                 pass
         return
     
     if "fingerprint_found" in message:
-        fingerprint_id = message.get("fingerprint_found")
-        sensor_fingerprints.append(fingerprint_id)
         return
     
     if msg_type == "fingerprint":
@@ -86,7 +62,7 @@ def handle_esp32_message(message: dict):
                             "message": f"Đăng ký vân tay ID {enrolled_id} thành công!"
                         }
                         
-                        broadcast_async(payload)
+                        websocket_manager.broadcast_threadsafe(payload)
                     except Exception:
                         pass
             finally:
@@ -101,7 +77,7 @@ def handle_esp32_message(message: dict):
                     "message": f"Đăng ký vân tay thất bại! Mã lỗi: {error_code}"
                 }
                 
-                broadcast_async(payload)
+                websocket_manager.broadcast_threadsafe(payload)
             except Exception:
                 pass
         
@@ -137,7 +113,7 @@ def handle_esp32_message(message: dict):
                                 "user_name": fingerprint.user.name
                             }
                             
-                            broadcast_async(payload)
+                            websocket_manager.broadcast_threadsafe(payload)
                         except:
                             pass
                             
@@ -150,7 +126,7 @@ def handle_esp32_message(message: dict):
                                 "message": "Vân tay không hợp lệ hoặc chưa được kích hoạt"
                             }
                             
-                            broadcast_async(payload)
+                            websocket_manager.broadcast_threadsafe(payload)
                         except:
                             pass
                         
@@ -0,0 +1,96 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+Color = Tuple[int, int, int]
+
+class OverlayRenderer:
+    """
+    Draws text onto BGR frames without converting the whole frame to PIL.
+    Fonts are loaded once per size, and each (text, size, color, background) is rasterized
+    once into a small BGR sprite plus alpha mask kept in an LRU cache; drawing is an
+    alpha blend of that sprite into the frame region.
+    """
+
+    def __init__(self, font_path: str = "arial.ttf", cache_size: int = 256):
+        self.font_path = font_path
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._fonts = {}
+        self._sprites: "OrderedDict[tuple, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+
+    def _font(self, size: int):
+        font = self._fonts.get(size)
+        if font is None:
+            try:
+                font = ImageFont.truetype(self.font_path, size)
+            except IOError:
+                font = ImageFont.load_default()
+            self._fonts[size] = font
+        return font
+
+    def _render(self, text: str, size: int, color: Color, background: Optional[Color], padding: Tuple[int, int]):
+        font = self._font(size)
+        left, top, right, bottom = font.getbbox(text)
+        pad_x, pad_y = padding if background is not None else (0, 0)
+        width = max(1, right - left + 2 * pad_x)
+        height = max(1, bottom - top + 2 * pad_y)
+
+        mask = Image.new("L", (width, height), 0)
+        ImageDraw.Draw(mask).text((pad_x - left, pad_y - top), text, font=font, fill=255)
+        text_alpha = np.asarray(mask, dtype=np.float32)[:, :, None] / 255.0
+
+        # Colors are BGR like the frame
+        foreground = np.array(color, dtype=np.float32)
+        if background is None:
+            sprite = np.broadcast_to(foreground, (height, width, 3)).astype(np.float32)
+            alpha = text_alpha
+        else:
+            back = np.array(background, dtype=np.float32)
+            sprite = back + (foreground - back) * text_alpha
+            alpha = np.ones((height, width, 1), dtype=np.float32)
+        return sprite, alpha
+
+    def _sprite(self, text: str, size: int, color: Color, background: Optional[Color], padding: Tuple[int, int]):
+        key = (text, size, color, background, padding)
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                return sprite
+
+        sprite = self._render(text, size, color, background, padding)
+
+        with self._lock:
+            self._sprites[key] = sprite
+            while len(self._sprites) > self.cache_size:
+                self._sprites.popitem(last=False)
+        return sprite
+
+    def text_size(self, text: str, size: int, background: Optional[Color] = None, padding: Tuple[int, int] = (10, 5)) -> Tuple[int, int]:
+        sprite, _ = self._sprite(text, size, (255, 255, 255), background, padding)
+        return sprite.shape[1], sprite.shape[0]
+
+    def draw_text(self, frame: np.ndarray, text: str, x: int, y: int, size: int, color: Color,
+                  background: Optional[Color] = None, padding: Tuple[int, int] = (10, 5)) -> Tuple[int, int]:
+        """Blend `text` into `frame` in place with its top-left corner at (x, y); returns the sprite size"""
+        sprite, alpha = self._sprite(text, size, tuple(color), None if background is None else tuple(background), padding)
+        height, width = sprite.shape[:2]
+        frame_h, frame_w = frame.shape[:2]
+
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(frame_w, x + width), min(frame_h, y + height)
+        if x2 <= x1 or y2 <= y1:
+            return width, height
+
+        sx, sy = x1 - x, y1 - y
+        region = frame[y1:y2, x1:x2]
+        sprite_part = sprite[sy:sy + (y2 - y1), sx:sx + (x2 - x1)]
+        alpha_part = alpha[sy:sy + (y2 - y1), sx:sx + (x2 - x1)]
+        region[:] = (sprite_part * alpha_part + region * (1.0 - alpha_part)).astype(np.uint8)
+        return width, height
+
+overlay_renderer = OverlayRenderer()
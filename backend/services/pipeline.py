@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+class LatestValue:
+    """
+    Bounded queue of size one that only keeps the newest item.
+    put() never blocks: an item that was not consumed yet is overwritten and counted as dropped,
+    so a slow consumer always sees the most recent value instead of a backlog.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item: Any = None
+        self._seq = 0
+        self._consumed_seq = 0
+        self.dropped = 0
+
+    def put(self, item: Any):
+        with self._cond:
+            if self._seq > self._consumed_seq:
+                self.dropped += 1
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """Wait for an item newer than the last one consumed; returns None on timeout"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > self._consumed_seq, timeout):
+                return None
+            self._consumed_seq = self._seq
+            return self._item
+
+    def wait_newer(self, seq: int, timeout: Optional[float] = None) -> Tuple[int, Any]:
+        """
+        Wait for an item with sequence number greater than `seq` without consuming it,
+        so any number of readers can follow the same value; returns (seq, None) on timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > seq, timeout):
+                return seq, None
+            return self._seq, self._item
+
+    def peek(self) -> Tuple[int, Any]:
+        with self._cond:
+            return self._seq, self._item
+
+    def clear(self):
+        with self._cond:
+            self._item = None
+            self._consumed_seq = self._seq
+
+class StageStats:
+    """Frame counter with an exponentially smoothed FPS estimate"""
+
+    def __init__(self, smoothing: float = 0.9):
+        self._lock = threading.Lock()
+        self._smoothing = smoothing
+        self._last_tick: Optional[float] = None
+        self._interval = 0.0
+        self._busy = 0.0
+        self.frames = 0
+
+    def tick(self, busy_seconds: float = 0.0):
+        now = time.monotonic()
+        with self._lock:
+            self.frames += 1
+            if self._last_tick is not None:
+                interval = now - self._last_tick
+                if self._interval == 0.0:
+                    self._interval = interval
+                    self._busy = busy_seconds
+                else:
+                    self._interval = self._smoothing * self._interval + (1 - self._smoothing) * interval
+                    self._busy = self._smoothing * self._busy + (1 - self._smoothing) * busy_seconds
+            self._last_tick = now
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stale = self._last_tick is None or time.monotonic() - self._last_tick > 2.0
+            fps = 0.0 if stale or self._interval <= 0 else 1.0 / self._interval
+            return {
+                "frames": self.frames,
+                "fps": round(fps, 1),
+                "latency_ms": round(self._busy * 1000, 1)
+            }
@@ -0,0 +1,187 @@
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import or_, select, update
+
+from config import config_manager
+from database import SessionLocal
+from models import Face, FaceKind, User
+from services.face_enrollment import encode_for_storage, rebuild_centroid
+from services.inference_pool import inference_pool
+from services.singleton import SingletonMeta
+from services.uniface import uniface_service
+from services.websocket import websocket_manager
+
+class ReembedJob(metaclass=SingletonMeta):
+    """
+    Regenerates stored embeddings from the registration images, after a model change (see
+    FaceGallery, which leaves rows of another model out of matching) or on request.
+    Images go through the inference pool's low-priority background worker in batches, and
+    results are written to the staged_* columns one transaction per batch, so an interrupted
+    job resumes where it stopped. When every image is done the staged embeddings replace the
+    live ones in one transaction and the gallery is swapped. Progress is broadcast over the
+    WebSocket as "reembed_progress" events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._cancel = threading.Event()
+        self._finished_version: Optional[str] = None
+
+        self.state = "idle"  # idle / running / cancelled / done / failed
+        self.force = False
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def schedule(self, force: bool = False, automatic: bool = True) -> bool:
+        """
+        Start the job in the background unless it is already running.
+        With force=True every sample is re-embedded, not only those of another model.
+        Automatic runs happen once per model version, so images that cannot be re-embedded
+        are not retried forever.
+        """
+        with self._lock:
+            if self.is_running():
+                return False
+            if automatic and not force and self._finished_version == uniface_service.model_version:
+                return False
+            self.force = force
+            self._cancel.clear()
+            self._thread = threading.Thread(target=self._run, name="reembed", daemon=True)
+            self._thread.start()
+            return True
+
+    def cancel(self) -> bool:
+        """Stop after the current batch; staged results are kept and the next run resumes"""
+        if not self.is_running():
+            return False
+        self._cancel.set()
+        return True
+
+    def _broadcast(self):
+        websocket_manager.broadcast_threadsafe({"type": "reembed_progress", **self.get_status()})
+
+    def _pending_query(self, db, version: str):
+        """Samples that still need an embedding for `version`"""
+        query = db.query(Face.id, Face.image_path).filter(
+            Face.kind == FaceKind.SAMPLE,
+            or_(Face.staged_model_version.is_(None), Face.staged_model_version != version)
+        )
+        if not self.force:
+            query = query.filter(Face.model_version.isnot(None), Face.model_version != version)
+        return query.order_by(Face.id)
+
+    def _run(self):
+        from services.face_gallery import face_gallery
+
+        if not uniface_service.load_models():
+            self.state, self.error = "failed", "Face models are not available"
+            self._broadcast()
+            return
+
+        version = uniface_service.model_version
+        batch_size = max(1, config_manager.get("reembed_batch_size", 8))
+        self.state, self.error = "running", None
+        self.failed = 0
+
+        db = SessionLocal()
+        try:
+            pending = self._pending_query(db, version).all()
+            self.processed = db.query(Face).filter(Face.staged_model_version == version).count()
+            self.total = self.processed + len(pending)
+            self._broadcast()
+
+            for start in range(0, len(pending), batch_size):
+                if self._cancel.is_set():
+                    self.state = "cancelled"
+                    return
+
+                # Interactive requests go first
+                while inference_pool.is_busy() and not self._cancel.is_set():
+                    time.sleep(0.05)
+
+                batch = pending[start:start + batch_size]
+                images = []
+                for _, image_path in batch:
+                    try:
+                        with open(image_path, "rb") as f:
+                            images.append(f.read())
+                    except (OSError, TypeError):
+                        images.append(b"")
+
+                results = inference_pool.extract_samples_background(images)
+
+                rows = []
+                for (face_id, _), result in zip(batch, results):
+                    if result is None:
+                        self.failed += 1
+                        continue
+                    embedding, quality = result
+                    rows.append({
+                        "id": face_id,
+                        "staged_embedding": encode_for_storage(embedding),
+                        "staged_quality": quality,
+                        "staged_model_version": version
+                    })
+                if rows:
+                    db.execute(update(Face), rows)
+                    db.commit()
+                self.processed += len(rows)
+                self._broadcast()
+
+            self._swap(db, version)
+            face_gallery.reload()
+            self.state = "done"
+            self._finished_version = version
+            print(f"Re-embedding finished: {self.processed} updated, {self.failed} failed")
+        except Exception as e:
+            db.rollback()
+            self.state, self.error = "failed", str(e)
+            self._finished_version = version
+            print(f"Re-embedding failed: {e}")
+            face_gallery.invalidate()
+        finally:
+            db.close()
+            inference_pool.stop_background()
+            self._broadcast()
+
+    def _swap(self, db, version: str):
+        """Replace the live embeddings with the staged ones and rebuild centroids, in one transaction"""
+        user_ids = db.scalars(
+            select(Face.user_id).where(Face.staged_model_version == version).distinct()
+        ).all()
+        db.execute(
+            update(Face)
+            .where(Face.staged_model_version == version)
+            .values(
+                face_embedding=Face.staged_embedding,
+                quality=Face.staged_quality,
+                model_version=Face.staged_model_version,
+                staged_embedding=None,
+                staged_quality=None,
+                staged_model_version=None
+            )
+            .execution_options(synchronize_session=False)
+        )
+        for user in db.query(User).filter(User.id.in_(user_ids)).all():
+            rebuild_centroid(db, user)
+        db.commit()
+
+    def get_status(self) -> dict:
+        return {
+            "state": self.state,
+            "force": self.force,
+            "total": self.total,
+            "processed": self.processed,
+            "failed": self.failed,
+            "error": self.error
+        }
+
+reembed_job = ReembedJob()
@@ -26,15 +26,39 @@ Messages FROM Backend to ESP32:
 
 4. Beep:
    {"cmd": "beep", "times": 2}
+
+Binary framing (uart_framing = "binary"): after connecting, the backend offers
+   {"cmd": "hello", "proto": 1, "framing": "binary"}
+and switches its outgoing messages to the binary frames of services/uart_framing.py if the
+ESP32 answers {"status": "hello", "proto": 1, "framing": "binary"}. Firmware that does not
+answer keeps JSON. Incoming data is accepted in both framings at any time.
 """
 
 import serial
-import json
+import asyncio
 import threading
 import time
 from typing import Callable, Optional
 
 from services.singleton import SingletonMeta
+from services.uart_dispatcher import message_dispatcher
+from services.uart_framing import PROTOCOL_VERSION, StreamDecoder, encode_frame, encode_line
+from services.uart_requests import PendingRequest, RequestTracker, UARTRequestTimeout
+from services.uart_writer import UARTWriter
+from services.websocket import websocket_manager
+
+class _SerialProtocol(asyncio.Protocol):
+    """asyncio side of the "asyncio" reader mode: bytes arrive through the event loop's selector"""
+
+    def __init__(self, service: "UARTService"):
+        self.service = service
+
+    def data_received(self, data: bytes):
+        self.service._on_data(data)
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            print(f"ESP32 serial connection lost: {exc}")
 
 class UARTService(metaclass=SingletonMeta):
     def __init__(self):
@@ -47,6 +71,20 @@ class UARTService(metaclass=SingletonMeta):
         self.listener_thread: Optional[threading.Thread] = None
         self.message_callback: Optional[Callable] = None
         
+        # "asyncio" reader mode: serial transport on the app loop
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._transport = None
+        
+        self.stats = {"bytes_received": 0, "reads": 0, "messages_received": 0}
+        self.decoder = StreamDecoder()
+        # Outgoing framing: "json" until the ESP32 accepts binary in the hello handshake
+        self.framing = "json"
+        
+        # Every outgoing message goes through this queue and its single writer thread
+        self.writer = UARTWriter(self._encode, self._write)
+        # Commands awaiting an answer; resolved by handle_esp32_message on the dispatcher thread
+        self.requests = RequestTracker()
+        
     def connect(self, port: str = None, baudrate: int = None):
 
         if port:
@@ -61,60 +99,93 @@ class UARTService(metaclass=SingletonMeta):
                 timeout=1
             )
             print(f"Connected to ESP32 on {self.port} at {self.baudrate} baud")
+            self.framing = "json"
+            self.decoder.reset()
+            self.configure_writer()
+            self.writer.start()
             return True
         except serial.SerialException as e:
             print(f"Failed to connect to ESP32: {e}")
             return False
     
+    def configure_writer(self):
+        # 8N1 framing: 10 bits on the wire per byte
+        rate = self.config_manager.get("uart_write_bytes_per_second", 0) or self.baudrate / 10
+        self.writer.configure(rate, self.config_manager.get("uart_write_burst", 256))
+    
     def disconnect(self):
         self.running = False
+        self.writer.stop()
+        # Nothing sent before will be answered; callers stop waiting instead of timing out
+        self.requests.fail_all(ConnectionError("ESP32 disconnected"))
+        self._stop_transport()
+        if self.serial_conn and self.serial_conn.is_open:
+            try:
+                # Wake the reader thread out of its blocking read
+                self.serial_conn.cancel_read()
+            except Exception:
+                pass
         if self.listener_thread:
             self.listener_thread.join(timeout=2)
+            self.listener_thread = None
         if self.serial_conn and self.serial_conn.is_open:
             self.serial_conn.close()
             print("Disconnected from ESP32")
     
+    def _stop_transport(self):
+        transport, loop = self._transport, self._loop
+        self._transport = None
+        if transport is None or loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            transport.close()
+        else:
+            loop.call_soon_threadsafe(transport.close)
+    
     def send_message(self, message: dict) -> bool:
         if not self.serial_conn or not self.serial_conn.is_open:
             print("Serial connection not open")
             
             # Broadcast error to frontend
-            try:
-                from services.websocket import websocket_manager
-                import asyncio
-                
-                payload = {
-                    "type": "system_error",
-                    "message": "Không kết nối được với mạch (Serial connection not open)"
-                }
-                
-                loop = None
-                try:
-                    loop = asyncio.get_event_loop()
-                except RuntimeError:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                
-                if loop.is_running():
-                    loop.create_task(websocket_manager.broadcast(payload))
-                else:
-                    loop.run_until_complete(websocket_manager.broadcast(payload))
-            except Exception as e:
-                print(f"Failed to broadcast error: {e}")
+            websocket_manager.broadcast_threadsafe({
+                "type": "system_error",
+                "message": "Không kết nối được với mạch (Serial connection not open)"
+            })
                 
             return False
         
-        try:
-            json_str = json.dumps(message) + "\n"
-            self.serial_conn.write(json_str.encode('utf-8'))
-            print(f"Sent to ESP32: {message}")
-            return True
-        except Exception as e:
-            print(f"Error sending message: {e}")
-            return False
+        return self.writer.submit(message)
     
     def send_command(self, message: dict) -> bool:
         return self.send_message(message)
+    
+    def start_request(self, message: dict) -> PendingRequest:
+        """
+        Send a command that the ESP32 answers (see uart_requests.RESPONSES) and return its
+        pending request, to await or stream. Call from the app loop; raises ConnectionError
+        if the command could not be queued.
+        """
+        request = self.requests.register(message)
+        if request is None:
+            raise ValueError(f"ESP32 command without response: {message.get('cmd')}")
+        if not self.send_message(message):
+            self.requests.discard(request)
+            raise ConnectionError("Serial connection not open")
+        return request
+    
+    async def request(self, message: dict, timeout: Optional[float] = None) -> dict:
+        """Send a command and wait for its answer; raises ConnectionError or UARTRequestTimeout"""
+        if timeout is None:
+            timeout = self.config_manager.get("uart_request_timeout", 5.0)
+        request = self.start_request(message)
+        try:
+            return await request.wait(timeout)
+        finally:
+            self.requests.discard(request)
 
     def unlock_door(self):
         return self.send_message({"cmd": "unlock"})
@@ -128,29 +199,118 @@ class UARTService(metaclass=SingletonMeta):
     def beep(self, times: int = 1):
         return self.send_message({"cmd": "beep", "times": times})
     
+    def _encode(self, message: dict) -> bytes:
+        return encode_frame(message) if self.framing == "binary" else encode_line(message)
+    
+    async def negotiate_framing(self) -> str:
+        """Offer binary framing; stays on JSON unless the ESP32 answers the hello with binary"""
+        try:
+            result = await self.request({"cmd": "hello", "proto": PROTOCOL_VERSION, "framing": "binary"})
+        except (ConnectionError, UARTRequestTimeout):
+            print("ESP32 did not answer the hello handshake, keeping JSON framing")
+            return self.framing
+        
+        response = result["response"]
+        if response.get("framing") == "binary" and response.get("proto") == PROTOCOL_VERSION:
+            self.framing = "binary"
+        print(f"ESP32 framing: {self.framing}")
+        return self.framing
+    
+    def _write(self, data: bytes):
+        transport = self._transport
+        if transport is not None:
+            # The asyncio transport owns the port; it must be written from its loop
+            self._loop.call_soon_threadsafe(transport.write, data)
+        else:
+            self.serial_conn.write(data)
+    
+    def _on_data(self, data: bytes):
+        self.stats["reads"] += 1
+        self.stats["bytes_received"] += len(data)
+        invalid = self.decoder.invalid
+        for message in self.decoder.feed(data):
+            self.stats["messages_received"] += 1
+            print(f"Received from ESP32: {message}")
+            # Handlers run on the dispatcher thread so the reader never waits on them
+            message_dispatcher.submit(message)
+        if self.decoder.invalid != invalid:
+            print(f"Invalid data from ESP32: {self.decoder.last_error}")
+    
     def _listen(self):
+        """
+        Reader thread: blocks in read() until bytes arrive, then drains everything buffered,
+        so each message is handled as soon as it is complete (no polling interval)
+        """
         while self.running:
             try:
-                if self.serial_conn and self.serial_conn.in_waiting > 0:
-                    line = self.serial_conn.readline().decode('utf-8').strip()
-                    if line:
-                        try:
-                            message = json.loads(line)
-                            print(f"Received from ESP32: {message}")
-                            if self.message_callback:
-                                self.message_callback(message)
-                        except json.JSONDecodeError:
-                            print(f"Invalid JSON from ESP32: {line}")
-                time.sleep(0.1)
+                conn = self.serial_conn
+                if conn is None or not conn.is_open:
+                    time.sleep(0.5)
+                    continue
+                data = conn.read(conn.in_waiting or 1)
+                if data:
+                    self._on_data(data)
             except Exception as e:
+                if not self.running:
+                    break
                 print(f"Error in listener thread: {e}")
+                self.decoder.reset()
                 time.sleep(1)
     
+    def _start_asyncio_reader(self) -> bool:
+        try:
+            import serial_asyncio
+        except ImportError:
+            print("pyserial-asyncio is not installed, using the reader thread")
+            return False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            print("No running event loop for the serial transport, using the reader thread")
+            return False
+        
+        self._loop = loop
+        
+        async def open_transport():
+            try:
+                transport, _ = await serial_asyncio.connection_for_serial(loop, lambda: _SerialProtocol(self), self.serial_conn)
+            except Exception as e:
+                print(f"Failed to start the asyncio serial reader: {e}")
+                return
+            if self.running:
+                self._transport = transport
+            else:
+                transport.close()
+        
+        loop.create_task(open_transport())
+        return True
+    
     def start_listening(self, callback: Callable):
         self.message_callback = callback
+        message_dispatcher.start(callback)
         self.running = True
-        self.listener_thread = threading.Thread(target=self._listen, daemon=True)
-        self.listener_thread.start()
-        print("Started listening for ESP32 messages")
+        if self.config_manager.get("uart_reader_mode", "thread") == "asyncio" and self._start_asyncio_reader():
+            print("Started listening for ESP32 messages (asyncio transport)")
+        else:
+            self.listener_thread = threading.Thread(target=self._listen, name="uart-reader", daemon=True)
+            self.listener_thread.start()
+            print("Started listening for ESP32 messages")
+        
+        if self.config_manager.get("uart_framing", "json") == "binary":
+            try:
+                asyncio.get_running_loop().create_task(self.negotiate_framing())
+            except RuntimeError:
+                print("No running event loop for the framing handshake, keeping JSON framing")
+    
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "mode": "asyncio" if self._transport is not None else "thread",
+            "framing": self.framing,
+            "decoder": self.decoder.get_stats(),
+            "writer": self.writer.get_stats(),
+            "requests": self.requests.get_stats(),
+            "dispatch": message_dispatcher.get_stats()
+        }
 
 uart_service = UARTService()
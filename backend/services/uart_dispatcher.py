@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import numpy as np
+
+from services.singleton import SingletonMeta
+
+class MessageDispatcher(metaclass=SingletonMeta):
+    """
+    Runs ESP32 message handlers off the serial reader.
+    The reader only enqueues decoded messages; one worker thread handles them in arrival
+    order (enrollment steps and fingerprint listings depend on it), so slow database commits
+    never hold up serial reads. The queue is bounded: when it is full new messages are
+    dropped and counted instead of blocking the reader.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._handler: Optional[Callable[[dict], None]] = None
+
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        # Recent (queue wait, handler run) times in seconds
+        self._timings = deque(maxlen=256)
+
+    def start(self, handler: Callable[[dict], None]):
+        from config import config_manager
+
+        with self._lock:
+            self._handler = handler
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=max(1, config_manager.get("uart_dispatch_queue_size", 256)))
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), name="uart-dispatch", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        with self._lock:
+            thread, work = self._thread, self._queue
+            self._thread = None
+        if thread is None:
+            return
+        try:
+            # Messages already queued are handled first
+            work.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout=timeout)
+
+    def restart(self):
+        """Recreate the queue (e.g. after uart_dispatch_queue_size changed); no-op when stopped"""
+        with self._lock:
+            handler = self._handler
+            running = self._thread is not None and self._thread.is_alive()
+        if running and handler is not None:
+            self.stop()
+            self.start(handler)
+
+    def submit(self, message: dict) -> bool:
+        work = self._queue
+        if work is None:
+            return False
+        try:
+            work.put_nowait((time.perf_counter(), message))
+        except queue.Full:
+            self.dropped += 1
+            print(f"ESP32 message dropped, dispatch queue full: {message}")
+            return False
+        self.max_depth = max(self.max_depth, work.qsize())
+        return True
+
+    def _run(self, work: queue.Queue):
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            queued_at, message = item
+            started = time.perf_counter()
+            try:
+                self._handler(message)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error handling ESP32 message {message}: {e}")
+            self._timings.append((started - queued_at, time.perf_counter() - started))
+
+    def get_stats(self) -> dict:
+        timings = np.array(self._timings, dtype=np.float64).reshape(-1, 2) * 1000
+        work = self._queue
+
+        def summary(values):
+            if values.size == 0:
+                return {"p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+            return {
+                "p50_ms": round(float(np.percentile(values, 50)), 2),
+                "p95_ms": round(float(np.percentile(values, 95)), 2),
+                "max_ms": round(float(values.max()), 2)
+            }
+
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queue_depth": work.qsize() if work is not None else 0,
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "wait": summary(timings[:, 0]),
+            "handler": summary(timings[:, 1])
+        }
+
+message_dispatcher = MessageDispatcher()
@@ -0,0 +1,247 @@
+"""
+Framing of the ESP32 serial link.
+
+JSON mode (default): one JSON object per line, terminated by \\n.
+
+Binary mode, used once the hello handshake succeeds:
+    SOF (0xA5 0x5A) | version (u8) | type (u8) | length (u16 LE) | payload | CRC-16/CCITT-FALSE (u16 LE)
+The CRC covers version, type, length and payload. Each numeric type stands for one message
+shape of MESSAGE_TYPES: its constant fields are implied by the type and the remaining fields
+are packed in order (u8 "B", u16 "H", length-prefixed UTF-8 "s", int-or-string "v"). Trailing
+fields may be omitted. Messages without a matching shape travel as TYPE_JSON frames.
+
+StreamDecoder accepts JSON lines and binary frames on the same stream, so either side can
+switch framing at any point without losing messages.
+"""
+
+import json
+import struct
+from typing import List, Optional
+
+PROTOCOL_VERSION = 1
+SOF = b"\xa5\x5a"
+HEADER = struct.Struct("<BBH")
+MAX_PAYLOAD = 1024
+
+TYPE_JSON = 0x00
+
+MESSAGE_TYPES = [
+    # Backend -> ESP32
+    (0x01, {"cmd": "unlock"}, [("duration", "B")]),
+    (0x02, {"cmd": "lock"}, []),
+    (0x03, {"cmd": "led"}, [("color", "s")]),
+    (0x04, {"cmd": "beep"}, [("times", "B")]),
+    (0x05, {"cmd": "display"}, [("text", "s")]),
+    (0x06, {"cmd": "enroll_fingerprint"}, [("id", "B")]),
+    (0x07, {"cmd": "delete_fingerprint"}, [("id", "B")]),
+    (0x08, {"cmd": "list_fingerprints"}, []),
+    (0x09, {"cmd": "clear_all_fingerprints"}, []),
+    (0x0A, {"cmd": "hello"}, [("proto", "B"), ("framing", "s")]),
+    # ESP32 -> backend
+    (0x40, {"type": "fingerprint"}, [("id", "v")]),
+    (0x41, {"type": "keypad"}, [("password", "s")]),
+    (0x42, {"type": "status"}, [("door", "s")]),
+    (0x50, {"status": "listing_fingerprints"}, []),
+    (0x51, {"status": "listing_complete"}, []),
+    (0x52, {"status": "fingerprint_deleted"}, [("id", "B")]),
+    (0x53, {"status": "delete_failed"}, [("id", "B")]),
+    (0x54, {"status": "all_fingerprints_cleared"}, []),
+    (0x55, {"status": "clear_failed"}, []),
+    (0x56, {"status": "enrollment_started"}, []),
+    (0x57, {"status": "place_finger"}, []),
+    (0x58, {"status": "remove_finger"}, []),
+    (0x59, {"status": "place_again"}, []),
+    (0x5A, {"status": "hello"}, [("proto", "B"), ("framing", "s")]),
+    (0x60, {}, [("fingerprint_found", "B")]),
+]
+
+_TYPES_BY_CODE = {code: (constants, fields) for code, constants, fields in MESSAGE_TYPES}
+
+def crc16(data: bytes, crc: int = 0xFFFF) -> int:
+    """CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF)"""
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return crc
+
+def _pack_field(value, fmt: str) -> Optional[bytes]:
+    """Packed field, or None if the value does not fit the format"""
+    if fmt in ("B", "H"):
+        limit = 0xFF if fmt == "B" else 0xFFFF
+        if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= limit:
+            return None
+        return struct.pack("<" + fmt, value)
+    if fmt == "s":
+        if not isinstance(value, str):
+            return None
+        data = value.encode("utf-8")
+        return bytes([len(data)]) + data if len(data) <= 0xFF else None
+    if fmt == "v":
+        packed = _pack_field(value, "H")
+        if packed is not None:
+            return b"\x00" + packed
+        packed = _pack_field(value, "s")
+        return b"\x01" + packed if packed is not None else None
+    return None
+
+def _unpack_field(payload: bytes, offset: int, fmt: str):
+    if fmt == "B":
+        return payload[offset], offset + 1
+    if fmt == "H":
+        return struct.unpack_from("<H", payload, offset)[0], offset + 2
+    if fmt == "s":
+        length = payload[offset]
+        end = offset + 1 + length
+        if end > len(payload):
+            raise ValueError("truncated string field")
+        return payload[offset + 1:end].decode("utf-8"), end
+    if fmt == "v":
+        return _unpack_field(payload, offset + 1, "H" if payload[offset] == 0 else "s")
+    raise ValueError(f"unknown field format {fmt}")
+
+def _pack_message(message: dict):
+    """(type, payload) of the first shape that fits `message`, or None"""
+    for code, constants, fields in MESSAGE_TYPES:
+        if any(message.get(key) != value for key, value in constants.items()):
+            continue
+        rest = [key for key in message if key not in constants]
+        names = [name for name, _ in fields]
+        if names[:len(rest)] != rest:
+            continue
+        parts = [_pack_field(message[name], fmt) for name, fmt in fields[:len(rest)]]
+        if any(part is None for part in parts):
+            continue
+        return code, b"".join(parts)
+    return None
+
+def encode_frame(message: dict) -> bytes:
+    packed = _pack_message(message)
+    if packed is None:
+        packed = TYPE_JSON, json.dumps(message, separators=(",", ":")).encode("utf-8")
+    code, payload = packed
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Message too large for a frame: {len(payload)} bytes")
+    body = HEADER.pack(PROTOCOL_VERSION, code, len(payload)) + payload
+    return SOF + body + struct.pack("<H", crc16(body))
+
+def encode_line(message: dict) -> bytes:
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+def decode_payload(code: int, payload: bytes) -> dict:
+    if code == TYPE_JSON:
+        message = json.loads(payload)
+        if not isinstance(message, dict):
+            raise ValueError("JSON frame is not an object")
+        return message
+    shape = _TYPES_BY_CODE.get(code)
+    if shape is None:
+        raise ValueError(f"unknown message type 0x{code:02x}")
+    constants, fields = shape
+    message = dict(constants)
+    offset = 0
+    for name, fmt in fields:
+        if offset >= len(payload):
+            break
+        message[name], offset = _unpack_field(payload, offset, fmt)
+    return message
+
+class StreamDecoder:
+    """
+    Turns the serial byte stream into messages, fed in chunks of any size.
+    Binary frames are recognized by their SOF; anything else is read as a JSON line.
+    Corrupt frames (bad CRC, unknown version) and invalid lines are counted and skipped;
+    a line longer than `max_line` is noise (wrong baudrate, boot log) and is dropped.
+    """
+
+    def __init__(self, max_line: int = 4096):
+        self.max_line = max_line
+        self._buffer = bytearray()
+        self.frames = 0
+        self.lines = 0
+        self.invalid = 0
+        self.crc_errors = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+
+    def feed(self, data: bytes) -> List[dict]:
+        self._buffer.extend(data)
+        messages = []
+        while self._buffer:
+            if self._buffer[:1] == SOF[:1] and (len(self._buffer) < 2 or self._buffer[:2] == SOF):
+                consumed = self._read_frame(messages)
+            else:
+                consumed = self._read_line(messages)
+            if consumed == 0:
+                break
+            del self._buffer[:consumed]
+        return messages
+
+    def _read_frame(self, messages: list) -> int:
+        start = len(SOF)
+        if len(self._buffer) < start + HEADER.size:
+            return 0
+        version, code, length = HEADER.unpack_from(self._buffer, start)
+        if version != PROTOCOL_VERSION or length > MAX_PAYLOAD:
+            self._error("bad frame header")
+            return 1
+        end = start + HEADER.size + length + 2
+        if len(self._buffer) < end:
+            return 0
+
+        body = bytes(self._buffer[start:end - 2])
+        if struct.unpack_from("<H", self._buffer, end - 2)[0] != crc16(body):
+            self.crc_errors += 1
+            self._error("CRC mismatch")
+            # Resynchronize on the next SOF rather than trusting the length field
+            return 1
+        try:
+            messages.append(decode_payload(code, body[HEADER.size:]))
+            self.frames += 1
+        except (ValueError, IndexError, struct.error) as e:
+            self._error(f"undecodable frame: {e}")
+        return end
+
+    def _read_line(self, messages: list) -> int:
+        newline = self._buffer.find(b"\n")
+        sof = self._buffer.find(SOF, 1)
+        if sof >= 0 and (newline < 0 or sof < newline):
+            # A frame starts inside an unterminated line: the line was cut off
+            self._error("truncated line")
+            return sof
+        if newline < 0:
+            if len(self._buffer) > self.max_line:
+                self.dropped += 1
+                # Keep a possible partial SOF at the end
+                return len(self._buffer) - 1
+            return 0
+
+        line = bytes(self._buffer[:newline]).strip()
+        if line:
+            try:
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError("not an object")
+                messages.append(message)
+                self.lines += 1
+            except (ValueError, UnicodeDecodeError):
+                self._error(f"invalid JSON: {line[:80]!r}")
+        return newline + 1
+
+    def _error(self, reason: str):
+        self.invalid += 1
+        self.last_error = reason
+
+    def reset(self):
+        self._buffer.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "lines": self.lines,
+            "invalid": self.invalid,
+            "crc_errors": self.crc_errors,
+            "dropped": self.dropped,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Optional
+
+class ResponseSpec:
+    """How the firmware answers a command: final statuses, and optionally a start status and streamed items"""
+
+    def __init__(self, done, failed=(), started: Optional[str] = None, item_key: Optional[str] = None,
+                 match_id: bool = False):
+        self.done = set(done)
+        self.failed = set(failed)
+        self.started = started
+        self.item_key = item_key
+        self.match_id = match_id
+
+# The firmware handles commands one at a time, in order, and does not echo request ids,
+# so answers are matched to the oldest pending request of the same command
+RESPONSES = {
+    "list_fingerprints": ResponseSpec({"listing_complete"}, started="listing_fingerprints", item_key="fingerprint_found"),
+    "delete_fingerprint": ResponseSpec({"fingerprint_deleted", "delete_failed"}, {"delete_failed"}, match_id=True),
+    "clear_all_fingerprints": ResponseSpec({"all_fingerprints_cleared", "clear_failed"}, {"clear_failed"}),
+    "enroll_fingerprint": ResponseSpec({"enrollment_started"}),
+    "hello": ResponseSpec({"hello"})
+}
+
+def _is_response(message: dict) -> bool:
+    status = message.get("status")
+    for spec in RESPONSES.values():
+        if status is not None and (status in spec.done or status == spec.started):
+            return True
+        if spec.item_key is not None and spec.item_key in message:
+            return True
+    return False
+
+class UARTRequestTimeout(TimeoutError):
+    """The ESP32 did not answer in time; `request.items` holds what was streamed before"""
+
+    def __init__(self, request: "PendingRequest"):
+        super().__init__(f"No response from ESP32 to {request.cmd} (request {request.id})")
+        self.request = request
+
+class PendingRequest:
+    """A command waiting for its answer. Resolved from the dispatcher thread, awaited on the app loop."""
+
+    def __init__(self, request_id: int, message: dict, spec: ResponseSpec, loop: asyncio.AbstractEventLoop):
+        self.id = request_id
+        self.message = message
+        self.cmd = message.get("cmd")
+        self.spec = spec
+        self.started = spec.started is None
+        self.items = []
+        self.created = time.monotonic()
+        self._loop = loop
+        self.future: asyncio.Future = loop.create_future()
+        self._stream: asyncio.Queue = asyncio.Queue()
+
+    def _on_loop(self, callback, *args):
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _add_item(self, item):
+        self.items.append(item)
+        self._on_loop(self._stream.put_nowait, ("item", item))
+
+    def _resolve(self, response: dict):
+        status = response.get("status")
+        result = {
+            "request_id": self.id,
+            "status": status,
+            "ok": status not in self.spec.failed,
+            "items": list(self.items),
+            "response": response
+        }
+
+        def finish():
+            if not self.future.done():
+                self.future.set_result(result)
+            self._stream.put_nowait(("done", result))
+
+        self._on_loop(finish)
+
+    def _fail(self, error: Exception):
+        def finish():
+            if not self.future.done():
+                self.future.set_exception(error)
+                # Retrieved here: stream() readers get the error through the queue instead
+                self.future.exception()
+            self._stream.put_nowait(("error", error))
+
+        self._on_loop(finish)
+
+    async def wait(self, timeout: float) -> dict:
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            raise UARTRequestTimeout(self)
+
+    async def stream(self, timeout: float) -> AsyncIterator[tuple]:
+        """Yield ("item", value) as results arrive, then ("done", result); raises UARTRequestTimeout or ConnectionError"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                kind, value = await asyncio.wait_for(self._stream.get(), max(0.0, remaining))
+            except asyncio.TimeoutError:
+                raise UARTRequestTimeout(self)
+            if kind == "error":
+                raise value
+            yield kind, value
+            if kind == "done":
+                return
+
+class RequestTracker:
+    """Correlates ESP32 answers with the commands that asked for them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending: Dict[str, deque] = {}
+        self.stats = {"requests": 0, "resolved": 0, "timed_out": 0, "failed": 0, "unmatched": 0}
+
+    def register(self, message: dict) -> Optional[PendingRequest]:
+        """Track `message` if its command has an answer (call on the app loop); None otherwise"""
+        spec = RESPONSES.get(message.get("cmd"))
+        if spec is None:
+            return None
+        with self._lock:
+            request = PendingRequest(next(self._ids), message, spec, asyncio.get_running_loop())
+            self._pending.setdefault(request.cmd, deque()).append(request)
+            self.stats["requests"] += 1
+        return request
+
+    def discard(self, request: PendingRequest):
+        with self._lock:
+            queue = self._pending.get(request.cmd)
+            if queue is not None and request in queue:
+                queue.remove(request)
+                if not request.future.done():
+                    self.stats["timed_out"] += 1
+
+    def fail_all(self, error: Exception):
+        """Fail every pending request with `error` (e.g. the link went down, no answer will come)"""
+        with self._lock:
+            pending = [request for queue in self._pending.values() for request in queue]
+            self._pending.clear()
+            self.stats["failed"] += len(pending)
+        for request in pending:
+            request._fail(error)
+
+    def _find(self, message: dict) -> Optional[PendingRequest]:
+        status = message.get("status")
+        for queue in self._pending.values():
+            for request in queue:
+                spec = request.spec
+                if status is not None and status in spec.done and request.started:
+                    if spec.match_id and "id" in message and message.get("id") != request.message.get("id"):
+                        continue
+                    return request
+                if status is not None and status == spec.started and not request.started:
+                    return request
+                if spec.item_key is not None and spec.item_key in message and request.started:
+                    return request
+                # Commands of one kind are answered in order: only the oldest can match
+                if not spec.match_id:
+                    break
+        return None
+
+    def feed(self, message: dict) -> bool:
+        """Apply an ESP32 message to the matching pending request; False if none expects it"""
+        with self._lock:
+            request = self._find(message)
+            if request is None:
+                if _is_response(message):
+                    self.stats["unmatched"] += 1
+                return False
+
+            status = message.get("status")
+            if status is not None and status in request.spec.done:
+                self._pending[request.cmd].remove(request)
+                self.stats["resolved"] += 1
+                request._resolve(message)
+            elif status is not None and status == request.spec.started:
+                request.started = True
+            else:
+                request._add_item(message[request.spec.item_key])
+            return True
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "pending": sum(len(queue) for queue in self._pending.values())}
@@ -0,0 +1,162 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Optional
+
+# Lower runs first: door control, then fingerprint commands, then cosmetic feedback
+PRIORITY_CONTROL = 0
+PRIORITY_COMMAND = 1
+PRIORITY_FEEDBACK = 2
+
+COMMAND_PRIORITIES = {
+    "unlock": PRIORITY_CONTROL,
+    "lock": PRIORITY_CONTROL,
+    "led": PRIORITY_FEEDBACK,
+    "beep": PRIORITY_FEEDBACK,
+    "display": PRIORITY_FEEDBACK
+}
+
+# Only the newest unsent state matters for these
+COALESCED_COMMANDS = {"led", "display"}
+
+class TokenBucket:
+    """Byte budget refilled at `rate` bytes/s, holding at most `burst` bytes"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(1.0, float(rate))
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+
+    def reserve(self, size: int) -> float:
+        """Take `size` bytes if available and return 0, otherwise the seconds to wait"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        # A message bigger than the burst goes out once the bucket is full
+        needed = min(size, self.burst)
+        if self._tokens >= needed:
+            self._tokens -= size
+            return 0.0
+        return (needed - self._tokens) / self.rate
+
+class UARTWriter:
+    """
+    Single writer for the serial link, so concurrent commands never interleave on the wire.
+    Messages wait in a priority queue (unlock/lock before fingerprint commands before LED,
+    beep and display), an unsent LED or display update is replaced by a newer one, and
+    writes are paced by a token bucket so the ESP32 receive buffer is never overrun.
+    """
+
+    def __init__(self, encode: Callable[[dict], bytes], write: Callable[[bytes], None], max_pending: int = 128):
+        self._encode = encode
+        self._write = write
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._heap = []
+        self._coalesce = {}
+        self._seq = itertools.count()
+        self._bucket = TokenBucket(11520, 256)
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        self.stats = {"sent": 0, "bytes_sent": 0, "coalesced": 0, "dropped": 0, "errors": 0, "throttled_seconds": 0.0}
+
+    def configure(self, bytes_per_second: float, burst: int):
+        with self._cond:
+            self._bucket = TokenBucket(bytes_per_second, burst)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="uart-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        """Stop the writer; messages not sent yet are discarded"""
+        with self._cond:
+            self._running = False
+            self._heap.clear()
+            self._coalesce.clear()
+            self._cond.notify_all()
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=timeout)
+
+    def submit(self, message: dict, priority: Optional[int] = None) -> bool:
+        cmd = message.get("cmd")
+        if priority is None:
+            priority = COMMAND_PRIORITIES.get(cmd, PRIORITY_COMMAND)
+
+        with self._cond:
+            if not self._running:
+                return False
+            pending = self._coalesce.get(cmd)
+            if pending is not None:
+                pending[2] = message
+                self.stats["coalesced"] += 1
+                return True
+            if len(self._heap) >= self.max_pending and priority >= PRIORITY_FEEDBACK:
+                self.stats["dropped"] += 1
+                return False
+
+            entry = [priority, next(self._seq), message]
+            heapq.heappush(self._heap, entry)
+            if cmd in COALESCED_COMMANDS:
+                self._coalesce[cmd] = entry
+            self._cond.notify()
+            return True
+
+    def _next(self) -> Optional[dict]:
+        with self._cond:
+            while self._running and not self._heap:
+                self._cond.wait()
+            if not self._running:
+                return None
+            _, _, message = heapq.heappop(self._heap)
+            cmd = message.get("cmd")
+            if cmd in COALESCED_COMMANDS:
+                self._coalesce.pop(cmd, None)
+            return message
+
+    def _run(self):
+        while True:
+            message = self._next()
+            if message is None:
+                return
+            data = self._encode(message)
+            while True:
+                with self._cond:
+                    wait = self._bucket.reserve(len(data))
+                if wait <= 0 or not self._running:
+                    break
+                self.stats["throttled_seconds"] += wait
+                time.sleep(wait)
+            if not self._running:
+                return
+
+            try:
+                self._write(data)
+                self.stats["sent"] += 1
+                self.stats["bytes_sent"] += len(data)
+                print(f"Sent to ESP32: {message}")
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Error sending message: {e}")
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "throttled_seconds": round(self.stats["throttled_seconds"], 3),
+            "pending": self.pending(),
+            "bytes_per_second": self._bucket.rate,
+            "burst": self._bucket.burst
+        }
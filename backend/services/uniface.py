@@ -1,88 +1,363 @@
 from services.singleton import SingletonMeta
+from services.face_quality import QualityStats, assess_face, face_quality
 import numpy as np
 import cv2
-from PIL import Image
-import io
-from typing import Optional, Tuple
+import os
+import threading
+import time
+from enum import Enum
+from typing import List, Optional, Tuple
 
-from uniface import RetinaFace, ArcFace, compute_similarity
+class ModelStatus(str, Enum):
+    NOT_LOADED = "not_loaded"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+def _face_field(face, *names):
+    for name in names:
+        value = getattr(face, name, None)
+        if value is None and isinstance(face, dict):
+            value = face.get(name)
+        if value is not None:
+            return value
+    return None
+
+class DetectedFace:
+    """Detector output normalized to float arrays: bbox (x1, y1, x2, y2), 5x2 landmarks, confidence"""
+    __slots__ = ("bbox", "landmarks", "confidence")
+
+    def __init__(self, bbox, landmarks=None, confidence: float = 1.0):
+        self.bbox = np.asarray(bbox, dtype=np.float32)[:4]
+        self.landmarks = None if landmarks is None else np.asarray(landmarks, dtype=np.float32).reshape(-1, 2)
+        self.confidence = float(confidence)
+
+    @classmethod
+    def from_detection(cls, face) -> Optional["DetectedFace"]:
+        bbox = _face_field(face, 'bbox', 'box')
+        if bbox is None:
+            return None
+        landmarks = _face_field(face, 'landmarks', 'kps')
+        confidence = _face_field(face, 'confidence', 'score', 'det_score')
+        if confidence is None:
+            # Some detectors append the score to the box
+            confidence = bbox[4] if len(bbox) > 4 else 1.0
+        return cls(bbox, landmarks, confidence)
+
+def decode_image(image_bytes) -> Optional[np.ndarray]:
+    """Decode an uploaded image (bytes, bytearray or memoryview) straight to BGR, None if unreadable"""
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def _model_file(model) -> Optional[str]:
+    for attr in ('_model_path', 'model_path', 'onnx_path'):
+        value = getattr(model, attr, None)
+        if isinstance(value, str):
+            return value
+    return None
+
+def _rebind_session(model, model_path: str, profile: dict):
+    """Replace the library-built onnxruntime session with one using the profile's options"""
+    import onnxruntime as ort
+    
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if profile["inference_intra_op_threads"] > 0:
+        options.intra_op_num_threads = profile["inference_intra_op_threads"]
+    if profile["inference_inter_op_threads"] > 0:
+        options.inter_op_num_threads = profile["inference_inter_op_threads"]
+    if profile["inference_execution_mode"] == "parallel":
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    else:
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    
+    session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+    model.session = session
+    # The wrappers cache input/output names next to the session, as a str or a list
+    # depending on the wrapper (RetinaFace feeds {self.input_names: blob}); keep that type
+    inputs = [node.name for node in session.get_inputs()]
+    outputs = [node.name for node in session.get_outputs()]
+    for attr, names in (('input_name', inputs), ('input_names', inputs), ('output_name', outputs), ('output_names', outputs)):
+        if hasattr(model, attr):
+            setattr(model, attr, names[0] if isinstance(getattr(model, attr), str) else list(names))
+
+def model_version(recognizer, profile: dict) -> str:
+    """Identifies the recognizer weights; embeddings from different versions are not comparable"""
+    if profile.get("model_precision") == "int8":
+        return os.path.basename(profile["recognizer_int8_model_path"])
+    path = _model_file(recognizer)
+    return os.path.basename(path) if path else type(recognizer).__name__
+
+def build_models(profile: dict):
+    """Create (detector, recognizer) for an inference profile (see config.INFERENCE_PROFILES)"""
+    # Imported here so that importing this module (and starting the API) does not load onnxruntime
+    from uniface import RetinaFace, ArcFace
+    
+    size = (int(profile["detector_input_size"]),) * 2
+    confidence = float(profile["detector_confidence"])
+    
+    detector = None
+    for kwargs in ({"conf_thresh": confidence, "input_size": size}, {"confidence_threshold": confidence, "input_size": size}):
+        try:
+            detector = RetinaFace(**kwargs)
+            break
+        except TypeError:
+            continue
+    if detector is None:
+        detector = RetinaFace()
+        for attr in ('conf_thresh', 'confidence_threshold'):
+            if hasattr(detector, attr):
+                setattr(detector, attr, confidence)
+    recognizer = ArcFace()
+    
+    int8 = profile["model_precision"] == "int8"
+    default_runtime = (
+        profile["inference_intra_op_threads"] == 0
+        and profile["inference_inter_op_threads"] == 0
+        and profile["inference_execution_mode"] != "parallel"
+    )
+    for model, int8_path in ((detector, profile["detector_int8_model_path"]), (recognizer, profile["recognizer_int8_model_path"])):
+        if int8:
+            if not os.path.exists(int8_path):
+                raise RuntimeError(f"INT8 model not found: {int8_path}")
+            _rebind_session(model, int8_path, profile)
+        elif not default_runtime and _model_file(model):
+            _rebind_session(model, _model_file(model), profile)
+    
+    return detector, recognizer
 
 class UnifaceService(metaclass=SingletonMeta):
     def __init__(self):
         self.detector = None
         self.recognizer = None
-        self._initialize_models()
+        self.profile: Optional[dict] = None
+        self.model_version: Optional[str] = None
+        self.status = ModelStatus.NOT_LOADED
+        self.error: Optional[str] = None
+        self.load_seconds = 0.0
+        self.quality_stats = QualityStats()
+        self._load_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._load_thread: Optional[threading.Thread] = None
     
-    def _initialize_models(self):
+    def _initialize_models(self, profile: dict):
         try:
-            self.detector = RetinaFace()
-            self.recognizer = ArcFace()
+            detector, recognizer = build_models(profile)
         except Exception as e:
             raise RuntimeError(f"Failed to load models: {e}")
+        self.detector, self.recognizer = detector, recognizer
+        self.profile = profile
+        self.model_version = model_version(recognizer, profile)
     
-    def extract_embedding(self, image_bytes: bytes) -> Optional[np.ndarray]:
-        try:
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            image_np = np.array(image)
-            image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+    def load_models(self, profile: Optional[dict] = None, force: bool = False) -> bool:
+        """
+        Load the models in the calling thread; concurrent callers wait for the same load.
+        With force=True the models are rebuilt (e.g. for a new profile) while the old ones keep
+        serving, and swapped in once ready.
+        """
+        if profile is None:
+            from config import config_manager
+            profile = config_manager.get_inference_profile()
+        
+        with self._load_lock:
+            if self.status == ModelStatus.READY and not force:
+                return True
             
-            faces = self.detector.detect(image_bgr)
+            reloading = self.status == ModelStatus.READY
+            if not reloading:
+                self.status = ModelStatus.LOADING
+            self.error = None
+            started = time.monotonic()
+            try:
+                self._initialize_models(profile)
+            except Exception as e:
+                self.error = str(e)
+                print(f"Face models failed to load: {e}")
+                if not reloading:
+                    self.status = ModelStatus.FAILED
+                return False
             
-            if faces is not None and len(faces) > 0:
-                face = faces[0]
-                
-                # Handle Face object attribute access
-                landmarks = getattr(face, 'landmarks', None)
-                if landmarks is None:
-                    landmarks = getattr(face, 'kps', None)
-                
-                if landmarks is None:
-                    # Fallback for dictionary access if somehow it is a dict
-                    try:
-                        landmarks = face['landmarks']
-                    except:
-                        pass
-                
-                if landmarks is not None:
-                    embedding = self.recognizer.get_normalized_embedding(
-                        image_bgr, 
-                        landmarks
-                    )
-                    
-                    if embedding is not None:
-                        return embedding
-                
-                return None
-            else:
+            self.load_seconds = time.monotonic() - started
+            self.status = ModelStatus.READY
+            print(f"Face models loaded in {self.load_seconds:.1f}s")
+            return True
+    
+    def reload(self, profile: Optional[dict] = None):
+        """Rebuild the models with a new profile on a background thread"""
+        threading.Thread(target=self.load_models, args=(profile, True), name="model-reloader", daemon=True).start()
+    
+    def start_loading(self):
+        """Load the models on a background thread so the server can answer requests meanwhile"""
+        with self._start_lock:
+            if self.status in (ModelStatus.LOADING, ModelStatus.READY):
+                return
+            if self._load_thread is not None and self._load_thread.is_alive():
+                return
+            self._load_thread = threading.Thread(target=self.load_models, name="model-loader", daemon=True)
+            self._load_thread.start()
+    
+    def is_ready(self) -> bool:
+        return self.status == ModelStatus.READY
+    
+    def get_status(self) -> dict:
+        return {
+            "status": self.status.value,
+            "error": self.error,
+            "load_seconds": round(self.load_seconds, 2),
+            "profile": self.profile,
+            "model_version": self.model_version,
+            "quality": self.quality_stats.snapshot()
+        }
+    
+    def detect_faces(self, image_bgr: np.ndarray, roi: Optional[Tuple[int, int, int, int]] = None, max_side: int = 0) -> List[DetectedFace]:
+        """
+        Detect faces, optionally only inside `roi` (x1, y1, x2, y2) and downscaled so the longer
+        side is at most `max_side`. Boxes and landmarks are always in full-frame coordinates.
+        """
+        offset_x, offset_y = 0, 0
+        image = image_bgr
+        if roi is not None:
+            height, width = image_bgr.shape[:2]
+            x1, y1, x2, y2 = max(0, roi[0]), max(0, roi[1]), min(width, roi[2]), min(height, roi[3])
+            if x2 <= x1 or y2 <= y1:
+                return []
+            image = image_bgr[y1:y2, x1:x2]
+            offset_x, offset_y = x1, y1
+        
+        scale = 1.0
+        if max_side and max(image.shape[:2]) > max_side:
+            scale = max_side / max(image.shape[:2])
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        faces = self.detector.detect(np.ascontiguousarray(image))
+        if faces is None:
+            return []
+        
+        detected = []
+        for face in faces:
+            face = DetectedFace.from_detection(face)
+            if face is None:
+                continue
+            if roi is not None or scale != 1.0:
+                face.bbox = face.bbox / scale + np.array([offset_x, offset_y, offset_x, offset_y], dtype=np.float32)
+                if face.landmarks is not None:
+                    face.landmarks = face.landmarks / scale + np.array([offset_x, offset_y], dtype=np.float32)
+            detected.append(face)
+        return detected
+    
+    def get_embeddings_batch(self, image_bgr: np.ndarray, landmarks_list: List[np.ndarray]) -> np.ndarray:
+        """L2-normalized embeddings (N, D) for several faces of one image"""
+        return self.embed_faces([(image_bgr, landmarks) for landmarks in landmarks_list])
+    
+    def embed_faces(self, faces: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        """
+        L2-normalized embeddings (N, D) for (image, landmarks) pairs, which may come from different images.
+        All crops are aligned and stacked into one blob so ArcFace runs once per batch;
+        models exported with a fixed batch size fall back to one call per face.
+        """
+        if not faces:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        session = getattr(self.recognizer, 'session', None)
+        model_input = session.get_inputs()[0] if session is not None else None
+        dynamic_batch = model_input is not None and not isinstance(model_input.shape[0], int)
+        try:
+            # The batch path reuses the library's own alignment and preprocessing, so a face
+            # embeds the same alone or in a group; without them every face goes one by one
+            from uniface import face_alignment
+            batchable = dynamic_batch and hasattr(self.recognizer, 'preprocess')
+        except ImportError:
+            batchable = False
+        
+        if len(faces) == 1 or not batchable:
+            rows = [
+                np.asarray(self.recognizer.get_normalized_embedding(image_bgr, landmarks), dtype=np.float32).reshape(-1)
+                for image_bgr, landmarks in faces
+            ]
+            return np.vstack(rows)
+        
+        image_size = self.recognizer.input_size
+        blob = np.concatenate([
+            self.recognizer.preprocess(face_alignment(image_bgr, landmarks, image_size=image_size)[0])
+            for image_bgr, landmarks in faces
+        ])
+        
+        embeddings = session.run(None, {model_input.name: blob})[0].astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+    
+    def select_faces(self, image_bgr: np.ndarray, faces: List[DetectedFace]) -> List[DetectedFace]:
+        """
+        Faces worth embedding: those passing the quality check (see face_quality). If none
+        passes, only the best one is kept so a single poor image still gets an answer.
+        """
+        from config import config_manager
+        if len(faces) == 0 or not config_manager.get("face_quality_enabled", True):
+            return faces
+        
+        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+        reports = [assess_face(image_bgr, face, gray) for face in faces]
+        for report in reports:
+            self.quality_stats.record(report)
+        selected = [face for face, report in zip(faces, reports) if report.passed]
+        if not selected:
+            selected = [max(zip(faces, reports), key=lambda item: item[1].score)[0]]
+        return selected
+    
+    def extract_embeddings_from_array(self, image_bgr: np.ndarray) -> Optional[np.ndarray]:
+        """Embeddings (N, D) of the usable faces with landmarks in a BGR image, or None if there is none"""
+        try:
+            faces = [face for face in self.detect_faces(image_bgr) if face.landmarks is not None]
+            faces = self.select_faces(image_bgr, faces)
+            if not faces:
                 return None
-                
+            return self.get_embeddings_batch(image_bgr, [face.landmarks for face in faces])
         except Exception:
             return None
     
-    def compare_faces(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
+    def extract_embeddings(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        image_bgr = decode_image(image_bytes)
+        if image_bgr is None:
+            return None
+        return self.extract_embeddings_from_array(image_bgr)
+    
+    def _largest_face(self, image_bgr: np.ndarray) -> Optional[DetectedFace]:
+        faces = [face for face in self.detect_faces(image_bgr) if face.landmarks is not None]
+        if not faces:
+            return None
+        return max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+    
+    def extract_samples_from_arrays(self, images: List[Optional[np.ndarray]]) -> List[Optional[Tuple[np.ndarray, float]]]:
+        """
+        (embedding, quality) of the largest face of each image, for enrollment; None where no
+        face is found. One ArcFace batch for all of them.
+        """
+        faces = []
+        for image_bgr in images:
+            try:
+                faces.append(self._largest_face(image_bgr) if image_bgr is not None else None)
+            except Exception:
+                faces.append(None)
+        
+        found = [(image, face) for image, face in zip(images, faces) if face is not None]
         try:
-            similarity = compute_similarity(embedding1, embedding2)
-            return float(similarity)
+            embeddings = self.embed_faces([(image, face.landmarks) for image, face in found])
         except Exception:
-            # Fallback to cosine similarity
-            similarity = np.dot(embedding1, embedding2) / (
-                np.linalg.norm(embedding1) * np.linalg.norm(embedding2)
-            )
-            return float(similarity)
-    
-    def verify_face(self, image_bytes: bytes, stored_embedding: np.ndarray, threshold: float = 0.7) -> Tuple[bool, float]:
-        new_embedding = self.extract_embedding(image_bytes)
-        
-        if new_embedding is None:
-            return False, 0.0
+            return [None] * len(images)
         
-        similarity = self.compare_faces(new_embedding, stored_embedding)
-        is_match = similarity >= threshold
-        
-        return is_match, similarity
+        results = []
+        rows = iter(range(len(found)))
+        for image, face in zip(images, faces):
+            if face is None:
+                results.append(None)
+            else:
+                results.append((embeddings[next(rows)], face_quality(image, face)))
+        return results
+    
+    def extract_samples(self, images: List[bytes]) -> List[Optional[Tuple[np.ndarray, float]]]:
+        return self.extract_samples_from_arrays([decode_image(data) if data else None for data in images])
 
 uniface_service = UnifaceService()
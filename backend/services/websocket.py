@@ -1,11 +1,17 @@
+import asyncio
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import List
+from typing import List, Optional
 
 from services.singleton import SingletonMeta
 
 class ConnectionManager(metaclass=SingletonMeta):
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Event loop that owns the connections; broadcast_threadsafe() schedules onto it"""
+        self._loop = loop
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
@@ -19,7 +25,7 @@ class ConnectionManager(metaclass=SingletonMeta):
 
     async def broadcast(self, message: dict):
         disconnected = []
-        for connection in self.active_connections:
+        for connection in list(self.active_connections):
             try:
                 await connection.send_json(message)
             except Exception:
@@ -28,4 +34,22 @@ class ConnectionManager(metaclass=SingletonMeta):
         for conn in disconnected:
             self.disconnect(conn)
 
+    def broadcast_threadsafe(self, message: dict) -> bool:
+        """
+        Broadcast from any thread (serial handlers, background jobs). The send runs on the
+        app loop; returns False if no loop is bound yet.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return False
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            loop.create_task(self.broadcast(message))
+        else:
+            asyncio.run_coroutine_threadsafe(self.broadcast(message), loop)
+        return True
+
 websocket_manager = ConnectionManager()
@@ -0,0 +1,66 @@
+"""
+Stand-in for the ESP32 firmware (firmware/src/tasks/serial_task.cpp) on the serial link.
+It accepts JSON lines and binary frames, answers the backend commands the way the firmware
+does, and, unlike the current firmware, accepts binary framing in the hello handshake.
+"""
+
+from typing import Iterable, List
+
+from services.uart_framing import PROTOCOL_VERSION, StreamDecoder, encode_frame, encode_line
+
+class ESP32Simulator:
+    def __init__(self, supports_binary: bool = True, fingerprints: Iterable[int] = ()):
+        # supports_binary=False behaves like the current firmware: no hello answer, JSON only
+        self.supports_binary = supports_binary
+        self.framing = "json"
+        self.fingerprints = set(fingerprints)
+        self.door = "locked"
+        self.decoder = StreamDecoder()
+        self.received: List[dict] = []
+
+    def feed(self, data: bytes) -> bytes:
+        """Bytes written by the backend in, the bytes the firmware answers out"""
+        output = bytearray()
+        for message in self.decoder.feed(data):
+            self.received.append(message)
+            output += self._handle(message)
+        return bytes(output)
+
+    def event(self, message: dict) -> bytes:
+        """Encode an unsolicited message (fingerprint scan, keypad entry, door status)"""
+        return self._encode(message)
+
+    def _encode(self, message: dict) -> bytes:
+        return encode_frame(message) if self.framing == "binary" else encode_line(message)
+
+    def _handle(self, message: dict) -> bytes:
+        cmd = message.get("cmd")
+        if cmd == "hello":
+            if not self.supports_binary:
+                return b""
+            accept = message.get("proto") == PROTOCOL_VERSION and message.get("framing") == "binary"
+            # The answer still goes out in the old framing, later messages in the new one
+            answer = self._encode({"status": "hello", "proto": PROTOCOL_VERSION, "framing": "binary" if accept else "json"})
+            self.framing = "binary" if accept else "json"
+            return answer
+        if cmd in ("unlock", "lock"):
+            self.door = "unlocked" if cmd == "unlock" else "locked"
+            return self._encode({"type": "status", "door": self.door})
+        if cmd == "enroll_fingerprint":
+            return self._encode({"status": "enrollment_started"})
+        if cmd == "delete_fingerprint":
+            fingerprint_id = message.get("id", 1)
+            if fingerprint_id in self.fingerprints:
+                self.fingerprints.discard(fingerprint_id)
+                return self._encode({"status": "fingerprint_deleted", "id": fingerprint_id})
+            return self._encode({"status": "delete_failed", "id": fingerprint_id})
+        if cmd == "list_fingerprints":
+            messages = [{"status": "listing_fingerprints"}]
+            messages += [{"fingerprint_found": fingerprint_id} for fingerprint_id in sorted(self.fingerprints)]
+            messages.append({"status": "listing_complete"})
+            return b"".join(self._encode(message) for message in messages)
+        if cmd == "clear_all_fingerprints":
+            self.fingerprints.clear()
+            return self._encode({"status": "all_fingerprints_cleared"})
+        # led, beep and display have no answer
+        return b""
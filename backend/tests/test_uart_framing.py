@@ -0,0 +1,131 @@
+import asyncio
+import unittest
+
+from services.uart_framing import (
+    MESSAGE_TYPES, PROTOCOL_VERSION, SOF, StreamDecoder, encode_frame, encode_line
+)
+from services.uart_requests import RequestTracker
+from tests.esp32_simulator import ESP32Simulator
+
+SAMPLE_VALUES = {"B": 7, "H": 1234, "s": "green", "v": 42}
+
+def sample_messages():
+    messages = []
+    for _, constants, fields in MESSAGE_TYPES:
+        messages.append({**constants, **{name: SAMPLE_VALUES[fmt] for name, fmt in fields}})
+    # String fingerprint ids, omitted trailing fields and shapes without a type code
+    messages += [
+        {"type": "fingerprint", "id": "A1B2"},
+        {"cmd": "unlock"},
+        {"cmd": "unlock", "duration": 300},
+        {"status": "hello", "proto": 1, "framing": "json", "extra": [1, 2]},
+        {"type": "rfid", "uid": "A1B2C3D4"},
+    ]
+    return messages
+
+def decode_in_chunks(data: bytes, size: int, decoder: StreamDecoder = None):
+    decoder = decoder or StreamDecoder()
+    messages = []
+    for start in range(0, len(data), size):
+        messages += decoder.feed(data[start:start + size])
+    return messages
+
+class FrameRoundTripTest(unittest.TestCase):
+    def test_every_message_round_trips(self):
+        messages = sample_messages()
+        stream = b"".join(encode_frame(message) for message in messages)
+        for size in (1, 3, 7, len(stream)):
+            with self.subTest(chunk=size):
+                self.assertEqual(decode_in_chunks(stream, size), messages)
+
+    def test_known_shapes_are_packed(self):
+        frame = encode_frame({"cmd": "led", "color": "green"})
+        # SOF, header, 1 length byte + 5 characters, CRC
+        self.assertEqual(len(frame), 2 + 4 + 6 + 2)
+        self.assertTrue(frame.startswith(SOF))
+
+class ResyncTest(unittest.TestCase):
+    def test_crc_error_skips_only_the_corrupt_frame(self):
+        first = bytearray(encode_frame({"cmd": "beep", "times": 2}))
+        first[-3] ^= 0xFF
+        stream = bytes(first) + encode_frame({"cmd": "lock"}) + encode_line({"type": "keypad", "password": "1234"})
+        for size in (1, 3, 7):
+            with self.subTest(chunk=size):
+                decoder = StreamDecoder()
+                messages = decode_in_chunks(stream, size, decoder)
+                self.assertEqual(messages, [{"cmd": "lock"}, {"type": "keypad", "password": "1234"}])
+                self.assertEqual(decoder.crc_errors, 1)
+
+    def test_noise_and_truncated_line_before_a_frame(self):
+        stream = b"boot: rst:0x1\n" + b'{"type": "sta' + encode_frame({"status": "listing_complete"})
+        decoder = StreamDecoder()
+        self.assertEqual(decode_in_chunks(stream, 3, decoder), [{"status": "listing_complete"}])
+        self.assertEqual(decoder.invalid, 2)
+
+class MixedStreamTest(unittest.TestCase):
+    def test_lines_and_frames_interleaved(self):
+        messages = sample_messages()
+        stream = b"".join(
+            encode_frame(message) if i % 2 else encode_line(message)
+            for i, message in enumerate(messages)
+        )
+        for size in (1, 3, 7):
+            with self.subTest(chunk=size):
+                self.assertEqual(decode_in_chunks(stream, size), messages)
+
+class HandshakeTest(unittest.TestCase):
+    def hello(self, simulator: ESP32Simulator, proto: int = PROTOCOL_VERSION):
+        """Run the backend side of the handshake against the simulator; returns the answer or None"""
+        async def run():
+            tracker = RequestTracker()
+            message = {"cmd": "hello", "proto": proto, "framing": "binary"}
+            request = tracker.register(message)
+            for answer in StreamDecoder().feed(simulator.feed(encode_line(message))):
+                tracker.feed(answer)
+            try:
+                return (await request.wait(0.1))["response"]
+            except TimeoutError:
+                return None
+        return asyncio.run(run())
+
+    def test_binary_accepted(self):
+        simulator = ESP32Simulator(fingerprints=[3, 5])
+        self.assertEqual(self.hello(simulator), {"status": "hello", "proto": PROTOCOL_VERSION, "framing": "binary"})
+
+        # Both sides now use frames
+        answer = simulator.feed(encode_frame({"cmd": "list_fingerprints"}))
+        self.assertTrue(answer.startswith(SOF))
+        self.assertEqual(StreamDecoder().feed(answer), [
+            {"status": "listing_fingerprints"},
+            {"fingerprint_found": 3},
+            {"fingerprint_found": 5},
+            {"status": "listing_complete"},
+        ])
+
+    def test_other_protocol_version_keeps_json(self):
+        simulator = ESP32Simulator()
+        response = self.hello(simulator, proto=PROTOCOL_VERSION + 1)
+        self.assertEqual(response["framing"], "json")
+        self.assertEqual(simulator.feed(encode_line({"cmd": "lock"})), encode_line({"type": "status", "door": "locked"}))
+
+    def test_firmware_without_handshake_does_not_answer(self):
+        simulator = ESP32Simulator(supports_binary=False)
+        self.assertIsNone(self.hello(simulator))
+        self.assertEqual(simulator.framing, "json")
+
+class SimulatorRequestTest(unittest.TestCase):
+    def test_delete_answers_are_matched_by_id(self):
+        async def run():
+            simulator = ESP32Simulator(fingerprints=[1, 2])
+            tracker = RequestTracker()
+            commands = [{"cmd": "delete_fingerprint", "id": i} for i in (1, 9, 2)]
+            requests = [tracker.register(command) for command in commands]
+            wire = simulator.feed(b"".join(encode_frame(command) for command in commands))
+            for message in decode_in_chunks(wire, 3):
+                tracker.feed(message)
+            return [(await request.wait(0.1))["ok"] for request in requests]
+
+        self.assertEqual(asyncio.run(run()), [True, False, True])
+
+if __name__ == "__main__":
+    unittest.main()